@@ -1,14 +1,28 @@
 import json
 import os
-import shutil
+import hashlib
 import logging
-from flask import Flask, request, render_template, redirect, url_for, flash, send_file, session, g
+from flask import (
+    Flask, Request, Response, request, make_response, render_template, redirect, url_for, flash, send_file, session, jsonify,
+    stream_with_context
+)
 from flask_session import Session
-from src.data import QueryData
+from src.data import QueryData, PARALLEL_PARSE_THRESHOLD
+from src.store import DatasetRegistry, DEFAULT_COMPACT_BYTES
+from src.columnar import ColumnarDataset
+from src.parsecache import DEFAULT_PARSE_CACHE_BYTES
+from src.janitor import Janitor, retire, DEFAULT_SWEEP_INTERVAL, DEFAULT_DELETES_PER_SECOND
+from src.cache import ResultCache, DEFAULT_RESULT_CACHE_BYTES
+from src.ingest import TsvUploadStream, UploadProgress, read_progress
 from src.utils import (
-    ensure_folders_exist, load_file, reset_session_and_globals,
-    get_search_params, filter_data, sort_data, prepare_table_data, get_sort_indicators,
-    generate_charts, process_form_fields, save_data_to_file, append_data_to_file, get_file_paths
+    ensure_folders_exist, reset_session_and_globals,
+    get_search_params, get_filtered_view, view_rows, select_rows, parse_sort_spec, format_sort_spec, prepare_table_data,
+    get_metadata_fields,
+    rows_after_cursor, encode_cursor, row_record, iter_ndjson, API_PAGE_LIMIT, MAX_API_PAGE_LIMIT,
+    get_sort_indicators, get_sort_links, get_page_window, PER_PAGE_OPTIONS,
+    get_chart_spec, generate_charts, process_form_fields, get_assignments, filter_indices,
+    parse_tsv_stream, check_schema,
+    iter_tsv, gzip_chunks, save_data_to_file, append_data_to_file, append_rows_to_file, get_file_paths
 )
 
 app = Flask(__name__)
@@ -16,15 +30,68 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'replace_with_strong_random_
 app.config['DATA_FOLDER'] = 'data'
 app.config['MODIFIED_FOLDER'] = 'modified'
 app.config['ADDED_FOLDER'] = 'added'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['DATASET_FOLDER'] = 'datasets'
+app.config['PROGRESS_FOLDER'] = 'progress'
+app.config['PARSE_CACHE_FOLDER'] = 'parse_cache'
+app.config['PINNED_DATASETS'] = [path for path in os.environ.get('PINNED_DATASETS', '').split(',') if path.strip()]
+app.config['DATASET_STORAGE'] = os.environ.get('DATASET_STORAGE', 'mmap')
+app.config['PARALLEL_PARSE_THRESHOLD'] = int(os.environ.get('PARALLEL_PARSE_THRESHOLD', PARALLEL_PARSE_THRESHOLD))
+app.config['PARSE_CACHE_BYTES'] = int(os.environ.get('PARSE_CACHE_BYTES', DEFAULT_PARSE_CACHE_BYTES))
+app.config['RESULT_CACHE_BYTES'] = int(os.environ.get('RESULT_CACHE_BYTES', DEFAULT_RESULT_CACHE_BYTES))
+app.config['JOURNAL_FSYNC'] = os.environ.get('JOURNAL_FSYNC', '1') != '0'
+app.config['JOURNAL_COMPACT_BYTES'] = int(os.environ.get('JOURNAL_COMPACT_BYTES', DEFAULT_COMPACT_BYTES))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SESSION_FILE_DIR'] = 'flask_session'
 app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+app.config['JANITOR_INTERVAL'] = int(os.environ.get('JANITOR_INTERVAL', DEFAULT_SWEEP_INTERVAL))
+app.config['JANITOR_DELETES_PER_SECOND'] = int(os.environ.get('JANITOR_DELETES_PER_SECOND', DEFAULT_DELETES_PER_SECOND))
+
+class UploadRequest(Request):
+    """Request that parses .tsv uploads while the body is still being received.
+
+    With the parse cache enabled uploads are only hashed while they arrive,
+    with progress counting bytes, so that a repeated file is loaded from its
+    snapshot without parsing.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename or not filename.lower().endswith('.tsv'):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        progress = None
+        upload_id = self.args.get('upload_id', '')
+        if upload_id.isalnum():
+            progress = UploadProgress(app.config['PROGRESS_FOLDER'], upload_id, total_content_length)
+        if self.endpoint == 'add_bulk':
+            return TsvUploadStream(app.config['DATA_FOLDER'], progress, sink=ColumnarDataset())
+        parse = registry.parse_cache is None and (
+            total_content_length is None or total_content_length < app.config['PARALLEL_PARSE_THRESHOLD']
+        )
+        return TsvUploadStream(app.config['DATA_FOLDER'], progress, sink=registry.new_sink() if parse else None)
+
+app.request_class = UploadRequest
 
 Session(app)
+registry = DatasetRegistry(app)
+view_cache = ResultCache(app.config['RESULT_CACHE_BYTES'])
+janitor = Janitor(app, registry)
+
+def preload_pinned_datasets():
+    """Load the PINNED_DATASETS files and build their indexes.
+
+    Run at import, so with gunicorn's preload_app the master loads them once
+    and every forked worker shares the pages instead of parsing again.
+    """
+    for path in app.config['PINNED_DATASETS']:
+        try:
+            registry.pin(path.strip())
+        except (OSError, ValueError) as e:
+            app.logger.error(f"Failed to pin dataset {path}: {str(e)}")
+
+preload_pinned_datasets()
 
 def setup_logging():
     """Configure logging with file and console handlers."""
@@ -44,20 +111,58 @@ def get_session_id():
         session['sid'] = os.urandom(16).hex()
     return session['sid']
 
+def get_dataset():
+    """Return the registry handle for the session's dataset, or None."""
+    dataset_id = session.get('dataset_id')
+    if not dataset_id:
+        return None
+    dataset = registry.get(dataset_id, session.get('dataset_version', 0))
+    if dataset is not None:
+        janitor.touch(os.path.join(app.config['DATASET_FOLDER'], dataset_id),
+                      os.path.join(app.config['DATA_FOLDER'], get_session_id()))
+    return dataset
+
+def dataset_etag(*parts):
+    """Return an ETag for the session's dataset version, the endpoint and its arguments.
+
+    Returns None without a dataset, including one dropped or expired since the
+    client cached its page, so that the request falls through to get_dataset.
+    """
+    if not session.get('dataset_id') or not registry.exists(session['dataset_id']):
+        return None
+    key = json.dumps([
+        session['dataset_id'], session.get('dataset_version', 0), request.endpoint,
+        sorted(request.args.items(multi=True)), *parts
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds the current representation, else None."""
+    if etag and request.if_none_match.contains(etag) and not session.get('_flashes'):
+        app.logger.info(f"Not modified: {request.path}")
+        return with_etag(Response(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    """Attach an ETag and require revalidation before the browser reuses the response."""
+    response = make_response(response)
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 def cleanup_session_files(session_id):
-    """Delete temporary files for the given session ID."""
+    """Retire the temporary folders of the given session ID to the trash, where the janitor deletes them."""
     if session_id:
         for folder in [app.config['DATA_FOLDER'], app.config['MODIFIED_FOLDER'], app.config['ADDED_FOLDER']]:
             user_folder = os.path.join(folder, session_id)
             if os.path.exists(user_folder):
-                shutil.rmtree(user_folder)
+                retire(user_folder)
 
-@app.teardown_appcontext
-def cleanup_on_shutdown(exception=None):
-    """Clean up session files on app shutdown or session expiry."""
-    session_id = g.get('session_id')
-    if session_id:
-        cleanup_session_files(session_id)
+@app.before_request
+def start_janitor():
+    """Start this worker's janitor thread, which expires session files after PERMANENT_SESSION_LIFETIME."""
+    janitor.start()
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -69,11 +174,14 @@ def index():
     user_modified_folder = os.path.normpath(os.path.join(app.config['MODIFIED_FOLDER'], session_id))
     user_added_folder = os.path.normpath(os.path.join(app.config['ADDED_FOLDER'], session_id))
     ensure_folders_exist(app, folders=[user_data_folder, user_modified_folder, user_added_folder])
-    g.session_id = session_id
     
     if request.method == 'POST':
         cleanup_session_files(session_id)
-        session.pop('data', None)
+        if session.get('dataset_id'):
+            registry.drop(session['dataset_id'])
+            view_cache.drop(session['dataset_id'])
+        session.pop('dataset_id', None)
+        session.pop('dataset_version', None)
         session.pop('selected_file_name', None)
         session.pop('data_loaded', None)
         session.pop('has_added_data', None)
@@ -102,12 +210,18 @@ def index():
         app.logger.info(f"Attempting to save uploaded file for session {session_id}: {filepath}")
         try:
             os.makedirs(user_data_folder, exist_ok=True)
-            file.save(filepath)
+            upload = file.stream if isinstance(file.stream, TsvUploadStream) else None
+            if upload is not None:
+                upload.save(filepath)
+            else:
+                file.save(filepath)
             if not os.path.exists(filepath):
                 app.logger.error(f"File save failed: {filepath} does not exist")
                 raise OSError(f"Failed to save file: {filepath}")
             app.logger.info(f"File saved successfully: {filepath}")
-            session['data'] = [d.to_dict() for d in load_file(filepath, app)]
+            dataset = registry.create(filepath, upload=upload)
+            session['dataset_id'] = dataset.dataset_id
+            session['dataset_version'] = dataset.version
             reset_session_and_globals()
             session['selected_file_name'] = filename
             flash('File uploaded and loaded successfully!', 'success')
@@ -121,10 +235,28 @@ def index():
     app.logger.debug("Rendering index page")
     return render_template('index.html', data_loaded=session.get('data_loaded', False))
 
+@app.route('/upload_progress/<upload_id>')
+def upload_progress(upload_id):
+    """Report rows parsed and bytes read for an upload that is still streaming."""
+    progress = read_progress(app.config['PROGRESS_FOLDER'], upload_id)
+    if progress is None:
+        return jsonify({'state': 'unknown'}), 404
+    return jsonify(progress)
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Report hit, miss and eviction counters of the filtered view cache."""
+    return jsonify(view_cache.stats())
+
 @app.route('/data')
 def data_table():
     """Display filtered and sorted data table."""
-    data = [QueryData.from_dict(d) for d in session.get('data', [])]
+    etag = dataset_etag(session.get('has_added_data', False))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    data = get_dataset()
     if not data:
         app.logger.warning("No data loaded for data table")
         return redirect(url_for('index'))
@@ -135,73 +267,146 @@ def data_table():
     except ValueError:
         page = 1
         per_page = 10
-    if per_page not in [10, 25, 50]:
+    if per_page not in PER_PAGE_OPTIONS:
         per_page = 10
     
     search_params = get_search_params()
-    filtered_data = filter_data(data, search_params, app)
+    sort_spec = parse_sort_spec(request.args.get('sort', ''), get_metadata_fields(data))
+    view = get_filtered_view(data, search_params, sort_spec, view_cache)
+    total_rows = view.count
     
     app.logger.info(f"Search terms: question_intent='{search_params['question_intent']}', "
-                   f"sub_intent='{search_params['sub_intent']}', segment='{search_params['segment']}'")
-    app.logger.info(f"Filtered {len(filtered_data)} of {len(data)} rows")
-    if not filtered_data and data:
+                   f"sub_intent='{search_params['sub_intent']}', segment='{search_params['segment']}', "
+                   f"text='{search_params['text']}'")
+    app.logger.info(f"Filtered {total_rows} of {len(data)} rows")
+    if not total_rows and data:
         app.logger.debug(f"Sample metadata (first 3 rows): {[item.metadata for item in data[:3]]}")
     
-    column = request.args.get('sort')
-    filtered_data = sort_data(filtered_data, column, app)
-    
-    total_rows = len(filtered_data)
     total_pages = (total_rows + per_page - 1) // per_page
     page = max(1, min(page, total_pages))
     start_idx = (page - 1) * per_page
     end_idx = min(start_idx + per_page, total_rows)
     
-    paginated_data = filtered_data[start_idx:end_idx]
+    page_indices = view_rows(data, view, sort_spec, start_idx, end_idx)
+    sort = format_sort_spec(sort_spec)
     
-    table_data = prepare_table_data(paginated_data, start_idx)
-    sort_indicators = get_sort_indicators()
+    table_data = prepare_table_data([data[i] for i in page_indices], start_idx, indices=page_indices)
+    sort_indicators = get_sort_indicators(sort_spec)
     
     pagination = {
         'page': page,
         'per_page': per_page,
         'total_pages': total_pages,
         'total_rows': total_rows,
+        'window': get_page_window(page, total_pages),
+        'options': PER_PAGE_OPTIONS,
         'start_row': start_idx + 1,
         'end_row': end_idx
     }
     
     app.logger.debug("Rendering data table page")
-    return render_template(
+    return with_etag(render_template(
         'data.html',
         data=table_data,
         sort_indicators=sort_indicators,
+        sort=sort,
+        sort_links=get_sort_links(sort_spec),
+        page_args=dict(search_params, per_page=per_page, sort=sort),
         search_params=search_params,
+        metadata_fields=sorted(data[0].metadata.keys()),
         total_rows=len(data),
-        filtered_rows=len(filtered_data),
+        filtered_rows=total_rows,
         pagination=pagination
-    )
+    ), etag)
+
+@app.route('/data/bulk_edit', methods=['POST'])
+def bulk_edit():
+    """Set metadata fields on every row matching the current filter as one change."""
+    data = get_dataset()
+    if not data:
+        app.logger.warning("No data loaded for bulk edit")
+        return redirect(url_for('index'))
+    
+    try:
+        assignments = get_assignments(sorted(data[0].metadata.keys()))
+        if not assignments:
+            raise ValueError("No field to set")
+        indices = filter_indices(data, get_search_params())
+        changed, session['dataset_version'] = registry.assign_metadata(data, indices, assignments)
+        app.logger.info(f"Bulk edit set {assignments} on {changed} of {len(indices)} matching rows for session {get_session_id()}")
+        flash(f'Updated {changed} of {len(indices)} matching rows', 'success')
+    except Exception as e:
+        app.logger.error(f"Failed to update rows: {str(e)}")
+        flash(f'Failed to update rows: {str(e)}', 'error')
+    return redirect(url_for('data_table', **request.args))
+
+@app.route('/api/rows')
+def api_rows():
+    """Return filtered, sorted rows as a JSON page with a keyset cursor, or as streamed NDJSON."""
+    data = get_dataset()
+    if not data:
+        return jsonify({'error': 'No data loaded'}), 404
+    
+    search_params = get_search_params()
+    sort_spec = parse_sort_spec(request.args.get('sort', ''), get_metadata_fields(data))
+    view = get_filtered_view(data, search_params, sort_spec, view_cache)
+    cursor = request.args.get('cursor', '')
+    try:
+        bits = rows_after_cursor(data, view.bits, sort_spec, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    remaining = bits.bit_count()
+    
+    if request.args.get('format') == 'ndjson':
+        indices = view.order if view.order is not None and not cursor else select_rows(data, bits, sort_spec, 0, remaining)
+        app.logger.info(f"Streaming {remaining} rows as NDJSON")
+        return Response(stream_with_context(iter_ndjson(data, indices)), mimetype='application/x-ndjson')
+    
+    try:
+        limit = int(request.args.get('limit', API_PAGE_LIMIT))
+    except ValueError:
+        limit = API_PAGE_LIMIT
+    limit = max(1, min(limit, MAX_API_PAGE_LIMIT))
+    if cursor:
+        indices = select_rows(data, bits, sort_spec, 0, limit)
+    else:
+        indices = view_rows(data, view, sort_spec, 0, limit)
+    return jsonify({
+        'rows': [row_record(data, index) for index in indices],
+        'total': view.count,
+        'next_cursor': encode_cursor(data, sort_spec, indices[-1]) if remaining > len(indices) else None
+    })
 
 @app.route('/charts')
 def charts():
     """Render charts page with pie and stacked bar charts."""
-    data = [QueryData.from_dict(d) for d in session.get('data', [])]
+    etag = dataset_etag()
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    data = get_dataset()
     if not data:
         app.logger.warning("No data available for charts")
         return render_template('charts.html', error="No data available")
     
-    pie_chart, bar_chart = generate_charts(data, app)
+    chart_spec = get_chart_spec(get_metadata_fields(data))
+    search_params = get_search_params()
+    pie_chart, bar_chart = generate_charts(data, app, chart_spec, search_params)
     app.logger.debug("Rendering charts page")
-    return render_template(
+    return with_etag(render_template(
         'charts.html',
         pie_chart=pie_chart,
-        bar_chart=bar_chart
-    )
+        bar_chart=bar_chart,
+        chart_spec=chart_spec,
+        search_params=search_params
+    ), etag)
 
 @app.route('/edit/<int:index>', methods=['GET', 'POST'])
 def edit(index):
     """Handle editing of a data point."""
-    data = [QueryData.from_dict(d) for d in session.get('data', [])]
-    if index >= len(data):
+    data = get_dataset()
+    if data is None or index >= len(data):
         app.logger.error(f"Invalid data point index: {index}")
         flash('Invalid data point', 'error')
         return redirect(url_for('data_table'))
@@ -212,10 +417,11 @@ def edit(index):
     
     if request.method == 'POST':
         try:
-            data_point.query[0] = process_form_fields(query_fields, 'query')
-            data_point.metadata = process_form_fields(metadata_fields, 'metadata')
+            new_query = list(data_point.query)
+            new_query[0] = process_form_fields(query_fields, 'query')
+            new_metadata = process_form_fields(metadata_fields, 'metadata')
             
-            session['data'] = [d.to_dict() for d in data]
+            session['dataset_version'] = registry.update_row(data, index, QueryData(new_query, new_metadata))
             app.logger.info(f"Data point {index} updated successfully for session {get_session_id()}")
             flash('Changes saved!', 'success')
             return redirect(url_for('data_table'))
@@ -239,7 +445,7 @@ def edit(index):
 @app.route('/add', methods=['GET', 'POST'])
 def add():
     """Handle adding a new data point."""
-    data = [QueryData.from_dict(d) for d in session.get('data', [])]
+    data = get_dataset()
     selected_file_name = session.get('selected_file_name')
     if not data:
         app.logger.warning("No data loaded for adding new data point")
@@ -256,14 +462,13 @@ def add():
             new_metadata = process_form_fields(metadata_fields, 'metadata')
             
             new_data_point = QueryData(query=[new_query], metadata=new_metadata)
-            data.append(new_data_point)
             
             session_id = get_session_id()
             original_name = os.path.splitext(selected_file_name)[0]
             added_filename, added_filepath = get_file_paths(original_name, 'ADDED_FOLDER', app, session_id)
             append_data_to_file(added_filepath, new_data_point)
             
-            session['data'] = [d.to_dict() for d in data]
+            session['dataset_version'] = registry.append_row(data, new_data_point)
             session['has_added_data'] = True
             app.logger.info(f"New data point added for session {session_id}, saved to {added_filename}")
             flash('New data point added!', 'success')
@@ -284,11 +489,59 @@ def add():
         metadata_data=metadata_data
     )
 
+@app.route('/add_bulk', methods=['POST'])
+def add_bulk():
+    """Merge an uploaded TSV of new data points into the loaded dataset in one change."""
+    data = get_dataset()
+    selected_file_name = session.get('selected_file_name')
+    if not data:
+        app.logger.warning("No data loaded for bulk add")
+        flash('Please load a dataset first', 'error')
+        return redirect(url_for('index'))
+    
+    file = request.files.get('tsv_file')
+    if file is None or not file.filename.lower().endswith('.tsv'):
+        app.logger.warning("No .tsv file uploaded for bulk add")
+        flash('Please upload a .tsv file', 'error')
+        return redirect(url_for('add'))
+    
+    try:
+        upload = file.stream if isinstance(file.stream, TsvUploadStream) else None
+        rows = upload.finish() if upload is not None else parse_tsv_stream(file.stream)
+        if not len(rows):
+            raise ValueError("No data points in file")
+        check_schema(rows, data)
+        
+        session_id = get_session_id()
+        original_name = os.path.splitext(selected_file_name)[0]
+        added_filename, added_filepath = get_file_paths(original_name, 'ADDED_FOLDER', app, session_id)
+        append_rows_to_file(added_filepath, rows)
+        
+        session['dataset_version'] = registry.append_rows(data, rows)
+        session['has_added_data'] = True
+        app.logger.info(f"Added {len(rows)} data points for session {session_id}, saved to {added_filename}")
+        flash(f'Added {len(rows)} data points!', 'success')
+        return redirect(url_for('data_table'))
+    except Exception as e:
+        app.logger.error(f"Failed to add data points: {str(e)}")
+        flash(f'Failed to add data points: {str(e)}', 'error')
+        return redirect(url_for('add'))
+
 @app.route('/download')
 def download():
-    """Serve the modified data file for download."""
-    data = [QueryData.from_dict(d) for d in session.get('data', [])]
+    """Stream the modified data for download, gzip-compressed when the client accepts it.
+
+    Range requests, such as a resumed download, are served from an export
+    file written once per dataset version.
+    """
     selected_file_name = session.get('selected_file_name')
+    use_gzip = request.range is None and request.accept_encodings['gzip'] > 0
+    etag = dataset_etag(selected_file_name, 'gzip' if use_gzip else 'identity')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    data = get_dataset()
     if not data:
         app.logger.warning("No data available for download")
         flash('No data to download', 'error')
@@ -302,11 +555,26 @@ def download():
     session_id = get_session_id()
     original_name = os.path.splitext(selected_file_name)[0]
     output_filename, filepath = get_file_paths(original_name, 'MODIFIED_FOLDER', app, session_id)
+    exported = session.get('exported_etag') == etag and os.path.exists(filepath)
     
-    save_data_to_file(filepath, data)
+    if use_gzip or not (exported or request.range):
+        app.logger.info(f"Streaming download for session {session_id}: {output_filename}, gzip={use_gzip}")
+        body = iter_tsv(data)
+        response = Response(gzip_chunks(body) if use_gzip else body,
+                            mimetype='text/tab-separated-values')
+        response.headers.set('Content-Disposition', 'attachment', filename=output_filename)
+        response.headers['Vary'] = 'Accept-Encoding'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.headers['Accept-Ranges'] = 'bytes'
+        return with_etag(response, etag)
     
+    if not exported:
+        save_data_to_file(filepath, data)
+        session['exported_etag'] = etag
     app.logger.info(f"Serving download file for session {session_id}: {output_filename}")
-    return send_file(filepath, as_attachment=True, download_name=output_filename)
+    return with_etag(send_file(filepath, as_attachment=True, download_name=output_filename, etag=etag), etag)
 
 @app.route('/download_added')
 def download_added():
@@ -1,2 +1,12 @@
+import gc
+import os
+
 bind = "0.0.0.0:8000"
-workers = 4
\ No newline at end of file
+workers = 4
+# Preload only when there are pinned datasets for the workers to share, unless PRELOAD_APP says otherwise.
+pinned = bool(os.environ.get('PINNED_DATASETS', '').strip(' ,'))
+preload_app = os.environ.get('PRELOAD_APP', '1' if pinned else '0') != '0'
+
+def pre_fork(server, worker):
+    """Freeze the objects the preloaded app allocated, so the collector does not touch their pages and workers keep sharing them."""
+    gc.freeze()
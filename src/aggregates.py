@@ -0,0 +1,183 @@
+from collections import Counter
+from src.columns import display_value
+from src.bitmaps import bitmap_to_indices
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHART_FIELDS = ('segment',)
+CHART_PAIRS = (('question_intent', 'sub_intent'),)
+OTHER_LABEL = 'Other'
+
+def _codes_array(column):
+    return np.frombuffer(column.codes, dtype=f'u{column.codes.itemsize}')
+
+def _bitmap_mask(bits, size):
+    data = np.frombuffer(bits.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, bitorder='little')[:size].view(bool)
+
+def count_values(column, bits=None):
+    """Return a Counter of code to row count for a column, optionally over the rows of a bitset only."""
+    if np is not None and len(column.codes):
+        codes = _codes_array(column)
+        if bits is not None:
+            codes = codes[_bitmap_mask(bits, len(codes))]
+        counts = np.bincount(codes, minlength=len(column.values))
+        return Counter({int(code): int(counts[code]) for code in np.flatnonzero(counts)})
+    if bits is None:
+        return Counter(column.codes)
+    return Counter(map(column.codes.__getitem__, bitmap_to_indices(bits)))
+
+def crosstab(first, second, bits=None):
+    """Return a Counter of (first code, second code) to row count, optionally over the rows of a bitset only."""
+    if np is not None and len(first.codes):
+        first_codes, second_codes = _codes_array(first).astype(np.int64), _codes_array(second)
+        if bits is not None:
+            mask = _bitmap_mask(bits, len(first_codes))
+            first_codes, second_codes = first_codes[mask], second_codes[mask]
+        width = len(second.values)
+        combined = first_codes * width + second_codes
+        if len(first.values) * width <= 4 * len(combined) + 1024:
+            counts = np.bincount(combined, minlength=len(first.values) * width)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(combined, return_counts=True)
+        return Counter({(int(key) // width, int(key) % width): int(count) for key, count in zip(keys, counts)})
+    if bits is None:
+        return Counter(zip(first.codes, second.codes))
+    indices = bitmap_to_indices(bits)
+    return Counter(zip(map(first.codes.__getitem__, indices), map(second.codes.__getitem__, indices)))
+
+def display_counts(column, code_counts):
+    """Convert code counts to a Counter of display value to row count, in vocabulary order."""
+    counter = Counter()
+    for code, count in sorted(code_counts.items()):
+        if count:
+            counter[display_value(column.values[code])] += count
+    return counter
+
+def display_pairs(first, second, pair_counts):
+    """Convert pair counts to {first display value: Counter of second display value to row count}."""
+    pair_map = {}
+    for (first_code, second_code), count in sorted(pair_counts.items()):
+        if count:
+            first_value = display_value(first.values[first_code])
+            pair_map.setdefault(first_value, Counter())[display_value(second.values[second_code])] += count
+    return pair_map
+
+def top_k(counter, k, other=OTHER_LABEL):
+    """Keep the k largest counts of a Counter, in their original order, and sum the rest into an 'Other' bucket."""
+    if not k or len(counter) <= k:
+        return counter
+    keep = {value for value, _ in counter.most_common(k)}
+    result = Counter({value: count for value, count in counter.items() if value in keep})
+    result[other] += sum(count for value, count in counter.items() if value not in keep)
+    return result
+
+def top_k_pairs(pair_map, k, other=OTHER_LABEL):
+    """Keep the k largest first values and the k largest second values of a cross-tab, folding the rest into 'Other'."""
+    if not k:
+        return pair_map
+    first_totals = Counter({first: sum(counter.values()) for first, counter in pair_map.items()})
+    second_totals = Counter()
+    for counter in pair_map.values():
+        second_totals.update(counter)
+    keep_first = set(top_k(first_totals, k))
+    keep_second = set(top_k(second_totals, k))
+    result = {}
+    for first, counter in pair_map.items():
+        target = result.setdefault(first if first in keep_first else other, Counter())
+        for second, count in counter.items():
+            target[second if second in keep_second else other] += count
+    return result
+
+class ChartAggregates:
+    """Value counts and pair counts over a dataset's categorical columns, kept current row by row.
+
+    Counts for a field or pair are computed once, on first use, with
+    count_values or crosstab. An edit moves a row's count from its old values
+    to its new ones and an append adds one, so unfiltered charts are read from
+    the counts without scanning any rows.
+    """
+
+    def __init__(self, columns, fields=CHART_FIELDS, pairs=CHART_PAIRS):
+        self.columns = columns
+        self.counts = {}
+        self.pair_counts = {}
+        for field in fields:
+            self.track(field)
+        for first, second in pairs:
+            self.track_pair(first, second)
+
+    def copy(self, columns):
+        """Return aggregates over another dict of the same columns, with their own counters."""
+        aggregates = ChartAggregates(columns, fields=(), pairs=())
+        aggregates.counts = {field: Counter(counter) for field, counter in self.counts.items()}
+        aggregates.pair_counts = {pair: Counter(counter) for pair, counter in self.pair_counts.items()}
+        return aggregates
+
+    def track(self, field):
+        """Start maintaining the value counts of a column."""
+        if field not in self.counts:
+            self.counts[field] = count_values(self.columns[field])
+
+    def track_pair(self, first, second):
+        """Start maintaining the pair counts of two columns."""
+        if (first, second) not in self.pair_counts:
+            self.pair_counts[(first, second)] = crosstab(self.columns[first], self.columns[second])
+
+    def row_changing(self, index):
+        """Counts are moved in row_changed from the codes it is given."""
+
+    def row_changed(self, index, changes, row):
+        """Move an edited row's counts to its new values, or count an appended row."""
+        for field, counter in self.counts.items():
+            old_code, new_code = changes[field]
+            if old_code == new_code:
+                continue
+            if old_code is not None:
+                counter[old_code] -= 1
+            counter[new_code] += 1
+        for (first, second), counter in self.pair_counts.items():
+            (old_first, new_first), (old_second, new_second) = changes[first], changes[second]
+            if (old_first, old_second) == (new_first, new_second):
+                continue
+            if old_first is not None:
+                counter[(old_first, old_second)] -= 1
+            counter[(new_first, new_second)] += 1
+
+    def rows_appended(self, start, rows):
+        """Count a batch of rows appended from index start."""
+        for field, counter in self.counts.items():
+            counter.update(self.columns[field].codes[start:])
+        for (first, second), counter in self.pair_counts.items():
+            counter.update(zip(self.columns[first].codes[start:], self.columns[second].codes[start:]))
+
+    def rows_changed(self, indices, old_codes):
+        """Move the counts of a batch of edited rows, given their previous codes per changed field."""
+        for field, counter in self.counts.items():
+            if field in old_codes:
+                codes = self.columns[field].codes
+                counter.subtract(old_codes[field])
+                counter.update(codes[index] for index in indices)
+        for (first, second), counter in self.pair_counts.items():
+            if first in old_codes or second in old_codes:
+                first_codes, second_codes = self.columns[first].codes, self.columns[second].codes
+                new_pairs = [(first_codes[index], second_codes[index]) for index in indices]
+                old_first = old_codes.get(first) or [pair[0] for pair in new_pairs]
+                old_second = old_codes.get(second) or [pair[1] for pair in new_pairs]
+                counter.subtract(zip(old_first, old_second))
+                counter.update(new_pairs)
+
+    def value_counts(self, field):
+        """Return a Counter of display value to row count, in vocabulary order."""
+        self.track(field)
+        return display_counts(self.columns[field], self.counts[field])
+
+    def pair_map(self, first, second):
+        """Return {first display value: Counter of second display value to row count}."""
+        self.track_pair(first, second)
+        return display_pairs(self.columns[first], self.columns[second], self.pair_counts[(first, second)])
@@ -0,0 +1,310 @@
+import re
+from itertools import groupby
+from src.columns import display_value, sort_key
+
+FILTER_FIELDS = ('question_intent', 'sub_intent', 'segment')
+SELECT_CHUNK_BYTES = 1024
+SELECT_BLOCK_BYTES = 256
+MAX_BITMAP_VALUES = 1024
+
+_NONZERO_BYTE = re.compile(rb'[^\x00]')
+_BIT_POSITIONS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+def indices_to_bitmap(indices, size):
+    """Build an int bitset with the given row indices set."""
+    buf = bytearray((size + 7) // 8)
+    for i in indices:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+def _bitmap_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+def _byte_indices(data, start, stop, offset=0):
+    result = []
+    for match in _NONZERO_BYTE.finditer(data, start, stop):
+        position = match.start()
+        base = (offset + position) * 8
+        result.extend(base + bit for bit in _BIT_POSITIONS[data[position]])
+    return result
+
+def bitmap_to_indices(bits):
+    """Return the set bits of an int bitset as an ascending list of row indices."""
+    data = _bitmap_bytes(bits)
+    return _byte_indices(data, 0, len(data))
+
+def _select_bytes(data, skip, limit, offset):
+    """Return up to limit set-bit row indices of data after skipping its first skip set bits.
+
+    Blocks of bytes before the skipped bits are passed over by population
+    count, and decoding stops as soon as limit indices are found.
+    """
+    result = []
+    for block_start in range(0, len(data), SELECT_BLOCK_BYTES):
+        block = data[block_start:block_start + SELECT_BLOCK_BYTES]
+        count = int.from_bytes(block, 'little').bit_count()
+        if count <= skip:
+            skip -= count
+            continue
+        for match in _NONZERO_BYTE.finditer(block):
+            position = match.start()
+            positions = _BIT_POSITIONS[block[position]]
+            if len(positions) <= skip:
+                skip -= len(positions)
+                continue
+            base = (offset + block_start + position) * 8
+            result.extend(base + bit for bit in positions[skip:])
+            skip = 0
+            if len(result) >= limit:
+                return result[:limit]
+    return result
+
+def bitmap_select(bits, start, stop):
+    """Return the row indices of the start-th up to the stop-th set bits.
+
+    The bitset is read in windows that double in size from
+    SELECT_CHUNK_BYTES, each cut out of the int without converting the rest
+    to bytes. Windows that end before start are skipped by population count,
+    so the first pages cost a few small windows and any page at most a few
+    passes over the bitset, plus the size of the page.
+    """
+    result = []
+    limit = stop - start
+    seen = 0
+    offset = 0
+    size = SELECT_CHUNK_BYTES
+    total = (bits.bit_length() + 7) // 8
+    while offset < total and len(result) < limit:
+        window = (bits >> (offset * 8) if offset else bits) & ((1 << (size * 8)) - 1)
+        count = window.bit_count()
+        if seen + count > start:
+            data = window.to_bytes(size, 'little')
+            result.extend(_select_bytes(data, max(0, start - seen), limit - len(result), offset))
+        seen += count
+        offset += size
+        size *= 2
+    return result
+
+class FilterIndex:
+    """Per-field bitmaps over a dataset's categorical metadata columns.
+
+    Each field keeps the normalized (stripped, lowercased) display string of
+    every distinct value and an int bitset of the rows holding that value. A
+    search term is matched once per distinct value, and the bitsets of the
+    matching values are OR-ed together and AND-ed across fields. Walking the
+    value bitsets in sort-key order gives each field's sort permutation, so a
+    sorted, filtered page is read without sorting any rows.
+    """
+
+    def __init__(self, columns, size, fields=FILTER_FIELDS):
+        self.columns = columns
+        self.size = size
+        self.fields = fields
+        self.normalized = {}
+        self.bitmaps = {}
+        self._groups = {}
+        for field in fields:
+            self._build_field(field)
+
+    def copy(self, columns):
+        """Return an index over another dict of the same columns that shares the bitsets but not the containers."""
+        index = FilterIndex(columns, self.size, fields=())
+        index.fields = self.fields
+        index.normalized = {field: list(values) for field, values in self.normalized.items()}
+        index.bitmaps = {field: list(bitmaps) for field, bitmaps in self.bitmaps.items()}
+        index._groups = dict(self._groups)
+        return index
+
+    def ensure_field(self, field):
+        """Build the value bitsets of another column unless it has too many distinct values.
+
+        Returns whether the field has bitsets. Each bitset can be as large as
+        the dataset, so high-cardinality fields such as scores are sorted
+        without them.
+        """
+        if field in self.bitmaps:
+            return True
+        if len(self.columns[field].values) > MAX_BITMAP_VALUES:
+            return False
+        self._build_field(field)
+        return True
+
+    def _build_field(self, field):
+        column = self.columns[field]
+        postings = [[] for _ in column.values]
+        for row, code in enumerate(column.codes):
+            postings[code].append(row)
+        self.normalized[field] = [display_value(value).strip().lower() for value in column.values]
+        self.bitmaps[field] = [indices_to_bitmap(rows, self.size) for rows in postings]
+
+    def _ensure_value(self, field, code):
+        values = self.columns[field].values
+        while len(self.normalized[field]) < len(values):
+            self.normalized[field].append(display_value(values[len(self.normalized[field])]).strip().lower())
+            self.bitmaps[field].append(0)
+
+    def row_changing(self, index):
+        """Edits are applied in row_changed from the codes it is given."""
+
+    def row_changed(self, index, changes, row):
+        """Move a row between value bitsets after it was edited or appended."""
+        if index >= self.size:
+            self.size = index + 1
+        for field, (old_code, new_code) in changes.items():
+            if field not in self.bitmaps or old_code == new_code:
+                continue
+            self._ensure_value(field, new_code)
+            bitmaps = self.bitmaps[field]
+            if old_code is not None:
+                bitmaps[old_code] &= ~(1 << index)
+            bitmaps[new_code] |= 1 << index
+
+    def rows_appended(self, start, rows):
+        """Add a batch of rows appended from index start, with one bitset update per value."""
+        self.size = start + len(rows)
+        for field, bitmaps in self.bitmaps.items():
+            self._ensure_value(field, None)
+            codes = self.columns[field].codes
+            postings = {}
+            for index in range(start, self.size):
+                postings.setdefault(codes[index], []).append(index)
+            for code, indices in postings.items():
+                bitmaps[code] |= indices_to_bitmap(indices, self.size)
+
+    def rows_changed(self, indices, old_codes):
+        """Move a batch of edited rows between value bitsets, given their previous codes per changed field."""
+        moved = indices_to_bitmap(indices, self.size)
+        for field, codes in old_codes.items():
+            if field not in self.bitmaps:
+                continue
+            self._ensure_value(field, None)
+            bitmaps = self.bitmaps[field]
+            for code in set(codes):
+                bitmaps[code] &= ~moved
+            new_codes = self.columns[field].codes
+            postings = {}
+            for index in indices:
+                postings.setdefault(new_codes[index], []).append(index)
+            for code, rows in postings.items():
+                bitmaps[code] |= moved if len(rows) == len(indices) else indices_to_bitmap(rows, self.size)
+
+    def match_term(self, field, term):
+        """Return the bitset of rows whose field contains the search term."""
+        bits = 0
+        for code, value in enumerate(self.normalized[field]):
+            if term in value:
+                bits |= self.bitmaps[field][code]
+        return bits
+
+    def match(self, search_params):
+        """Return the bitset of rows matching every non-empty search parameter."""
+        bits = (1 << self.size) - 1
+        for field in self.fields:
+            term = search_params.get(field)
+            if term:
+                bits &= self.match_term(field, term)
+                if not bits:
+                    break
+        return bits
+
+    def _sort_groups(self, field):
+        values = self.columns[field].values
+        cached = self._groups.get(field)
+        if cached is None or cached[0] != len(values):
+            codes = sorted(range(len(values)), key=lambda code: sort_key(values[code]))
+            groups = [list(group) for _, group in groupby(codes, key=lambda code: sort_key(values[code]))]
+            cached = self._groups[field] = (len(values), groups)
+        return cached[1]
+
+    def _select_sorted(self, bits, sort_spec, start, stop, seen, result):
+        if not sort_spec:
+            result.extend(bitmap_select(bits, max(0, start - seen), stop - seen))
+            return seen + bits.bit_count()
+        field, reverse = sort_spec[0]
+        groups = self._sort_groups(field)
+        bitmaps = self.bitmaps[field]
+        remaining = bits
+        for codes in (reversed(groups) if reverse else groups):
+            group_bits = bitmaps[codes[0]]
+            for code in codes[1:]:
+                group_bits |= bitmaps[code]
+            group_bits &= remaining
+            if not group_bits:
+                continue
+            remaining ^= group_bits
+            count = group_bits.bit_count()
+            if seen + count > start:
+                seen = self._select_sorted(group_bits, sort_spec[1:], start, stop, seen, result)
+            else:
+                seen += count
+            if seen >= stop or not remaining:
+                break
+        return seen
+
+    def _sort_indices(self, bits, sort_spec):
+        indices = bitmap_to_indices(bits)
+        for field, reverse in reversed(sort_spec):
+            ranks = [0] * len(self.columns[field].values)
+            for rank, codes in enumerate(self._sort_groups(field)):
+                for code in codes:
+                    ranks[code] = rank
+            codes = self.columns[field].codes
+            indices.sort(key=lambda i: ranks[codes[i]], reverse=reverse)
+        return indices
+
+    def select_sorted(self, bits, sort_spec, start=0, stop=None):
+        """Return the start-th up to the stop-th rows of a bitset ordered by a sort spec.
+
+        sort_spec is a list of (field, reverse) pairs over columns of the
+        dataset. Ties keep row order in either direction. When every field has
+        bitsets, groups that end before start are skipped by population count;
+        otherwise the matching rows are sorted by their value ranks.
+        """
+        if stop is None:
+            stop = bits.bit_count()
+        if start >= stop:
+            return []
+        if not all(field in self.bitmaps for field, _ in sort_spec):
+            return self._sort_indices(bits, sort_spec)[start:stop]
+        result = []
+        self._select_sorted(bits, list(sort_spec), start, stop, 0, result)
+        return result
+
+    def _split_by_key(self, field, key, reverse):
+        """Return bitsets of the rows whose field sorts after, and equal to, a sort key."""
+        values = self.columns[field].values
+        later_codes, equal_codes = set(), set()
+        for code, value in enumerate(values):
+            value_key = sort_key(value)
+            if value_key == key:
+                equal_codes.add(code)
+            elif (value_key < key) if reverse else (value_key > key):
+                later_codes.add(code)
+        if field in self.bitmaps:
+            bitmaps = self.bitmaps[field]
+            later = equal = 0
+            for code in later_codes:
+                later |= bitmaps[code]
+            for code in equal_codes:
+                equal |= bitmaps[code]
+            return later, equal
+        codes = self.columns[field].codes
+        later = [row for row, code in enumerate(codes) if code in later_codes]
+        equal = [row for row, code in enumerate(codes) if code in equal_codes]
+        return indices_to_bitmap(later, self.size), indices_to_bitmap(equal, self.size)
+
+    def after(self, bits, sort_spec, keys, last_index):
+        """Return the rows of a bitset that come after a keyset position in sort order.
+
+        The position is the sort keys of a row (see columns.sort_key) plus its
+        index, which breaks ties, so paging stays consistent when other rows
+        are edited or added between requests.
+        """
+        if not sort_spec:
+            return bits >> (last_index + 1) << (last_index + 1)
+        later, equal = self._split_by_key(sort_spec[0][0], keys[0], sort_spec[0][1])
+        result = bits & later
+        equal &= bits
+        if equal:
+            result |= self.after(equal, sort_spec[1:], keys[1:], last_index)
+        return result
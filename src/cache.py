@@ -0,0 +1,107 @@
+import sys
+import threading
+from collections import OrderedDict
+
+DEFAULT_RESULT_CACHE_BYTES = 64 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 256
+
+class CachedView:
+    """Rows of a dataset matching one filter and sort, as cached between requests.
+
+    A view starts as the filter bitset. When it is requested again its full
+    row order is materialized, after which any page is a slice of that order.
+    """
+
+    __slots__ = ('bits', 'count', 'order')
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.count = bits.bit_count()
+        self.order = None
+
+    @property
+    def nbytes(self):
+        size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(self.bits)
+        if self.order is not None:
+            size += len(self.order) * self.order.itemsize
+        return size
+
+class ResultCache:
+    """Bounded LRU of per-dataset results, evicted by their estimated size in bytes.
+
+    Entries are stored with the dataset version they were computed at. Seeing a
+    newer version of a dataset discards all of its older entries, so an edit or
+    add invalidates cached results without the cache being told about it.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _see_version(self, dataset_id, version):
+        latest = self._versions.get(dataset_id)
+        if latest is not None and latest >= version:
+            return
+        self._versions[dataset_id] = version
+        if latest is not None:
+            self._discard(lambda entry_key: entry_key[0] == dataset_id)
+
+    def _discard(self, predicate):
+        for entry_key in [entry_key for entry_key in self._entries if predicate(entry_key)]:
+            self.bytes -= self._entries.pop(entry_key)[2]
+
+    def get(self, dataset_id, version, key):
+        """Return the cached result for a dataset version and key, or None."""
+        with self._lock:
+            self._see_version(dataset_id, version)
+            entry = self._entries.get((dataset_id, key))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((dataset_id, key))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, dataset_id, version, key, value, nbytes):
+        """Store or re-size a result, evicting least recently used entries to stay within budget."""
+        with self._lock:
+            self._see_version(dataset_id, version)
+            if self._versions[dataset_id] != version:
+                return
+            old = self._entries.pop((dataset_id, key), None)
+            if old is not None:
+                self.bytes -= old[2]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[(dataset_id, key)] = (version, value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.bytes -= evicted_bytes
+                self.evictions += 1
+
+    def drop(self, dataset_id):
+        """Forget every result of a dataset."""
+        with self._lock:
+            self._versions.pop(dataset_id, None)
+            self._discard(lambda entry_key: entry_key[0] == dataset_id)
+
+    def stats(self):
+        """Return hit, miss and eviction counters and the current footprint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import logging
+from array import array
+from collections.abc import Sequence
+from src.columns import INDEXED_FIELDS, MISSING, CategoricalColumn
+from src.data import QueryData, map_line_ranges, TsvChunkParser, PARALLEL_PARSE_THRESHOLD
+
+class JsonStore:
+    """Packed store of compact JSON documents in a single bytearray.
+
+    Replacing a document appends the new encoding and repoints its span, so
+    the bytes of replaced documents are only reclaimed by rebuilding the store.
+    """
+
+    def __init__(self):
+        self._blob = bytearray()
+        self._spans = array('q')
+
+    def __len__(self):
+        return len(self._spans) // 2
+
+    def _encode(self, obj):
+        start = len(self._blob)
+        self._blob += json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return start, len(self._blob)
+
+    def append(self, obj):
+        self._spans.extend(self._encode(obj))
+
+    def set(self, index, obj):
+        self._spans[2 * index], self._spans[2 * index + 1] = self._encode(obj)
+
+    def get(self, index):
+        return json.loads(self._blob[self._spans[2 * index]:self._spans[2 * index + 1]])
+
+    def parts(self):
+        """Return the packed bytes and the span array of the store."""
+        return self._blob, self._spans
+
+    @classmethod
+    def from_parts(cls, blob, spans):
+        store = cls()
+        store._blob = bytearray(blob)
+        store._spans = spans
+        return store
+
+    def extend(self, other):
+        """Append every document of another store."""
+        shift = len(self._blob)
+        self._blob += other._blob
+        self._spans.extend(position + shift for position in other._spans)
+
+class RowView:
+    """QueryData-compatible view of one row of a ColumnarDataset.
+
+    Each access to query or metadata decodes a fresh copy, so changes must go
+    through ColumnarDataset.set rather than by mutating what a view returns.
+    """
+
+    __slots__ = ('_dataset', '_index')
+
+    def __init__(self, dataset, index):
+        self._dataset = dataset
+        self._index = index
+
+    @property
+    def query(self):
+        return self._dataset.query(self._index)
+
+    @property
+    def metadata(self):
+        return self._dataset.metadata(self._index)
+
+    def to_dict(self):
+        """Convert the row to a JSON-serializable dictionary."""
+        return {
+            'query': self.query,
+            'metadata': self.metadata
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a row view over a single-row dataset built from a dictionary."""
+        return ColumnarDataset.from_dicts([data])[0]
+
+class ColumnarDataset(Sequence):
+    """Compact in-memory dataset with dictionary-encoded columns for the indexed fields.
+
+    The indexed metadata fields are stored once per row as integer codes into a
+    shared vocabulary. The query and the remaining metadata are kept as compact
+    JSON in packed stores, with indexed fields left as placeholders so that the
+    original key order survives a round trip.
+    """
+
+    def __init__(self, fields=INDEXED_FIELDS):
+        self.columns = {field: CategoricalColumn() for field in fields}
+        self._queries = JsonStore()
+        self._metadata = JsonStore()
+
+    def __len__(self):
+        return len(self._queries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Row index out of range: {index}")
+        return RowView(self, index)
+
+    def _strip(self, metadata):
+        return {key: 0 if key in self.columns else value for key, value in metadata.items()}
+
+    def append(self, row):
+        """Append a QueryData-like row."""
+        self._queries.append(row.query)
+        self._metadata.append(self._strip(row.metadata))
+        for field, column in self.columns.items():
+            column.append(row.metadata.get(field, MISSING))
+
+    def add(self, end_offset, row):
+        """Parser sink interface: append a row parsed from a TSV line."""
+        self.append(row)
+
+    def set(self, index, row):
+        """Replace a row in place."""
+        self._queries.set(index, row.query)
+        self._metadata.set(index, self._strip(row.metadata))
+        for field, column in self.columns.items():
+            column.set(index, row.metadata.get(field, MISSING))
+
+    def query(self, index):
+        return self._queries.get(index)
+
+    def metadata(self, index):
+        metadata = self._metadata.get(index)
+        for field, column in self.columns.items():
+            if field in metadata:
+                metadata[field] = column.value(index)
+        return metadata
+
+    def extend(self, other):
+        """Append every row of another dataset with the same fields."""
+        self._queries.extend(other._queries)
+        self._metadata.extend(other._metadata)
+        for field, column in self.columns.items():
+            column.extend(other.columns[field])
+
+    def parts(self):
+        """Return the columns and the packed query and metadata stores."""
+        return self.columns, self._queries, self._metadata
+
+    @classmethod
+    def from_parts(cls, columns, queries, metadata):
+        """Rebuild a dataset from the parts returned by parts()."""
+        dataset = cls(tuple(columns))
+        dataset.columns = columns
+        dataset._queries = queries
+        dataset._metadata = metadata
+        return dataset
+
+    @classmethod
+    def from_rows(cls, rows, fields=INDEXED_FIELDS):
+        dataset = cls(fields)
+        for row in rows:
+            dataset.append(row)
+        return dataset
+
+    @classmethod
+    def from_dicts(cls, dicts, fields=INDEXED_FIELDS):
+        return cls.from_rows((QueryData.from_dict(d) for d in dicts), fields)
+
+    def to_dicts(self):
+        return [row.to_dict() for row in self]
+
+def columnar_range(file_path, start, end):
+    """Parse the TSV lines in a byte range of a file into a ColumnarDataset."""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    dataset = ColumnarDataset()
+    parser = TsvChunkParser(dataset)
+    parser.feed(block)
+    parser.close()
+    return dataset
+
+def load_columnar(file_path, parallel_threshold=PARALLEL_PARSE_THRESHOLD, workers=None):
+    """Load a TSV file into a ColumnarDataset, parsing large files in parallel."""
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(file_path)
+    if workers > 1 and parallel_threshold is not None and size >= parallel_threshold:
+        dataset = ColumnarDataset()
+        for piece in map_line_ranges(columnar_range, file_path, workers):
+            dataset.extend(piece)
+    else:
+        dataset = columnar_range(file_path, 0, size)
+    if not len(dataset):
+        logging.warning(f"No data loaded from {file_path}")
+    return dataset
+
+def deep_sizeof(obj, seen=None):
+    """Estimate the memory held by an object and everything it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+def memory_report(rows):
+    """Compare the memory of a list of QueryData with the same rows in a ColumnarDataset."""
+    rows = list(rows)
+    columnar = ColumnarDataset.from_rows(rows)
+    query_data_bytes = deep_sizeof(rows)
+    columnar_bytes = deep_sizeof(columnar)
+    return {
+        'rows': len(rows),
+        'query_data_bytes': query_data_bytes,
+        'columnar_bytes': columnar_bytes,
+        'ratio': query_data_bytes / columnar_bytes if columnar_bytes else 0.0
+    }
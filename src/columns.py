@@ -0,0 +1,87 @@
+import json
+from array import array
+
+INDEXED_FIELDS = ('segment', 'question_intent', 'sub_intent')
+
+class _Missing:
+    """Marker for rows whose metadata does not contain a field."""
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+def value_key(value):
+    """Return a hashable key for a metadata value, keeping types distinct."""
+    if value is MISSING:
+        return MISSING
+    try:
+        hash(value)
+    except TypeError:
+        return ('json', json.dumps(value, sort_keys=True, ensure_ascii=False))
+    return (type(value).__name__, value)
+
+def display_value(value, default='Unknown'):
+    """Return the string shown for a metadata value, as the table renders it."""
+    return default if value is MISSING else str(value)
+
+def sort_key(value):
+    """Return the key a metadata value sorts by: numbers numerically, anything else by its lowercase display string."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, '')
+    return (1, 0, display_value(value).lower())
+
+class CategoricalColumn:
+    """Dictionary-encoded column: one integer code per row into a shared vocabulary."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_parts(cls, values, codes):
+        """Rebuild a column from its vocabulary and codes."""
+        column = cls()
+        column.values = list(values)
+        column.codes = codes
+        column._lookup = {value_key(value): code for code, value in enumerate(column.values)}
+        return column
+
+    def code_for(self, value):
+        """Return the code for a value, adding it to the vocabulary if needed."""
+        key = value_key(value)
+        code = self._lookup.get(key)
+        if code is None:
+            code = len(self.values)
+            self._lookup[key] = code
+            self.values.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(self.code_for(value))
+
+    def set(self, index, value):
+        self.codes[index] = self.code_for(value)
+
+    def value(self, index):
+        return self.values[self.codes[index]]
+
+    def extend(self, other):
+        """Append another column's rows, re-mapping its codes into this vocabulary."""
+        remap = array('I', (self.code_for(value) for value in other.values))
+        self.codes.extend(remap[code] for code in other.codes)
+
+def build_columns(rows, fields=INDEXED_FIELDS):
+    """Build categorical columns for the given metadata fields from QueryData rows."""
+    columns = {field: CategoricalColumn() for field in fields}
+    for row in rows:
+        for field, column in columns.items():
+            column.append(row.metadata.get(field, MISSING))
+    return columns
@@ -1,7 +1,14 @@
+import io
+import os
 import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+PARALLEL_PARSE_THRESHOLD = 32 * 1024 * 1024
 
 class QueryData:
+    __slots__ = ('query', 'metadata')
+
     def __init__(self, query, metadata):
         self.query = query
         self.metadata = metadata
@@ -18,21 +25,126 @@ class QueryData:
         """Create a QueryData instance from a dictionary."""
         return cls(data['query'], data['metadata'])
 
-def load_query_data(file_path):
-    """Load QueryData objects from a TSV file."""
+def parse_line(line):
+    """Parse a single TSV line into a QueryData object."""
+    columns = line.strip().split('\t')
+    if len(columns) != 2:
+        raise ValueError(f"Invalid line format: {line}")
+    try:
+        query_json = json.loads(columns[0])
+        metadata_json = json.loads(columns[1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in line: {line}") from e
+    return QueryData(query_json, metadata_json)
+
+def parse_lines(lines):
+    """Parse an iterable of TSV lines into QueryData objects."""
+    data = []
+    for line in lines:
+        data.append(parse_line(line))
+    return data
+
+def split_line_ranges(file_path, parts):
+    """Split a file into up to `parts` byte ranges that start and end on line boundaries."""
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as f:
+        for i in range(1, parts):
+            target = size * i // parts
+            if target <= boundaries[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def parse_range(file_path, start, end):
+    """Parse the TSV lines in a byte range, with the same newline handling as text mode."""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    return parse_lines(io.TextIOWrapper(io.BytesIO(block), encoding='utf-8'))
+
+def map_line_ranges(func, file_path, workers):
+    """Run func(file_path, start, end) over line-aligned byte ranges in a process pool.
+
+    Results are yielded in file order, so the first exception raised is the one
+    for the earliest failing range.
+    """
+    ranges = split_line_ranges(file_path, workers * 4)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(func, file_path, start, end) for start, end in ranges]
+        for future in futures:
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def load_query_data_parallel(file_path, workers):
+    """Parse byte ranges of a TSV file in a process pool and merge them in file order."""
     data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            columns = line.strip().split('\t')
-            if len(columns) != 2:
-                raise ValueError(f"Invalid line format: {line}")
-            try:
-                query_json = json.loads(columns[0])
-                metadata_json = json.loads(columns[1])
-            except json.JSONDecodeError as e:
-                raise ValueError(f"Invalid JSON in line: {line}") from e
-            query_data = QueryData(query_json, metadata_json)
-            data.append(query_data)
+    for rows in map_line_ranges(parse_range, file_path, workers):
+        data.extend(rows)
+    return data
+
+def load_query_data(file_path, parallel_threshold=PARALLEL_PARSE_THRESHOLD, workers=None):
+    """Load QueryData objects from a TSV file, parsing large files in parallel."""
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and parallel_threshold is not None and os.path.getsize(file_path) >= parallel_threshold:
+        data = load_query_data_parallel(file_path, workers)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = parse_lines(f)
     if not data:
         logging.warning(f"No data loaded from {file_path}")
     return data
+
+class TsvChunkParser:
+    """Incrementally parse TSV bytes into QueryData rows as chunks arrive.
+
+    Only the trailing partial line of the last chunk is buffered, so memory
+    used by parsing is bounded by the chunk size rather than the file size.
+    When a sink is given (anything with len() and add(end_offset, row), such
+    as a LineIndex or ColumnarDataset), each parsed row is handed to it
+    instead of being kept in a list.
+    """
+
+    def __init__(self, sink=None):
+        self.rows = []
+        self.sink = sink
+        self.offset = 0
+        self._pending = []
+
+    @property
+    def rows_parsed(self):
+        return len(self.sink) if self.sink is not None else len(self.rows)
+
+    def _add(self, line):
+        row = parse_line(line.decode('utf-8'))
+        self.offset += len(line)
+        if self.sink is not None:
+            self.sink.add(self.offset, row)
+        else:
+            self.rows.append(row)
+
+    def feed(self, chunk):
+        """Parse every complete line in the chunk and buffer the remainder."""
+        end = chunk.rfind(b'\n')
+        if end == -1:
+            self._pending.append(chunk)
+            return
+        self._pending.append(chunk[:end + 1])
+        block = b''.join(self._pending)
+        self._pending = [chunk[end + 1:]] if end + 1 < len(chunk) else []
+        for line in block.split(b'\n')[:-1]:
+            self._add(line + b'\n')
+
+    def close(self):
+        """Parse a final line without a trailing newline and return all rows."""
+        tail = b''.join(self._pending)
+        self._pending = []
+        if tail:
+            self._add(tail)
+        return self.rows
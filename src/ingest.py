@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from src.data import TsvChunkParser
+
+class UploadProgress:
+    """Progress of a single upload, written to a small JSON file for polling.
+
+    The file lives outside the worker so that a poll served by any worker sees
+    the progress of an upload that another worker is still receiving.
+    """
+
+    def __init__(self, folder, upload_id, total_bytes=None, interval=0.5):
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload ID: {upload_id}")
+        self.path = os.path.join(folder, f"{upload_id}.json")
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows_parsed = 0
+        self.interval = interval
+        self._last_write = 0.0
+        os.makedirs(folder, exist_ok=True)
+        self._write('receiving')
+
+    def _write(self, state, error=None):
+        status = {
+            'state': state,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'rows_parsed': self.rows_parsed,
+            'error': error
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self.path)
+        self._last_write = time.monotonic()
+
+    def update(self, bytes_read, rows_parsed):
+        """Record progress, writing it out at most once per interval."""
+        self.bytes_read = bytes_read
+        self.rows_parsed = rows_parsed
+        if time.monotonic() - self._last_write >= self.interval:
+            self._write('receiving')
+
+    def finish(self, rows_parsed):
+        """Mark the upload as fully parsed."""
+        self.rows_parsed = rows_parsed
+        self._write('done')
+
+    def fail(self, error):
+        """Mark the upload as failed."""
+        self._write('error', error=str(error))
+
+    def discard(self):
+        """Remove the progress file once the upload request has finished."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def read_progress(folder, upload_id):
+    """Return the progress dictionary for an upload, or None if unknown."""
+    if not upload_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(folder, f"{upload_id}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class TsvUploadStream:
+    """Writable upload container that parses TSV rows while the body arrives.
+
+    Werkzeug writes each multipart chunk here as it reads the request body, so
+    rows are validated and indexed chunk by chunk alongside the copy to disk
+    instead of after the whole file has been saved. A parse error stops parsing but the upload
+    is still drained so that the error can be reported once it completes.
+    Without a sink the upload is only written to disk, for files large enough
+    that the parallel parser should handle them after the upload. Either way
+    the bytes are hashed as they arrive, for the parse cache.
+    """
+
+    def __init__(self, folder, progress=None, sink=None):
+        os.makedirs(folder, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=folder, suffix='.part', delete=False)
+        self.parser = TsvChunkParser(sink) if sink is not None else None
+        self.progress = progress
+        self.bytes_read = 0
+        self.error = None
+        self._hash = hashlib.sha256()
+
+    @property
+    def digest(self):
+        """SHA-256 hex digest of the bytes received so far."""
+        return self._hash.hexdigest()
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.bytes_read += len(chunk)
+        if self.parser is not None and self.error is None:
+            try:
+                self.parser.feed(chunk)
+            except (ValueError, UnicodeDecodeError) as e:
+                self.error = e
+        if self.progress:
+            self.progress.update(self.bytes_read, self.rows_parsed)
+        return len(chunk)
+
+    @property
+    def rows_parsed(self):
+        return self.parser.rows_parsed if self.parser is not None else 0
+
+    def finish(self):
+        """Parse any trailing line and return the sink (None if not parsing), re-raising parse errors."""
+        if self.parser is None:
+            if self.progress:
+                self.progress.finish(0)
+            return None
+        if self.error is None:
+            try:
+                self.parser.close()
+            except (ValueError, UnicodeDecodeError) as e:
+                self.error = e
+        if self.error is not None:
+            if self.progress:
+                self.progress.fail(self.error)
+            if isinstance(self.error, UnicodeDecodeError):
+                raise ValueError(f"Invalid UTF-8 in upload: {self.error}") from self.error
+            raise self.error
+        if self.progress:
+            self.progress.finish(self.rows_parsed)
+        return self.parser.sink
+
+    def save(self, dst):
+        """Move the received upload to its final path without copying it."""
+        self._file.close()
+        os.replace(self._file.name, dst)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def close(self):
+        """Close the container and discard the upload unless it was saved."""
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+        if self.progress:
+            self.progress.discard()
@@ -0,0 +1,214 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+
+TRASH_DIRNAME = '_trash'
+LOCK_FILENAME = '.janitor.lock'
+DEFAULT_SWEEP_INTERVAL = 300
+DEFAULT_DELETES_PER_SECOND = 100
+TOUCH_INTERVAL = 60
+
+def retire(path):
+    """Move a file or folder into the trash folder beside it, for the janitor to delete later.
+
+    A rename within the same folder is constant time however large the tree
+    is, so a request can discard files without deleting them itself.
+    """
+    trash = os.path.join(os.path.dirname(path), TRASH_DIRNAME)
+    os.makedirs(trash, exist_ok=True)
+    os.rename(path, os.path.join(trash, f'{os.path.basename(path)}-{os.urandom(4).hex()}'))
+
+def newest_mtime(path):
+    """Return the latest modification time of a path and, for a folder, of its direct entries."""
+    newest = os.stat(path).st_mtime
+    if os.path.isdir(path):
+        for entry in os.scandir(path):
+            try:
+                newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+class Janitor:
+    """Background thread that deletes expired session files at a bounded rate.
+
+    Session folders under DATA_FOLDER, MODIFIED_FOLDER and ADDED_FOLDER, dataset
+    folders, shared base files no dataset refers to and upload progress files
+    expire once nothing in them has changed for PERMANENT_SESSION_LIFETIME;
+    requests keep theirs alive with touch(). Anything retired into a trash
+    folder is deleted on the next sweep. Deletes are spread out to at most
+    JANITOR_DELETES_PER_SECOND, and only one worker sweeps at a time.
+    """
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+        self.reclaimed_bytes = 0
+        self.deleted_files = 0
+        self._touched = {}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        lifetime = self.app.config['PERMANENT_SESSION_LIFETIME']
+        return lifetime.total_seconds() if hasattr(lifetime, 'total_seconds') else lifetime
+
+    def start(self):
+        """Start the sweeping thread in this process unless it is running or JANITOR_INTERVAL is 0."""
+        interval = self.app.config.get('JANITOR_INTERVAL', DEFAULT_SWEEP_INTERVAL)
+        if not interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the sweeping thread after its current delete."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = self._pid = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Janitor sweep failed: {str(e)}")
+
+    def touch(self, *paths):
+        """Mark paths as in use, writing each one's modification time at most once per TOUCH_INTERVAL."""
+        now = time.monotonic()
+        for path in paths:
+            if now - self._touched.get(path, -TOUCH_INTERVAL) < TOUCH_INTERVAL:
+                continue
+            self._touched[path] = now
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _prune_touched(self):
+        """Forget paths not touched within TOUCH_INTERVAL, so the map holds only recently used ones."""
+        now = time.monotonic()
+        for path, touched in self._touched.copy().items():
+            if now - touched >= TOUCH_INTERVAL:
+                self._touched.pop(path, None)
+
+    def _expired(self, path, cutoff):
+        try:
+            return newest_mtime(path) < cutoff
+        except FileNotFoundError:
+            return False
+
+    def _unlink(self, path, pause):
+        try:
+            size = os.lstat(path).st_size
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        self.deleted_files += 1
+        self._stop.wait(pause)
+        return size
+
+    def _delete(self, path):
+        """Delete a file or folder tree one file at a time, pacing deletes, and return the bytes reclaimed."""
+        pause = 1 / self.app.config.get('JANITOR_DELETES_PER_SECOND', DEFAULT_DELETES_PER_SECOND)
+        reclaimed = 0
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path, topdown=False):
+                for name in files:
+                    if self._stop.is_set():
+                        break
+                    reclaimed += self._unlink(os.path.join(root, name), pause)
+                for name in dirs:
+                    subfolder = os.path.join(root, name)
+                    try:
+                        if os.path.islink(subfolder):
+                            os.unlink(subfolder)
+                        else:
+                            os.rmdir(subfolder)
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        else:
+            reclaimed = self._unlink(path, pause)
+        self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    def _trash_folders(self):
+        config = self.app.config
+        for key in ('DATA_FOLDER', 'MODIFIED_FOLDER', 'ADDED_FOLDER', 'DATASET_FOLDER'):
+            yield os.path.join(config[key], TRASH_DIRNAME)
+
+    def _session_groups(self):
+        """Return {session ID: its folders} over the per-session upload, export and added folders."""
+        groups = {}
+        for key in ('DATA_FOLDER', 'MODIFIED_FOLDER', 'ADDED_FOLDER'):
+            folder = self.app.config[key]
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    if name.isalnum():
+                        groups.setdefault(name, []).append(os.path.join(folder, name))
+        return groups
+
+    def expired_paths(self, now=None):
+        """Return the paths a sweep would delete: trash contents and entries idle for longer than the TTL."""
+        cutoff = (now if now is not None else time.time()) - self.ttl
+        paths = []
+        for trash in self._trash_folders():
+            if os.path.isdir(trash):
+                paths += [os.path.join(trash, name) for name in os.listdir(trash)]
+        for folders in self._session_groups().values():
+            if all(self._expired(folder, cutoff) for folder in folders):
+                paths += folders
+        dataset_folder = self.app.config['DATASET_FOLDER']
+        if os.path.isdir(dataset_folder):
+            for name in os.listdir(dataset_folder):
+                if name.isalnum() and self._expired(os.path.join(dataset_folder, name), cutoff):
+                    paths.append(os.path.join(dataset_folder, name))
+        paths += [path for path in self.registry.unreferenced_bases() if self._expired(path, cutoff)]
+        progress_folder = self.app.config['PROGRESS_FOLDER']
+        if os.path.isdir(progress_folder):
+            paths += [os.path.join(progress_folder, name) for name in os.listdir(progress_folder)
+                      if self._expired(os.path.join(progress_folder, name), cutoff)]
+        return paths
+
+    def sweep(self, now=None):
+        """Delete every expired path unless another worker is sweeping, and return the bytes reclaimed."""
+        self._prune_touched()
+        dataset_folder = self.app.config['DATASET_FOLDER']
+        os.makedirs(dataset_folder, exist_ok=True)
+        with open(os.path.join(dataset_folder, LOCK_FILENAME), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            paths = self.expired_paths(now)
+            reclaimed = 0
+            for path in paths:
+                if self._stop.is_set():
+                    break
+                if os.path.dirname(path) == dataset_folder:
+                    self.registry.forget(os.path.basename(path))
+                reclaimed += self._delete(path)
+        if paths:
+            logging.info(f"Janitor deleted {len(paths)} expired entries, reclaiming {reclaimed} bytes "
+                         f"({self.reclaimed_bytes} bytes in total)")
+        return reclaimed
+
+    def stats(self):
+        """Return the files deleted and bytes reclaimed by this process's sweeps."""
+        return {'deleted_files': self.deleted_files, 'reclaimed_bytes': self.reclaimed_bytes}
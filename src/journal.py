@@ -0,0 +1,126 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+
+SEAL_OP = 'compacted'
+
+class ChangeJournal:
+    """Append-only file of JSON change records, one per line, with group-committed fsync.
+
+    Each record is written with a single O_APPEND write, so records from
+    several worker processes never interleave. Durability is paid separately
+    by commit(): writers that arrive while another is syncing wait for it
+    and are covered by the next fsync together, so a burst of changes costs
+    about one fsync rather than one each. A compacted journal ends with a
+    seal record pointing at the generation that replaces it.
+    """
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.syncs = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+
+    @property
+    def size(self):
+        return os.fstat(self._fd).st_size
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive lock on the journal across processes."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield self
+        finally:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def read(self, offset):
+        """Return the complete records after offset, the offset after them, and the seal record if any.
+
+        A trailing line without a newline is a record whose write did not
+        finish and is left unread.
+        """
+        data = os.pread(self._fd, max(0, self.size - offset), offset)
+        end = data.rfind(b'\n') + 1
+        records = []
+        seal = None
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if record['op'] == SEAL_OP:
+                seal = record
+                break
+            records.append(record)
+        return records, offset + end, seal
+
+    def read_bytes(self, start, end):
+        """Return the raw bytes of a range of the journal."""
+        return os.pread(self._fd, end - start, start)
+
+    def truncate(self, offset):
+        """Drop a partially written record left after offset by a crashed writer."""
+        os.ftruncate(self._fd, offset)
+
+    def append(self, record):
+        """Write a record and return (sequence number, end offset); pass the sequence to commit()."""
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            os.write(self._fd, line)
+            self._written += 1
+            return self._written, self.size
+
+    def commit(self, sequence):
+        """Wait until every record up to sequence is on disk, syncing at most once for a batch."""
+        if not self.sync:
+            return
+        with self._sync_lock:
+            if self._synced >= sequence:
+                return
+            with self._lock:
+                target = self._written
+            os.fsync(self._fd)
+            self._synced = target
+            self.syncs += 1
+
+    def close(self):
+        """Close the file, which also releases a lock held on it."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+def write_synced(path, data):
+    """Replace a file with the given bytes, synced to disk before it becomes visible."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def sync_file(path):
+    """Flush a written file to disk."""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+def read_seal(path):
+    """Return the seal record ending a journal file, or None if it is still open for writes."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            tail = f.read()
+    except FileNotFoundError:
+        return None
+    if not tail.endswith(b'\n'):
+        return None
+    try:
+        record = json.loads(tail[:-1].rsplit(b'\n', 1)[-1])
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and record.get('op') == SEAL_OP else None
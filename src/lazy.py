@@ -0,0 +1,134 @@
+import os
+import json
+import mmap
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from src.columns import INDEXED_FIELDS, MISSING, CategoricalColumn
+from src.data import parse_line, map_line_ranges, TsvChunkParser, PARALLEL_PARSE_THRESHOLD
+
+DEFAULT_ROW_CACHE_SIZE = 4096
+
+class LineIndex:
+    """Line offsets of a TSV file plus dictionary-encoded columns for the indexed fields.
+
+    offsets[i] is where line i starts and offsets[i + 1] where it ends, so the
+    index costs 8 bytes per row plus 4 bytes per row for each indexed field.
+    """
+
+    def __init__(self, start=0, fields=INDEXED_FIELDS):
+        self.offsets = array('q', [start])
+        self.columns = {field: CategoricalColumn() for field in fields}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, end_offset, row):
+        """Record a parsed row whose line ends at end_offset."""
+        self.offsets.append(end_offset)
+        for field, column in self.columns.items():
+            column.append(row.metadata.get(field, MISSING))
+
+    def extend(self, other):
+        """Append an index for the byte range directly following this one."""
+        if other.offsets[0] != self.offsets[-1]:
+            raise ValueError("Line index ranges are not contiguous")
+        self.offsets.extend(other.offsets[1:])
+        for field, column in self.columns.items():
+            column.extend(other.columns[field])
+
+def index_range(file_path, start, end):
+    """Validate and index the TSV lines in a byte range of a file."""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    index = LineIndex(start)
+    parser = TsvChunkParser(index)
+    parser.offset = start
+    parser.feed(block)
+    parser.close()
+    return index
+
+def build_line_index(file_path, parallel_threshold=PARALLEL_PARSE_THRESHOLD, workers=None):
+    """Build a LineIndex for a TSV file, indexing large files in parallel."""
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(file_path)
+    if workers > 1 and parallel_threshold is not None and size >= parallel_threshold:
+        index = LineIndex()
+        for piece in map_line_ranges(index_range, file_path, workers):
+            index.extend(piece)
+    else:
+        index = index_range(file_path, 0, size)
+    if not len(index):
+        logging.warning(f"No data loaded from {file_path}")
+    return index
+
+class LazyDataset(Sequence):
+    """Memory-mapped TSV dataset that decodes a QueryData only when a row is accessed.
+
+    Decoded rows are kept in a bounded LRU; filtering, sorting and charts read
+    the indexed metadata fields from the columns instead of decoding rows.
+    """
+
+    def __init__(self, file_path, index=None, cache_size=DEFAULT_ROW_CACHE_SIZE):
+        self.file_path = file_path
+        self.index = index if index is not None else build_line_index(file_path)
+        self.columns = self.index.columns
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Row index out of range: {index}")
+        with self._lock:
+            row = self._cache.get(index)
+            if row is not None:
+                self._cache.move_to_end(index)
+                return row
+        row = parse_line(self.line_bytes(index).decode('utf-8'))
+        with self._lock:
+            self._cache[index] = row
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return row
+
+    def query(self, index):
+        """Decode only the query column of a row, bypassing the row cache."""
+        line = self.line_bytes(index)
+        return json.loads(line[:line.index(b'\t')])
+
+    def metadata(self, index):
+        """Decode only the metadata column of a row, bypassing the row cache."""
+        line = self.line_bytes(index)
+        return json.loads(line[line.index(b'\t') + 1:])
+
+    def line_span(self, start, stop):
+        """Return the byte range of the file holding lines start up to stop."""
+        return self.index.offsets[start], self.index.offsets[stop]
+
+    def source_bytes(self, start, end):
+        """Return a byte range of the source file."""
+        return self._mmap[start:end]
+
+    def line_bytes(self, index):
+        """Return the raw bytes of a line, including its newline."""
+        return self._mmap[self.index.offsets[index]:self.index.offsets[index + 1]]
+
+    def close(self):
+        """Release the memory map and file handle."""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
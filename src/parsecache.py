@@ -0,0 +1,180 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import logging
+import threading
+from array import array
+from src.columns import MISSING, CategoricalColumn
+from src.lazy import LineIndex
+from src.columnar import ColumnarDataset, JsonStore
+
+DEFAULT_PARSE_CACHE_BYTES = 256 * 1024 * 1024
+SNAPSHOT_MAGIC = b'TSVSNAP1'
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _encode_values(values):
+    return [[] if value is MISSING else [value] for value in values]
+
+def _decode_values(values):
+    return [value[0] if value else MISSING for value in values]
+
+def write_snapshot(path, parsed):
+    """Write a parsed LineIndex or ColumnarDataset to a binary snapshot file.
+
+    The file is a JSON header describing the columns' vocabularies and the
+    arrays that follow it, then the raw bytes of each array, so loading it
+    copies arrays instead of parsing rows.
+    """
+    if isinstance(parsed, ColumnarDataset):
+        columns, queries, metadata = parsed.parts()
+        kind = 'columnar'
+        arrays = [('queries.blob', array('B', queries.parts()[0])), ('queries.spans', queries.parts()[1]),
+                  ('metadata.blob', array('B', metadata.parts()[0])), ('metadata.spans', metadata.parts()[1])]
+    else:
+        columns = parsed.columns
+        kind = 'lines'
+        arrays = [('offsets', parsed.offsets)]
+    arrays += [(f'codes.{field}', column.codes) for field, column in columns.items()]
+    header = json.dumps({
+        'kind': kind,
+        'fields': list(columns),
+        'values': {field: _encode_values(column.values) for field, column in columns.items()},
+        'arrays': [[name, data.typecode, len(data) * data.itemsize] for name, data in arrays]
+    }, ensure_ascii=False).encode('utf-8')
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<Q', len(header)) + header)
+            for _, data in arrays:
+                data.tofile(f)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def read_snapshot(path):
+    """Load a snapshot written by write_snapshot, raising ValueError if it is not one."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError(f"Not a parse snapshot: {path}")
+    start = len(SNAPSHOT_MAGIC) + 8
+    header_size, = struct.unpack_from('<Q', data, len(SNAPSHOT_MAGIC))
+    header = json.loads(data[start:start + header_size])
+    position = start + header_size
+    arrays = {}
+    for name, typecode, size in header['arrays']:
+        arrays[name] = array(typecode, data[position:position + size])
+        position += size
+    if position != len(data):
+        raise ValueError(f"Truncated parse snapshot: {path}")
+    columns = {
+        field: CategoricalColumn.from_parts(_decode_values(header['values'][field]), arrays[f'codes.{field}'])
+        for field in header['fields']
+    }
+    if header['kind'] == 'columnar':
+        queries = JsonStore.from_parts(arrays['queries.blob'].tobytes(), arrays['queries.spans'])
+        metadata = JsonStore.from_parts(arrays['metadata.blob'].tobytes(), arrays['metadata.spans'])
+        return ColumnarDataset.from_parts(columns, queries, metadata)
+    index = LineIndex(fields=tuple(columns))
+    index.offsets = arrays['offsets']
+    index.columns = columns
+    return index
+
+class ParseCache:
+    """On-disk LRU of parsed uploads keyed by the SHA-256 of the uploaded bytes.
+
+    A re-upload of the same file loads the snapshot instead of parsing JSON
+    again. Snapshots are files in a folder shared by all workers, so recency
+    is kept as their modification time and the least recently used ones are
+    deleted once the folder grows past max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_PARSE_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, digest, kind):
+        if not digest.isalnum():
+            raise ValueError(f"Invalid digest: {digest}")
+        return os.path.join(self.folder, f'{digest}.{kind}')
+
+    def get(self, digest, kind, source_bytes):
+        """Return the cached parse of an upload, or None; kind is 'lines' or 'columnar'."""
+        path = self._path(digest, kind)
+        try:
+            parsed = read_snapshot(path)
+            os.utime(path)
+        except FileNotFoundError:
+            parsed = None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable parse snapshot {path}: {e}")
+            parsed = None
+        with self._lock:
+            if parsed is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += source_bytes
+            lookups = self.hits + self.misses
+            logging.info(f"Parse cache {'hit' if parsed is not None else 'miss'} for {digest[:12]}: "
+                         f"{self.hits}/{lookups} hits, {self.bytes_saved} bytes not parsed")
+        return parsed
+
+    def put(self, digest, parsed):
+        """Store the parse of an upload, then evict snapshots beyond the size budget."""
+        kind = 'columnar' if isinstance(parsed, ColumnarDataset) else 'lines'
+        try:
+            write_snapshot(self._path(digest, kind), parsed)
+        except OSError as e:
+            logging.warning(f"Failed to write parse snapshot for {digest[:12]}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used snapshots until the folder fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        """Return hit and miss counters and the bytes whose parsing was skipped."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'max_bytes': self.max_bytes
+            }
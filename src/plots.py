@@ -64,7 +64,10 @@ def plot_stacked_bar(data):
         if q_intent not in intent_subintent_map:
             intent_subintent_map[q_intent] = Counter()
         intent_subintent_map[q_intent][sub_intent] += 1
+    return plot_stacked_bar_counts(intent_subintent_map)
 
+def plot_stacked_bar_counts(intent_subintent_map):
+    """Create JSON data for a Chart.js stacked bar chart from per-intent sub-intent counters."""
     question_intents = sorted(intent_subintent_map.keys())
     all_sub_intents = sorted(set(sub_intent for counter in intent_subintent_map.values() for sub_intent in counter))
     colors = generate_colors(len(all_sub_intents))
@@ -0,0 +1,504 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import Counter
+from collections.abc import Sequence
+from src.data import QueryData, TsvChunkParser
+from src.columns import INDEXED_FIELDS, MISSING, display_value, sort_key, value_key
+from src.bitmaps import FILTER_FIELDS, indices_to_bitmap, bitmap_to_indices, bitmap_select
+from src.textindex import query_text
+
+SQLITE_FILENAME = 'rows.db'
+LOAD_BATCH_ROWS = 10000
+SQL_BATCH_ROWS = 500
+
+FIELD_COLUMNS = ('display', 'match', 'rank', 'num', 'text')
+ROW_COLUMNS = ['id', 'query', 'metadata', 'query_text'] + [
+    f'{field}_{suffix}' for field in INDEXED_FIELDS for suffix in FIELD_COLUMNS
+]
+
+def field_values(metadata):
+    """Return the indexed column values of a row's metadata: display, filter and sort forms of each field."""
+    values = []
+    for field in INDEXED_FIELDS:
+        value = metadata.get(field, MISSING)
+        display = display_value(value)
+        values.extend([display, display.strip().lower(), *sort_key(value)])
+    return values
+
+def row_values(index, row):
+    """Return the column values stored for a row."""
+    return [
+        index,
+        json.dumps(row.query, ensure_ascii=False),
+        json.dumps(row.metadata, ensure_ascii=False),
+        query_text(row.query).lower()
+    ] + field_values(row.metadata)
+
+def _insert_sql():
+    return f"INSERT INTO rows ({', '.join(ROW_COLUMNS)}) VALUES ({', '.join('?' * len(ROW_COLUMNS))})"
+
+def _sort_columns(field, reverse):
+    direction = ' DESC' if reverse else ''
+    return [f'{field}_{suffix}{direction}' for suffix in ('rank', 'num', 'text')]
+
+def _first_row(field):
+    return f'(SELECT MIN(id) FROM rows AS first WHERE first.{field}_display = rows.{field}_display)'
+
+def _field_conditions(search_params):
+    conditions = []
+    for field in FILTER_FIELDS:
+        term = (search_params or {}).get(field)
+        if term:
+            conditions.append((f'instr({field}_match, ?) > 0', (term,)))
+    return conditions
+
+def _text_condition(term):
+    return 'instr(query_text, ?) > 0', (term.strip().lower(),)
+
+def _batches(items, size=SQL_BATCH_ROWS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class SqliteLoader:
+    """Parser sink that inserts rows into a new SQLite database in batches."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+        self._pending = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, end_offset, row):
+        self._pending.append(row_values(self.count, row))
+        self.count += 1
+        if len(self._pending) >= LOAD_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany(_insert_sql(), self._pending)
+        self._pending = []
+
+def load_sqlite(source_path, db_path):
+    """Load a TSV file into a new SQLite database with indexed metadata columns.
+
+    The database is built under a temporary name and moved into place once
+    complete, so a crash during loading never leaves a partial database.
+    """
+    temp_path = db_path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute('PRAGMA journal_mode=OFF')
+        columns = ['id INTEGER PRIMARY KEY', 'query TEXT', 'metadata TEXT', 'query_text TEXT']
+        for field in INDEXED_FIELDS:
+            columns += [f'{field}_display TEXT', f'{field}_match TEXT', f'{field}_rank INTEGER',
+                        f'{field}_num REAL', f'{field}_text TEXT']
+        connection.execute(f"CREATE TABLE rows ({', '.join(columns)})")
+        connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)')
+        loader = SqliteLoader(connection)
+        parser = TsvChunkParser(loader)
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                parser.feed(chunk)
+        parser.close()
+        loader.flush()
+        for field in INDEXED_FIELDS:
+            connection.execute(f'CREATE INDEX rows_{field}_sort ON rows ({field}_rank, {field}_num, {field}_text)')
+            connection.execute(f'CREATE INDEX rows_{field}_sort_desc ON rows '
+                               f'({field}_rank DESC, {field}_num DESC, {field}_text DESC)')
+            connection.execute(f'CREATE INDEX rows_{field}_display ON rows ({field}_display)')
+        connection.executemany('INSERT INTO meta VALUES (?, ?)', [('version', 0), ('rows', loader.count)])
+        connection.commit()
+        connection.execute('PRAGMA journal_mode=WAL')
+    except Exception:
+        connection.close()
+        os.remove(temp_path)
+        raise
+    connection.close()
+    os.replace(temp_path, db_path)
+    return loader.count
+
+class SqliteColumn:
+    """Per-row access to one metadata field of a SqliteDataset, as encode_cursor needs."""
+
+    def __init__(self, dataset, field):
+        self.dataset = dataset
+        self.field = field
+
+    def value(self, index):
+        return self.dataset.metadata(index).get(self.field, MISSING)
+
+class SqliteFilter:
+    """Rows of a SqliteDataset matching SQL conditions, standing in for a filter bitset.
+
+    A filter is kept as its WHERE clause rather than as the matching ids, so
+    counting it, reading a page of it in sort order or narrowing it to the
+    rows after a keyset cursor is one indexed query. The int bitset is only
+    read back when it meets a plain bitset or code that decodes the bits.
+    """
+
+    def __init__(self, dataset, conditions=(), size=None):
+        self.dataset = dataset
+        self.conditions = tuple(conditions)
+        self.size = len(dataset) if size is None else size
+        self._count = None
+        self._bits = None
+
+    def where(self):
+        """Return the WHERE clause and parameters of the filter, limited to its rows."""
+        clauses = [condition for condition, _ in self.conditions] + ['id < ?']
+        params = [param for _, values in self.conditions for param in values] + [self.size]
+        return ' AND '.join(clauses), params
+
+    def narrow(self, condition, params):
+        """Return the filter with one more condition."""
+        if (condition, tuple(params)) in self.conditions:
+            return self
+        return SqliteFilter(self.dataset, self.conditions + ((condition, tuple(params)),), self.size)
+
+    def ids(self, order='id', limit=-1, offset=0):
+        """Return the matching ids in the given ORDER BY order, a page of them with limit and offset."""
+        where, params = self.where()
+        rows = self.dataset.execute(f'SELECT id FROM rows WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?',
+                                    params + [limit, offset])
+        return [row[0] for row in rows]
+
+    def bit_count(self):
+        if self._count is None:
+            if self._bits is not None:
+                self._count = self._bits.bit_count()
+            else:
+                where, params = self.where()
+                self._count = self.dataset.execute(f'SELECT COUNT(*) FROM rows WHERE {where}', params).fetchone()[0]
+        return self._count
+
+    def __bool__(self):
+        return self.bit_count() > 0
+
+    def __int__(self):
+        if self._bits is None:
+            self._bits = indices_to_bitmap(self.ids(), self.size)
+        return self._bits
+
+    __index__ = __int__
+
+    def bit_length(self):
+        return int(self).bit_length()
+
+    def to_bytes(self, length, byteorder):
+        return int(self).to_bytes(length, byteorder)
+
+    def __and__(self, other):
+        if isinstance(other, SqliteFilter) and other.dataset is self.dataset:
+            result = self
+            for condition, params in other.conditions:
+                result = result.narrow(condition, params)
+            return result
+        return int(self) & int(other)
+
+    __rand__ = __and__
+
+    def __eq__(self, other):
+        if not isinstance(other, (int, SqliteFilter)):
+            return NotImplemented
+        return int(self) == int(other)
+
+class SqliteIndex:
+    """FilterIndex counterpart that filters, sorts and pages with SQL over the indexed columns.
+
+    match returns a SqliteFilter, so a sorted page of the search results is
+    a single WHERE ... ORDER BY ... LIMIT query and a keyset cursor adds its
+    position to the WHERE clause. Plain int bitsets are still accepted.
+    Sorting by a field without indexed columns decodes the metadata of the
+    matching rows instead.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def size(self):
+        return len(self.dataset)
+
+    def ensure_field(self, field):
+        return field in INDEXED_FIELDS
+
+    def _ids(self, where, params, order=''):
+        sql = f'SELECT id FROM rows WHERE ({where}) AND id < ?' + (f' ORDER BY {order}' if order else '')
+        return [row[0] for row in self.dataset.execute(sql, list(params) + [self.size])]
+
+    def match(self, search_params):
+        """Return the filter of rows matching every non-empty search parameter."""
+        return SqliteFilter(self.dataset, _field_conditions(search_params))
+
+    def _order_by(self, sort_spec):
+        columns = []
+        for field, reverse in sort_spec:
+            columns.extend(_sort_columns(field, reverse))
+        return ', '.join(columns + ['id'])
+
+    def _row_keys(self, indices, sort_spec):
+        keys = {}
+        for index, metadata in self.dataset.metadata_many(indices):
+            keys[index] = [sort_key(metadata.get(field, MISSING)) for field, _ in sort_spec]
+        return keys
+
+    def select_sorted(self, bits, sort_spec, start=0, stop=None):
+        """Return the start-th up to the stop-th rows of a bitset ordered by a sort spec."""
+        if stop is None:
+            stop = bits.bit_count()
+        if start >= stop:
+            return []
+        indexed = all(self.ensure_field(field) for field, _ in sort_spec)
+        if isinstance(bits, SqliteFilter) and indexed:
+            return bits.ids(self._order_by(sort_spec), stop - start, start)
+        if not sort_spec:
+            return bitmap_select(bits, start, stop)
+        if not indexed:
+            indices = bits.ids() if isinstance(bits, SqliteFilter) else bitmap_to_indices(bits)
+            keys = self._row_keys(indices, sort_spec)
+            for position, (field, reverse) in reversed(list(enumerate(sort_spec))):
+                indices.sort(key=lambda i: keys[i][position], reverse=reverse)
+            return indices[start:stop]
+        order = self._order_by(sort_spec)
+        if bits == (1 << self.size) - 1:
+            return self._ids('1', [], f'{order} LIMIT {stop - start} OFFSET {start}')
+        data = bits.to_bytes((self.size + 7) // 8, 'little')
+        result = []
+        seen = 0
+        for (index,) in self.dataset.execute(f'SELECT id FROM rows WHERE id < ? ORDER BY {order}', [self.size]):
+            if data[index >> 3] >> (index & 7) & 1:
+                if seen >= start:
+                    result.append(index)
+                seen += 1
+                if seen >= stop:
+                    break
+        return result
+
+    def _after_clause(self, sort_spec, keys, last_index):
+        if not sort_spec:
+            return 'id > ?', [last_index]
+        (field, reverse), key = sort_spec[0], list(keys[0])
+        columns = f'({field}_rank, {field}_num, {field}_text)'
+        rest, params = self._after_clause(sort_spec[1:], keys[1:], last_index)
+        operator = '<' if reverse else '>'
+        return f'({columns} {operator} (?, ?, ?) OR ({columns} = (?, ?, ?) AND {rest}))', key + key + params
+
+    def after(self, bits, sort_spec, keys, last_index):
+        """Return the rows of a bitset that come after a keyset position in sort order."""
+        indexed = all(self.ensure_field(field) for field, _ in sort_spec)
+        if isinstance(bits, SqliteFilter) and indexed:
+            return bits.narrow(*self._after_clause(sort_spec, keys, last_index))
+        if not sort_spec:
+            return bits >> (last_index + 1) << (last_index + 1)
+        if indexed:
+            where, params = self._after_clause(sort_spec, keys, last_index)
+            return bits & indices_to_bitmap(self._ids(where, params), self.size)
+        indices = bits.ids() if isinstance(bits, SqliteFilter) else bitmap_to_indices(bits)
+        row_keys = self._row_keys(indices, sort_spec)
+        later = []
+        for index in indices:
+            for (field, reverse), row_key, key in zip(sort_spec, row_keys[index], keys):
+                if row_key != key:
+                    if (row_key < key) if reverse else (row_key > key):
+                        later.append(index)
+                    break
+            else:
+                if index > last_index:
+                    later.append(index)
+        return indices_to_bitmap(later, self.size)
+
+class SqliteTextIndex:
+    """TrigramIndex counterpart that matches the lowercase query text with SQL."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def match(self, term, within=None):
+        """Return the filter of rows whose text contains the term, narrowing within when it is a filter."""
+        if isinstance(within, SqliteFilter):
+            return within.narrow(*_text_condition(term))
+        return SqliteFilter(self.dataset, [_text_condition(term)])
+
+class SqliteAggregates:
+    """ChartAggregates counterpart that counts display values with GROUP BY, optionally over a filter.
+
+    Fields without indexed columns are counted from the decoded metadata.
+    """
+
+    supports_filters = True
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def _where(self, search_params):
+        conditions = _field_conditions(search_params)
+        if (search_params or {}).get('text'):
+            conditions.append(_text_condition(search_params['text']))
+        return SqliteFilter(self.dataset, conditions).where()
+
+    def _metadata(self, search_params):
+        where, params = self._where(search_params)
+        for (metadata,) in self.dataset.execute(f'SELECT metadata FROM rows WHERE {where} ORDER BY id', params):
+            yield json.loads(metadata)
+
+    def value_counts(self, field, search_params=None):
+        """Return a Counter of display value to row count, in order of each value's first row."""
+        if field not in INDEXED_FIELDS:
+            return Counter(display_value(metadata.get(field, MISSING)) for metadata in self._metadata(search_params))
+        where, params = self._where(search_params)
+        rows = self.dataset.execute(
+            f'SELECT {field}_display, COUNT(*) FROM rows WHERE {where} GROUP BY {field}_display '
+            f'ORDER BY {_first_row(field)}', params)
+        return Counter(dict(rows))
+
+    def pair_map(self, first, second, search_params=None):
+        """Return {first display value: Counter of second display value to row count}."""
+        pair_map = {}
+        if first in INDEXED_FIELDS and second in INDEXED_FIELDS:
+            where, params = self._where(search_params)
+            rows = self.dataset.execute(
+                f'SELECT {first}_display, {second}_display, COUNT(*) FROM rows WHERE {where} '
+                f'GROUP BY {first}_display, {second}_display ORDER BY {_first_row(first)}, {_first_row(second)}', params)
+            for first_value, second_value, count in rows:
+                pair_map.setdefault(first_value, Counter())[second_value] = count
+            return pair_map
+        for metadata in self._metadata(search_params):
+            first_value = display_value(metadata.get(first, MISSING))
+            pair_map.setdefault(first_value, Counter())[display_value(metadata.get(second, MISSING))] += 1
+        return pair_map
+
+class SqliteDataset(Sequence):
+    """Dataset stored in a SQLite database in WAL mode and shared by every worker process.
+
+    Rows are kept as JSON next to indexed display, filter and sort columns
+    for the metadata fields, so filtering, sorting, paging and chart counts
+    run as SQL instead of over per-worker copies of the rows. Changes are
+    written straight to the database; the version and row count live in its
+    meta table and are re-read by refresh().
+    """
+
+    def __init__(self, dataset_id, path, synchronous=True):
+        self.dataset_id = dataset_id
+        self.path = path
+        self.synchronous = synchronous
+        self.version = 0
+        self._size = 0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.filter_index = SqliteIndex(self)
+        self.text_index = SqliteTextIndex(self)
+        self.chart_aggregates = SqliteAggregates(self)
+        self.refresh()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute(f"PRAGMA synchronous={'FULL' if self.synchronous else 'NORMAL'}")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def execute(self, sql, params=()):
+        return self._connection().execute(sql, params)
+
+    def refresh(self):
+        """Re-read the version and row count, which other workers may have changed."""
+        meta = dict(self.execute('SELECT key, value FROM meta'))
+        self.version = meta['version']
+        self._size = meta['rows']
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Row index out of range: {index}")
+        query, metadata = self.execute('SELECT query, metadata FROM rows WHERE id = ?', [index]).fetchone()
+        return QueryData(json.loads(query), json.loads(metadata))
+
+    def __iter__(self):
+        for query, metadata in self.execute('SELECT query, metadata FROM rows WHERE id < ? ORDER BY id', [len(self)]):
+            yield QueryData(json.loads(query), json.loads(metadata))
+
+    def metadata(self, index):
+        """Decode only the metadata of a row."""
+        return json.loads(self.execute('SELECT metadata FROM rows WHERE id = ?', [index]).fetchone()[0])
+
+    def metadata_many(self, indices):
+        """Yield (index, metadata) for the given rows."""
+        for batch in _batches(list(indices)):
+            rows = self.execute(f"SELECT id, metadata FROM rows WHERE id IN ({', '.join('?' * len(batch))})", batch)
+            for index, metadata in rows:
+                yield index, json.loads(metadata)
+
+    def column(self, field):
+        """Return per-row access to a metadata field."""
+        return SqliteColumn(self, field)
+
+    def rows_differing(self, indices, metadata):
+        """Return the indices whose metadata does not already hold every one of the given values."""
+        keys = {field: value_key(value) for field, value in metadata.items()}
+        return sorted(
+            index for index, row_metadata in self.metadata_many(indices)
+            if any(value_key(row_metadata.get(field, MISSING)) != key for field, key in keys.items())
+        )
+
+    def _assign(self, connection, indices, metadata):
+        updates = []
+        for index, row_metadata in self.metadata_many(indices):
+            row_metadata = {**row_metadata, **metadata}
+            updates.append([json.dumps(row_metadata, ensure_ascii=False)] + field_values(row_metadata) + [index])
+        columns = ['metadata'] + ROW_COLUMNS[4:]
+        connection.executemany(f"UPDATE rows SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?", updates)
+
+    def apply(self, change):
+        """Write a change record to the database in one transaction and return the new version."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.refresh()
+            if change['op'] == 'update':
+                row = QueryData.from_dict(change['row'])
+                columns = ROW_COLUMNS[1:]
+                connection.execute(f"UPDATE rows SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                                   row_values(change['index'], row)[1:] + [change['index']])
+            elif change['op'] in ('append', 'extend'):
+                rows = [change['row']] if change['op'] == 'append' else change['rows']
+                connection.executemany(_insert_sql(), [
+                    row_values(index, QueryData.from_dict(row)) for index, row in enumerate(rows, self._size)
+                ])
+                self._size += len(rows)
+            elif change['op'] == 'assign':
+                self._assign(connection, change['indices'], change['metadata'])
+            else:
+                raise ValueError(f"Unknown change operation: {change['op']}")
+            self.version += 1
+            connection.executemany('UPDATE meta SET value = ? WHERE key = ?',
+                                   [(self.version, 'version'), (self._size, 'rows')])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            self.refresh()
+            raise
+        return self.version
+
+    def close(self):
+        """Close every connection opened on the database."""
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
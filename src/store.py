@@ -0,0 +1,768 @@
+import os
+import json
+import shutil
+import weakref
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from src.data import QueryData, PARALLEL_PARSE_THRESHOLD
+from src.columns import MISSING, CategoricalColumn, build_columns, value_key
+from src.lazy import LazyDataset, LineIndex, build_line_index, DEFAULT_ROW_CACHE_SIZE
+from src.columnar import ColumnarDataset, load_columnar
+from src.bitmaps import FilterIndex
+from src.textindex import TrigramIndex
+from src.aggregates import ChartAggregates
+from src.journal import ChangeJournal, SEAL_OP, read_seal, write_synced, sync_file
+from src.sqlstore import SQLITE_FILENAME, SqliteDataset, load_sqlite
+from src.parsecache import ParseCache, DEFAULT_PARSE_CACHE_BYTES, file_digest
+from src.janitor import retire
+from src.utils import save_data_to_file
+
+SOURCE_FILENAME = 'source.tsv'
+BASE_FILENAME = 'BASE'
+BASES_DIRNAME = '_bases'
+CHANGES_FILENAME = 'changes.jsonl'
+CURRENT_FILENAME = 'CURRENT'
+DEFAULT_COMPACT_BYTES = 64 * 1024 * 1024
+
+def generation_paths(dataset_dir, generation):
+    """Return the source and journal paths of a dataset generation.
+
+    Generation 0 is the uploaded file; each compaction writes a snapshot of
+    the rows and an empty journal under the next generation number.
+    """
+    if generation == 0:
+        return os.path.join(dataset_dir, SOURCE_FILENAME), os.path.join(dataset_dir, CHANGES_FILENAME)
+    return (os.path.join(dataset_dir, f'snapshot-{generation}.tsv'),
+            os.path.join(dataset_dir, f'changes-{generation}.jsonl'))
+
+class PatchedRow:
+    """QueryData-compatible row of the base with metadata values set over it.
+
+    The base row is only decoded when the row is read, so a bulk edit of
+    many rows does not parse any of them.
+    """
+
+    __slots__ = ('_base', '_index', 'patch')
+
+    def __init__(self, base, index, patch):
+        self._base = base
+        self._index = index
+        self.patch = patch
+
+    @property
+    def query(self):
+        return self._base[self._index].query
+
+    @property
+    def metadata(self):
+        return {**self._base[self._index].metadata, **self.patch}
+
+    def to_dict(self):
+        """Convert the row to a JSON-serializable dictionary."""
+        return {
+            'query': self.query,
+            'metadata': self.metadata
+        }
+
+class Dataset(Sequence):
+    """Read-only handle to a parsed dataset held by the registry.
+
+    Rows come from an immutable base (a LazyDataset over the source file, a
+    ColumnarDataset, or a plain list) with edited rows and added rows kept
+    alongside it. The metadata columns always reflect the current rows, and
+    derived indexes built over them are updated row by row on each change.
+    A base may be shared by several datasets: its columns are copied the
+    first time a change touches them, and a shared base is left open on close.
+    Derived indexes borrowed from another dataset are dropped on the first
+    change and rebuilt from this dataset's own columns.
+    """
+
+    def __init__(self, dataset_id, base, version=0, generation=0, shared=False):
+        self.dataset_id = dataset_id
+        self.version = version
+        self.generation = generation
+        self.shared = shared
+        self._base = base
+        self._overrides = {}
+        self._appended = []
+        base_columns = getattr(base, 'columns', None)
+        self.columns = dict(base_columns or build_columns(base))
+        self._owned_columns = set() if base_columns else set(self.columns)
+        self._indexes = {}
+        self._indexes_shared = False
+        self._journal = None
+        self._log_offset = 0
+
+    def __len__(self):
+        return len(self._base) + len(self._appended)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Row index out of range: {index}")
+        row = self._overrides.get(index)
+        if row is not None:
+            return row
+        if index < len(self._base):
+            return self._base[index]
+        return self._appended[index - len(self._base)]
+
+    def part(self, index, name):
+        """Return the 'query' or 'metadata' of one row, decoding only that part of a base row where possible."""
+        base_part = getattr(self._base, name, None)
+        if base_part is None or index in self._overrides or index >= len(self._base):
+            return getattr(self[index], name)
+        return base_part(index)
+
+    def _query(self, index):
+        return self.part(index, 'query')
+
+    def parts(self, name):
+        """Iterate over the 'query' or 'metadata' of every row, decoding only that part of base rows where possible."""
+        for index in range(len(self)):
+            yield self.part(index, name)
+
+    def rows_differing(self, indices, metadata):
+        """Return the indices whose metadata does not already hold every one of the given values.
+
+        Indexed fields are compared by code; only rows that match on all of
+        them have their metadata decoded for the remaining fields.
+        """
+        keys = {field: value_key(value) for field, value in metadata.items()}
+        indexed = [(self.columns[field].codes, self.columns[field]._lookup.get(key))
+                   for field, key in keys.items() if field in self.columns]
+        others = [(field, key) for field, key in keys.items() if field not in self.columns]
+        result = []
+        for index in indices:
+            if any(codes[index] != code for codes, code in indexed):
+                result.append(index)
+            elif others:
+                row_metadata = self.part(index, 'metadata')
+                if any(value_key(row_metadata.get(field, MISSING)) != key for field, key in others):
+                    result.append(index)
+        return result
+
+    @property
+    def source_path(self):
+        """Path of the source file that unedited base rows are read from, or None."""
+        return getattr(self._base, 'file_path', None)
+
+    def source_bytes(self, start, end):
+        """Return a byte range of the source file."""
+        return self._base.source_bytes(start, end)
+
+    def export_runs(self):
+        """Yield the rows in order for export, with runs of unedited base rows as source byte spans.
+
+        Edited and added rows are yielded as rows, and each run of base rows
+        between them as a (start, end) byte span of the source file that can
+        be copied verbatim. Bases without a source file yield every row.
+        """
+        line_span = getattr(self._base, 'line_span', None)
+        if line_span is None:
+            yield from self
+            return
+        base_size = len(self._base)
+        dirty = {index for index in self._overrides if index < base_size}
+        if base_size and not self._base.line_bytes(base_size - 1).endswith(b'\n'):
+            dirty.add(base_size - 1)
+        start = 0
+        for index in sorted(dirty) + [base_size]:
+            if index > start:
+                yield line_span(start, index)
+            if index < base_size:
+                yield self[index]
+            start = index + 1
+        yield from self._appended
+
+    def column(self, field):
+        """Return the categorical column of a metadata field, building it on first use."""
+        column = self.columns.get(field)
+        if column is None:
+            column = CategoricalColumn()
+            for metadata in self.parts('metadata'):
+                column.append(metadata.get(field, MISSING))
+            self.columns[field] = column
+            self._owned_columns.add(field)
+        return column
+
+    def _writable_column(self, field):
+        """Return a column to change, first copying it if it still belongs to the base."""
+        column = self.columns[field]
+        if field not in self._owned_columns:
+            column = self.columns[field] = CategoricalColumn.from_parts(column.values, array('I', column.codes))
+            self._owned_columns.add(field)
+        return column
+
+    def _derived_index(self, name, factory):
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = factory()
+        return index
+
+    @property
+    def filter_index(self):
+        """Bitmap filter index over the metadata columns, built on first use."""
+        return self._derived_index('filter', lambda: FilterIndex(self.columns, len(self)))
+
+    @property
+    def text_index(self):
+        """Trigram index over the query text, built on first use."""
+        return self._derived_index('text', lambda: TrigramIndex(self.parts('query'), self._query))
+
+    @property
+    def chart_aggregates(self):
+        """Chart counts over the metadata columns, built on first use."""
+        return self._derived_index('charts', lambda: ChartAggregates(self.columns))
+
+    def warm_indexes(self):
+        """Build every derived index now rather than on first use."""
+        for name in ('filter_index', 'text_index', 'chart_aggregates'):
+            getattr(self, name)
+
+    def share_indexes(self, other):
+        """Start from the columns and derived indexes of an unchanged dataset over the same base.
+
+        The column dict and the filter and chart indexes are shallow copies,
+        sharing the columns and value bitsets but never adding to other's
+        containers, so other stays as it was. The text index is only read by
+        searches, so it is borrowed as is until the first change.
+        """
+        self.columns = dict(other.columns)
+        self._owned_columns = set()
+        self._indexes = {}
+        for name, index in other._indexes.items():
+            self._indexes[name] = index if name == 'text' else index.copy(self.columns)
+        self._indexes_shared = 'text' in self._indexes
+
+    def _unshare_indexes(self):
+        self._indexes.pop('text', None)
+        self._indexes_shared = False
+
+    def _set_columns(self, index, row):
+        changes = {}
+        for field in list(self.columns):
+            column = self._writable_column(field)
+            value = row.metadata.get(field, MISSING)
+            if index == len(column):
+                old_code = None
+                column.append(value)
+            else:
+                old_code = column.codes[index]
+                column.set(index, value)
+            changes[field] = (old_code, column.codes[index])
+        for derived in self._indexes.values():
+            derived.row_changed(index, changes, row)
+
+    def _extend(self, rows):
+        start = len(self)
+        self._appended.extend(rows)
+        for field in list(self.columns):
+            column = self._writable_column(field)
+            for row in rows:
+                column.append(row.metadata.get(field, MISSING))
+        for derived in self._indexes.values():
+            derived.rows_appended(start, rows)
+
+    def _assign(self, indices, metadata):
+        old_codes = {}
+        for field, value in metadata.items():
+            if field not in self.columns:
+                continue
+            column = self._writable_column(field)
+            old_codes[field] = [column.codes[index] for index in indices]
+            code = column.code_for(value)
+            for index in indices:
+                column.codes[index] = code
+        base_size = len(self._base)
+        for index in indices:
+            row = self._overrides.get(index)
+            if index >= base_size:
+                row = self._appended[index - base_size]
+                self._appended[index - base_size] = QueryData(row.query, {**row.metadata, **metadata})
+            elif row is None:
+                self._overrides[index] = PatchedRow(self._base, index, metadata)
+            elif isinstance(row, PatchedRow):
+                self._overrides[index] = PatchedRow(self._base, index, {**row.patch, **metadata})
+            else:
+                self._overrides[index] = QueryData(row.query, {**row.metadata, **metadata})
+        for derived in self._indexes.values():
+            derived.rows_changed(indices, old_codes)
+
+    def _apply_change(self, change):
+        """Apply a single change record and bump the version."""
+        if self._indexes_shared:
+            self._unshare_indexes()
+        if change['op'] == 'update':
+            row = QueryData.from_dict(change['row'])
+            index = change['index']
+            for derived in self._indexes.values():
+                derived.row_changing(index)
+            if index < len(self._base):
+                self._overrides[index] = row
+            else:
+                self._appended[index - len(self._base)] = row
+            self._set_columns(index, row)
+        elif change['op'] == 'append':
+            row = QueryData.from_dict(change['row'])
+            index = len(self)
+            self._appended.append(row)
+            self._set_columns(index, row)
+        elif change['op'] == 'extend':
+            self._extend([QueryData.from_dict(d) for d in change['rows']])
+        elif change['op'] == 'assign':
+            self._assign(change['indices'], change['metadata'])
+        else:
+            raise ValueError(f"Unknown change operation: {change['op']}")
+        self.version += 1
+
+    def frozen(self):
+        """Return a handle to the current rows that later changes do not affect, sharing the base."""
+        copy = Dataset(self.dataset_id, self._base, self.version, self.generation, shared=True)
+        copy._overrides = dict(self._overrides)
+        copy._appended = list(self._appended)
+        return copy
+
+    def adopt_indexes(self, other):
+        """Take over the columns and derived indexes of another handle to the same rows."""
+        if other.version == self.version and len(other) == len(self):
+            self.columns = other.columns
+            self._owned_columns = other._owned_columns
+            self._indexes = other._indexes
+            self._indexes_shared = other._indexes_shared
+            if 'text' in self._indexes and not self._indexes_shared:
+                self._indexes['text'].query_of = self._query
+
+    def close_journal(self):
+        """Close the journal file handle, if open."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def close(self):
+        """Release the journal, and the base rows unless other datasets share them."""
+        self.close_journal()
+        close = getattr(self._base, 'close', None)
+        if close is not None and not self.shared:
+            close()
+
+class DatasetRegistry:
+    """Per-process registry of parsed datasets keyed by dataset ID and version.
+
+    Each dataset owns a folder under DATASET_FOLDER holding an append-only
+    change journal, so a worker that has not seen a dataset yet (or holds an
+    older version) can rebuild or catch up from disk. Uploaded files are kept
+    once per content hash under DATASET_FOLDER/_bases, and every dataset of
+    the same file shares one parsed base, holding only its own changes.
+    Once a journal grows past JOURNAL_COMPACT_BYTES it is folded into a new
+    snapshot of the source in the background. With DATASET_STORAGE 'sqlite'
+    the folder instead holds a SQLite database that every worker reads and
+    writes directly.
+    """
+
+    def __init__(self, app, max_datasets=8):
+        self.app = app
+        self.max_datasets = max_datasets
+        self._datasets = OrderedDict()
+        self._lock = threading.RLock()
+        self._compacting = set()
+        self._parse_cache = None
+        self._bases = weakref.WeakValueDictionary()
+        self._pinned = {}
+
+    def _dataset_dir(self, dataset_id):
+        if not dataset_id or not dataset_id.isalnum():
+            raise ValueError(f"Invalid dataset ID: {dataset_id}")
+        return os.path.normpath(os.path.join(self.app.config['DATASET_FOLDER'], dataset_id))
+
+    def _remember(self, dataset):
+        self._datasets[dataset.dataset_id] = dataset
+        self._datasets.move_to_end(dataset.dataset_id)
+        while len(self._datasets) > self.max_datasets:
+            evicted_id, evicted = self._datasets.popitem(last=False)
+            evicted.close()
+            self.app.logger.info(f"Evicted dataset {evicted_id} from registry")
+
+    def new_sink(self):
+        """Return an empty parser sink for the configured DATASET_STORAGE.
+
+        'mmap' (the default) keeps rows in the source file behind a LineIndex;
+        'memory' keeps them in a compact ColumnarDataset; 'sqlite' loads the
+        stored file into a database instead, so it returns None.
+        """
+        storage = self.app.config.get('DATASET_STORAGE', 'mmap')
+        if storage == 'sqlite':
+            return None
+        if storage == 'memory':
+            return ColumnarDataset()
+        return LineIndex()
+
+    def _open_sqlite(self, dataset_id, db_path):
+        return SqliteDataset(dataset_id, db_path, synchronous=self.app.config.get('JOURNAL_FSYNC', True))
+
+    @property
+    def parse_cache(self):
+        """The ParseCache under PARSE_CACHE_FOLDER, or None if it is not configured."""
+        folder = self.app.config.get('PARSE_CACHE_FOLDER')
+        max_bytes = self.app.config.get('PARSE_CACHE_BYTES', DEFAULT_PARSE_CACHE_BYTES)
+        if not folder or not max_bytes:
+            return None
+        with self._lock:
+            if self._parse_cache is None or self._parse_cache.folder != folder:
+                self._parse_cache = ParseCache(folder, max_bytes)
+            return self._parse_cache
+
+    def _parse_source(self, source_path):
+        threshold = self.app.config.get('PARALLEL_PARSE_THRESHOLD', PARALLEL_PARSE_THRESHOLD)
+        if isinstance(self.new_sink(), ColumnarDataset):
+            return load_columnar(source_path, parallel_threshold=threshold)
+        return build_line_index(source_path, parallel_threshold=threshold)
+
+    def _open_source(self, source_path, parsed=None, digest=None):
+        """Open a source file, parsing it unless it was parsed while uploading or is in the parse cache."""
+        cache = self.parse_cache
+        if parsed is None and cache is not None:
+            digest = digest or file_digest(source_path)
+            kind = 'columnar' if isinstance(self.new_sink(), ColumnarDataset) else 'lines'
+            parsed = cache.get(digest, kind, os.path.getsize(source_path))
+            if parsed is None:
+                parsed = self._parse_source(source_path)
+                cache.put(digest, parsed)
+        elif parsed is None:
+            parsed = self._parse_source(source_path)
+        if isinstance(parsed, ColumnarDataset):
+            return parsed
+        cache_size = self.app.config.get('ROW_CACHE_SIZE', DEFAULT_ROW_CACHE_SIZE)
+        return LazyDataset(source_path, parsed, cache_size=cache_size)
+
+    def _base_path(self, digest):
+        return os.path.join(self.app.config['DATASET_FOLDER'], BASES_DIRNAME, f'{digest}.tsv')
+
+    def _shared_base(self, digest, parsed=None):
+        """Return the parsed base of an uploaded file, shared by every dataset of the same content."""
+        base_path = self._base_path(digest)
+        with self._lock:
+            base = self._bases.get(base_path)
+            if base is None:
+                base = self._bases[base_path] = self._open_source(base_path, parsed, digest)
+            return base
+
+    def _base_dataset(self, dataset_id, digest, parsed=None, version=0):
+        """Return a new dataset over the shared base of a file, starting from the indexes of a pinned one."""
+        dataset = Dataset(dataset_id, self._shared_base(digest, parsed), version, shared=True)
+        pinned = self._pinned.get(self._base_path(digest))
+        if pinned is not None:
+            dataset.share_indexes(pinned)
+        return dataset
+
+    def pin(self, source_path):
+        """Load a reference file as a base that stays loaded, with its derived indexes built.
+
+        Datasets of the same content share the base and start from these
+        indexes. Pinning before gunicorn forks its workers lets every worker
+        serve the file without parsing it or building its indexes again.
+        """
+        digest = file_digest(source_path)
+        base_path = self._base_path(digest)
+        if not os.path.exists(base_path):
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            shutil.copyfile(source_path, base_path + '.tmp')
+            os.replace(base_path + '.tmp', base_path)
+        pinned = Dataset(digest, self._shared_base(digest), shared=True)
+        pinned.warm_indexes()
+        with self._lock:
+            self._pinned[base_path] = pinned
+        self.app.logger.info(f"Pinned {len(pinned)} data points from {source_path}")
+        return pinned
+
+    def _store_base(self, source_path, digest):
+        """Move an upload to the shared base file for its content and return whether it was new."""
+        base_path = self._base_path(digest)
+        if os.path.exists(base_path):
+            os.utime(base_path)
+            os.remove(source_path)
+            return False
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        shutil.move(source_path, base_path)
+        return True
+
+    def create(self, source_path, upload=None):
+        """Register an uploaded TSV file, taking ownership of it.
+
+        The file is kept once per content hash; a dataset of a file that is
+        already stored shares its parsed base. Otherwise, if the upload was
+        parsed into a sink while it streamed in, that sink is reused, or the
+        file is loaded from the parse cache or parsed here. Parse errors raise
+        ValueError and leave nothing registered.
+        """
+        parsed = upload.finish() if upload is not None else None
+        dataset_id = os.urandom(16).hex()
+        dataset_dir = self._dataset_dir(dataset_id)
+        os.makedirs(dataset_dir, exist_ok=True)
+        digest, new_base = None, False
+        try:
+            if self.app.config.get('DATASET_STORAGE', 'mmap') == 'sqlite':
+                stored_path = os.path.join(dataset_dir, SOURCE_FILENAME)
+                shutil.move(source_path, stored_path)
+                db_path = os.path.join(dataset_dir, SQLITE_FILENAME)
+                load_sqlite(stored_path, db_path)
+                dataset = self._open_sqlite(dataset_id, db_path)
+            else:
+                digest = upload.digest if upload is not None else file_digest(source_path)
+                new_base = self._store_base(source_path, digest)
+                with open(os.path.join(dataset_dir, BASE_FILENAME), 'w', encoding='utf-8') as f:
+                    f.write(digest)
+                dataset = self._base_dataset(dataset_id, digest, parsed)
+        except Exception:
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            if new_base and self._base_path(digest) not in self._bases:
+                os.remove(self._base_path(digest))
+            raise
+        with self._lock:
+            self._remember(dataset)
+        self.app.logger.info(f"Loaded {len(dataset)} data points into dataset {dataset_id}")
+        return dataset
+
+    def get(self, dataset_id, version=0):
+        """Return the dataset for the given ID at least at the given version, or None."""
+        with self._lock:
+            dataset = self._datasets.get(dataset_id)
+            if dataset is None:
+                dataset = self._load(dataset_id)
+            elif isinstance(dataset, SqliteDataset):
+                dataset.refresh()
+            elif dataset.version < version:
+                dataset = self._catch_up(dataset)
+            if dataset is None:
+                return None
+            self._remember(dataset)
+            return dataset
+
+    def exists(self, dataset_id):
+        """Return whether a dataset's folder is still on disk, without loading the dataset."""
+        try:
+            return os.path.isdir(self._dataset_dir(dataset_id))
+        except ValueError:
+            return False
+
+    def _current_generation(self, dataset_dir):
+        """Return the (generation, version) to load, following seals past a stale CURRENT file."""
+        try:
+            with open(os.path.join(dataset_dir, CURRENT_FILENAME), encoding='utf-8') as f:
+                current = json.load(f)
+            generation, version = current['generation'], current['version']
+        except FileNotFoundError:
+            generation, version = 0, 0
+        while True:
+            seal = read_seal(generation_paths(dataset_dir, generation)[1])
+            if seal is None:
+                return generation, version
+            generation, version = seal['generation'], seal['version']
+
+    def _open(self, dataset_id, generation, version):
+        dataset_dir = self._dataset_dir(dataset_id)
+        if generation == 0:
+            try:
+                with open(os.path.join(dataset_dir, BASE_FILENAME), encoding='utf-8') as f:
+                    digest = f.read().strip()
+            except FileNotFoundError:
+                digest = None
+            if digest and os.path.exists(self._base_path(digest)):
+                return self._base_dataset(dataset_id, digest, version=version)
+        source_path = generation_paths(dataset_dir, generation)[0]
+        if not os.path.exists(source_path):
+            self.app.logger.warning(f"No source file for dataset {dataset_id}")
+            return None
+        return Dataset(dataset_id, self._open_source(source_path), version, generation)
+
+    def _load(self, dataset_id):
+        """Rebuild a dataset from its latest source snapshot and journal."""
+        try:
+            dataset_dir = self._dataset_dir(dataset_id)
+        except ValueError:
+            return None
+        db_path = os.path.join(dataset_dir, SQLITE_FILENAME)
+        if os.path.exists(db_path):
+            return self._open_sqlite(dataset_id, db_path)
+        dataset = self._open(dataset_id, *self._current_generation(dataset_dir))
+        if dataset is None:
+            return None
+        dataset = self._catch_up(dataset)
+        self.app.logger.info(f"Loaded dataset {dataset_id} from disk at version {dataset.version}")
+        return dataset
+
+    def _journal(self, dataset):
+        if dataset._journal is None:
+            journal_path = generation_paths(self._dataset_dir(dataset.dataset_id), dataset.generation)[1]
+            dataset._journal = ChangeJournal(journal_path, sync=self.app.config.get('JOURNAL_FSYNC', True))
+        return dataset._journal
+
+    def _replay(self, dataset):
+        """Apply journal records written since the dataset was last synced and return the seal, if any."""
+        changes, dataset._log_offset, seal = self._journal(dataset).read(dataset._log_offset)
+        for change in changes:
+            dataset._apply_change(change)
+        return seal
+
+    def _catch_up(self, dataset):
+        """Bring a dataset up to date, moving to a newer generation if its journal was compacted."""
+        seal = self._replay(dataset)
+        if seal is None:
+            return dataset
+        current = self._open(dataset.dataset_id, seal['generation'], seal['version'])
+        if current is None:
+            return None
+        current.adopt_indexes(dataset)
+        dataset.close_journal()
+        return self._catch_up(current)
+
+    def _record(self, dataset, change):
+        """Append a change to the journal and apply it in memory, returning once it is durable."""
+        if isinstance(dataset, SqliteDataset):
+            return dataset.apply(change)
+        with self._lock:
+            dataset = self._datasets.get(dataset.dataset_id, dataset)
+            while True:
+                journal = self._journal(dataset)
+                with journal.locked():
+                    current = self._catch_up(dataset)
+                    if current is dataset:
+                        if journal.size > dataset._log_offset:
+                            journal.truncate(dataset._log_offset)
+                        sequence, dataset._log_offset = journal.append(change)
+                        dataset._apply_change(change)
+                        break
+                dataset = current
+            self._remember(dataset)
+            version = dataset.version
+        journal.commit(sequence)
+        self._maybe_compact(dataset)
+        return version
+
+    def update_row(self, dataset, index, data_point):
+        """Replace a single row and return the new dataset version."""
+        if not 0 <= index < len(dataset):
+            raise IndexError(f"Row index out of range: {index}")
+        return self._record(dataset, {'op': 'update', 'index': index, 'row': data_point.to_dict()})
+
+    def append_row(self, dataset, data_point):
+        """Append a single row and return the new dataset version."""
+        return self._record(dataset, {'op': 'append', 'row': data_point.to_dict()})
+
+    def assign_metadata(self, dataset, indices, metadata):
+        """Set metadata values on the given rows as one change.
+
+        Returns (rows changed, new version); rows that already hold the values
+        are left out of the change, and nothing is recorded if none remain.
+        """
+        if any(not 0 <= index < len(dataset) for index in indices):
+            raise IndexError("Row index out of range")
+        changed = dataset.rows_differing(indices, metadata)
+        if not changed:
+            return 0, dataset.version
+        return len(changed), self._record(dataset, {'op': 'assign', 'indices': changed, 'metadata': metadata})
+
+    def append_rows(self, dataset, data_points):
+        """Append a batch of rows as one change and return the new dataset version."""
+        return self._record(dataset, {'op': 'extend', 'rows': [data_point.to_dict() for data_point in data_points]})
+
+    def _maybe_compact(self, dataset):
+        limit = self.app.config.get('JOURNAL_COMPACT_BYTES', DEFAULT_COMPACT_BYTES)
+        with self._lock:
+            if not isinstance(dataset, Dataset) or not limit or dataset._log_offset < limit or dataset.dataset_id in self._compacting:
+                return
+            self._compacting.add(dataset.dataset_id)
+        threading.Thread(target=self.compact, args=(dataset.dataset_id,), daemon=True).start()
+
+    def compact(self, dataset_id):
+        """Fold a dataset's journal into a new source snapshot and return the new generation.
+
+        The snapshot is written from a frozen copy of the rows without holding
+        the lock, so changes keep being recorded meanwhile; records journaled
+        after the copy are carried over into the new generation's journal.
+        Returns None if another worker compacted the dataset first, or if the
+        dataset is stored in SQLite and has no journal.
+        """
+        try:
+            with self._lock:
+                dataset = self.get(dataset_id)
+                if not isinstance(dataset, Dataset):
+                    return None
+                frozen, offset = dataset.frozen(), dataset._log_offset
+            generation = dataset.generation + 1
+            dataset_dir = self._dataset_dir(dataset_id)
+            source_path, journal_path = generation_paths(dataset_dir, generation)
+            save_data_to_file(source_path + '.tmp', frozen)
+            sync_file(source_path + '.tmp')
+            with self._lock:
+                journal = self._journal(dataset)
+                with journal.locked():
+                    _, end, seal = journal.read(offset)
+                    if seal is not None:
+                        os.remove(source_path + '.tmp')
+                        return None
+                    write_synced(journal_path, journal.read_bytes(offset, end))
+                    os.replace(source_path + '.tmp', source_path)
+                    sequence, _ = journal.append({'op': SEAL_OP, 'generation': generation, 'version': frozen.version})
+                    journal.commit(sequence)
+                write_synced(os.path.join(dataset_dir, CURRENT_FILENAME),
+                             json.dumps({'generation': generation, 'version': frozen.version}).encode('utf-8'))
+            if generation >= 2:
+                for path in generation_paths(dataset_dir, generation - 2):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.app.logger.info(f"Compacted dataset {dataset_id} into generation {generation} at version {frozen.version}")
+            current = self._open(dataset_id, generation, frozen.version)
+            with self._lock:
+                dataset = self._datasets.get(dataset_id)
+                if dataset is not None and dataset.generation < generation:
+                    self._replay(dataset)
+                    current.adopt_indexes(dataset)
+                    dataset.close_journal()
+                current = self._catch_up(current) if current is not None else None
+                if current is not None:
+                    self._remember(current)
+            return generation
+        finally:
+            with self._lock:
+                self._compacting.discard(dataset_id)
+
+    def forget(self, dataset_id):
+        """Close and forget this process's handle to a dataset, leaving its folder."""
+        with self._lock:
+            dataset = self._datasets.pop(dataset_id, None)
+        if dataset is not None:
+            dataset.close()
+
+    def drop(self, dataset_id):
+        """Forget a dataset and retire its folder to the trash for the janitor to delete."""
+        self.forget(dataset_id)
+        try:
+            dataset_dir = self._dataset_dir(dataset_id)
+        except ValueError:
+            return
+        if os.path.exists(dataset_dir):
+            retire(dataset_dir)
+
+    def unreferenced_bases(self):
+        """Return the shared base files that no dataset folder names and that no dataset in this process uses."""
+        dataset_folder = self.app.config['DATASET_FOLDER']
+        bases_dir = os.path.join(dataset_folder, BASES_DIRNAME)
+        if not os.path.isdir(bases_dir):
+            return []
+        referenced = set()
+        for name in os.listdir(dataset_folder):
+            try:
+                with open(os.path.join(dataset_folder, name, BASE_FILENAME), encoding='utf-8') as f:
+                    referenced.add(self._base_path(f.read().strip()))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        with self._lock:
+            referenced.update(self._bases.keys())
+        return [os.path.join(bases_dir, name) for name in sorted(os.listdir(bases_dir))
+                if os.path.join(bases_dir, name) not in referenced]
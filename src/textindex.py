@@ -0,0 +1,117 @@
+from array import array
+from bisect import bisect_left, insort
+from src.bitmaps import indices_to_bitmap
+
+GRAM_SIZE = 3
+
+def query_text(query):
+    """Return the text of the first query turn, or '' if there is none."""
+    if query and isinstance(query[0], dict):
+        text = query[0].get('text', '')
+        return text if isinstance(text, str) else ''
+    return ''
+
+def grams(text, size=GRAM_SIZE):
+    """Return the set of distinct n-grams of a normalized text."""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class TrigramIndex:
+    """Inverted index from lowercase trigrams of the query text to row indices.
+
+    Postings are kept sorted and exact: before a row changes its postings
+    are removed under the trigrams of its old text, read back through
+    query_of. A search intersects the postings of the term's trigrams and
+    verifies the remaining candidates against the rows themselves, so no
+    copy of the texts is held; only texts shorter than a trigram, which
+    have no postings, are kept.
+    """
+
+    def __init__(self, queries, query_of):
+        self.query_of = query_of
+        self.size = 0
+        self.postings = {}
+        self.short = {}
+        for index, query in enumerate(queries):
+            self._add(index, query_text(query).lower())
+
+    def _text(self, index):
+        return query_text(self.query_of(index)).lower()
+
+    def _add(self, index, text):
+        self.size = max(self.size, index + 1)
+        if len(text) < GRAM_SIZE:
+            self.short[index] = text
+        for gram in grams(text):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('I')
+            if not postings or postings[-1] < index:
+                postings.append(index)
+            else:
+                insort(postings, index)
+
+    def _remove(self, index, text):
+        self.short.pop(index, None)
+        for gram in grams(text):
+            postings = self.postings.get(gram)
+            position = bisect_left(postings, index) if postings is not None else 0
+            if postings is not None and position < len(postings) and postings[position] == index:
+                del postings[position]
+                if not postings:
+                    del self.postings[gram]
+
+    def row_changing(self, index):
+        """Remove the postings of a row's current text before it is edited."""
+        if index < self.size:
+            self._remove(index, self._text(index))
+
+    def row_changed(self, index, changes, row):
+        """Index the new text of an edited or appended row."""
+        self._add(index, query_text(row.query).lower())
+
+    def rows_appended(self, start, rows):
+        """Index the texts of a batch of appended rows."""
+        for index, row in enumerate(rows, start):
+            self._add(index, query_text(row.query).lower())
+
+    def rows_changed(self, indices, old_codes):
+        """Metadata-only batch edits leave the query texts unchanged."""
+
+    def search(self, term, within=None):
+        """Return the ascending indices of rows whose text contains the term.
+
+        Given a bitset within, only candidates among its rows are verified.
+        """
+        term = term.strip().lower()
+        if len(term) < GRAM_SIZE:
+            found = {i for i, text in self.short.items() if term in text}
+            for gram, postings in self.postings.items():
+                if term in gram:
+                    found.update(postings)
+            return self._within(sorted(found), within)
+        posting_lists = []
+        for gram in grams(term):
+            postings = self.postings.get(gram)
+            if postings is None:
+                return []
+            posting_lists.append(postings)
+        posting_lists.sort(key=len)
+        candidates = set(posting_lists[0])
+        for postings in posting_lists[1:]:
+            if not candidates:
+                return []
+            candidates.intersection_update(postings)
+        candidates = self._within(sorted(candidates), within)
+        if len(term) == GRAM_SIZE:
+            return candidates
+        return [i for i in candidates if term in self._text(i)]
+
+    def _within(self, indices, within):
+        if within is None:
+            return indices
+        data = within.to_bytes((within.bit_length() + 7) // 8, 'little')
+        return [i for i in indices if i >> 3 < len(data) and data[i >> 3] >> (i & 7) & 1]
+
+    def match(self, term, within=None):
+        """Return the bitset of rows whose text contains the term, looking only among within when given."""
+        return indices_to_bitmap(self.search(term, within), self.size)
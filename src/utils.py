@@ -1,9 +1,35 @@
 import os
 import json
+import zlib
+import base64
+import binascii
+from array import array
 from collections import Counter
 from flask import request, session
-from src.data import load_query_data
-from src.plots import plot_pie, plot_stacked_bar
+from src.data import load_query_data, TsvChunkParser, PARALLEL_PARSE_THRESHOLD
+from src.columns import sort_key
+from src.bitmaps import bitmap_to_indices
+from src.cache import CachedView
+from src.aggregates import count_values, crosstab, display_counts, display_pairs, top_k, top_k_pairs
+from src.plots import plot_pie, plot_stacked_bar, plot_stacked_bar_counts
+
+SORT_FIELDS = {
+    'Segment': 'segment',
+    'Question Intent': 'question_intent',
+    'Sub Intent': 'sub_intent'
+}
+MAX_SORT_KEYS = 4
+PER_PAGE_OPTIONS = [10, 25, 50, 100, 250, 500]
+PAGE_WINDOW = 2
+API_PAGE_LIMIT = 100
+MAX_API_PAGE_LIMIT = 1000
+NDJSON_BATCH_ROWS = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+CHART_DEFAULTS = {
+    'pie': 'segment',
+    'bar': 'question_intent',
+    'stack': 'sub_intent'
+}
 
 def ensure_folders_exist(app, folders=None):
     """Create necessary folders if they don't exist."""
@@ -15,7 +41,8 @@ def ensure_folders_exist(app, folders=None):
 def load_file(filepath, app):
     """Load data from a TSV file and return it."""
     try:
-        loaded_data = load_query_data(filepath)
+        loaded_data = load_query_data(
+            filepath, parallel_threshold=app.config.get('PARALLEL_PARSE_THRESHOLD', PARALLEL_PARSE_THRESHOLD))
         app.logger.info(f"Loaded {len(loaded_data)} data points")
         if loaded_data:
             app.logger.debug(f"Sample metadata: {[item.metadata for item in loaded_data[:3]]}")
@@ -25,56 +52,183 @@ def load_file(filepath, app):
         raise
 
 def reset_session_and_globals():
-    """Reset session and sort variables when loading a new file."""
+    """Reset session variables when loading a new file."""
     session['data_loaded'] = True
     session['has_added_data'] = False
-    session['sort_column'] = None
-    session['sort_reverse'] = False
 
 def get_search_params():
     """Extract search parameters from request arguments."""
     return {
         'question_intent': request.args.get('question_intent', '').strip().lower(),
         'sub_intent': request.args.get('sub_intent', '').strip().lower(),
-        'segment': request.args.get('segment', '').strip().lower()
+        'segment': request.args.get('segment', '').strip().lower(),
+        'text': request.args.get('text', '').strip().lower()
     }
 
+def as_dataset(data):
+    """Return data if it has derived indexes, else an in-memory Dataset over its rows."""
+    if hasattr(data, 'filter_index'):
+        return data
+    from src.store import Dataset  # src.store imports this module
+    return Dataset('rows', list(data))
+
 def filter_data(data, search_params, app):
-    """Filter data based on search parameters."""
-    return [
-        item for item in data
-        if (not search_params['question_intent'] or
-            search_params['question_intent'] in str(item.metadata.get('question_intent', 'Unknown')).strip().lower())
-        and (not search_params['sub_intent'] or
-             search_params['sub_intent'] in str(item.metadata.get('sub_intent', 'Unknown')).strip().lower())
-        and (not search_params['segment'] or
-             search_params['segment'] in str(item.metadata.get('segment', 'Unknown')).strip().lower())
-    ]
+    """Filter data based on search parameters, with the filter and text indexes of the dataset."""
+    dataset = as_dataset(data)
+    return [dataset[i] for i in filter_indices(dataset, search_params)]
 
-def sort_data(filtered_data, column, app):
-    """Sort filtered data by specified column."""
-    if column not in ['Question Intent', 'Sub Intent']:
-        return filtered_data
-    
-    app.logger.info(f"Sorting by {column}, reverse={session.get('sort_reverse', False)}")
-    if session.get('sort_column') == column:
-        session['sort_reverse'] = not session.get('sort_reverse', False)
+def filter_bitmap(data, search_params):
+    """Return an int bitset of rows matching the search parameters, from the dataset's indexes."""
+    bits = data.filter_index.match(search_params)
+    if bits and search_params.get('text'):
+        bits &= data.text_index.match(search_params['text'], bits)
+    return bits
+
+def filter_indices(data, search_params):
+    """Return indices of rows matching the search parameters, in row order."""
+    return bitmap_to_indices(filter_bitmap(data, search_params))
+
+def get_metadata_fields(data):
+    """Return the metadata fields a dataset's rows may be sorted and charted by."""
+    return set(data[0].metadata) | set(SORT_FIELDS.values()) | set(CHART_DEFAULTS.values())
+
+def parse_sort_spec(value, fields=None):
+    """Parse a sort parameter like 'question_intent,-sub_intent' into (field, reverse) pairs.
+
+    A leading '-' sorts a field in descending order; the column labels in
+    SORT_FIELDS are accepted in place of field names. Fields not in fields,
+    when given, are ignored so that unknown names never build a column.
+    """
+    sort_spec = []
+    for part in value.split(','):
+        part = part.strip()
+        reverse = part.startswith('-')
+        field = part.lstrip('-').strip()
+        field = SORT_FIELDS.get(field, field)
+        if fields is not None and field not in fields:
+            continue
+        if field and field not in [f for f, _ in sort_spec] and len(sort_spec) < MAX_SORT_KEYS:
+            sort_spec.append((field, reverse))
+    return sort_spec
+
+def format_sort_spec(sort_spec):
+    """Format (field, reverse) pairs as a sort parameter."""
+    return ','.join(f"-{field}" if reverse else field for field, reverse in sort_spec)
+
+def get_sort_links(sort_spec):
+    """Return the sort parameter each column header links to.
+
+    Clicking a column makes it the primary sort key, flipping its direction if
+    it already was, and keeps the other keys as tie-breakers.
+    """
+    links = {}
+    for label, field in SORT_FIELDS.items():
+        reverse = bool(sort_spec) and sort_spec[0] == (field, False)
+        rest = [key for key in sort_spec if key[0] != field]
+        links[label] = format_sort_spec([(field, reverse)] + rest)
+    return links
+
+def sort_index(data, sort_spec):
+    """Return the dataset's filter index, prepared to order rows by the sort spec."""
+    index = data.filter_index
+    for field, _ in sort_spec:
+        data.column(field)
+        index.ensure_field(field)
+    return index
+
+def select_rows(data, bits, sort_spec, start, stop):
+    """Return the start-th up to the stop-th rows of a filter bitset in sort order."""
+    return sort_index(data, sort_spec).select_sorted(bits, sort_spec, start, stop)
+
+def get_filtered_view(data, search_params, sort_spec, cache):
+    """Return the cached view of the rows matching the search parameters and sort spec.
+
+    A miss computes only the filter bitset. A repeated request, such as the
+    next page, materializes the full row order once so that later pages are
+    plain slices.
+    """
+    key = (tuple(sorted(search_params.items())), format_sort_spec(sort_spec))
+    view = cache.get(data.dataset_id, data.version, key)
+    if view is None:
+        view = CachedView(filter_bitmap(data, search_params))
+    elif view.order is None:
+        view.order = array('I', select_rows(data, view.bits, sort_spec, 0, view.count))
     else:
-        session['sort_column'] = column
-        session['sort_reverse'] = False
-    
-    key_map = {
-        'Question Intent': lambda x: str(x.metadata.get('question_intent', 'Unknown')).lower(),
-        'Sub Intent': lambda x: str(x.metadata.get('sub_intent', 'Unknown')).lower()
-    }
-    filtered_data.sort(key=key_map[column], reverse=session['sort_reverse'])
-    return filtered_data
+        return view
+    cache.put(data.dataset_id, data.version, key, view, view.nbytes)
+    return view
+
+def view_rows(data, view, sort_spec, start, stop):
+    """Return the start-th up to the stop-th rows of a filtered view."""
+    if view.order is not None:
+        return view.order[start:stop].tolist()
+    return select_rows(data, view.bits, sort_spec, start, stop)
+
+def encode_cursor(data, sort_spec, index):
+    """Return an opaque keyset cursor for the position just after a row."""
+    keys = [sort_key(data.column(field).value(index)) for field, _ in sort_spec]
+    payload = json.dumps({'sort': format_sort_spec(sort_spec), 'keys': keys, 'index': index}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort_spec):
+    """Return the (sort keys, row index) of a cursor, raising ValueError if it is invalid for the sort spec."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        keys = [tuple(key) for key in payload['keys']]
+        index = int(payload['index'])
+    except (ValueError, TypeError, KeyError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if payload.get('sort') != format_sort_spec(sort_spec) or len(keys) != len(sort_spec):
+        raise ValueError("Cursor does not match the sort order")
+    return keys, index
+
+def rows_after_cursor(data, bits, sort_spec, cursor):
+    """Return the rows of a filter bitset that come after a cursor, or all of them without one."""
+    if not cursor:
+        return bits
+    keys, index = decode_cursor(cursor, sort_spec)
+    return sort_index(data, sort_spec).after(bits, sort_spec, keys, index)
+
+def row_record(data, index):
+    """Return a row as a JSON-serializable dictionary with its index."""
+    return dict(data[index].to_dict(), index=index)
 
-def prepare_table_data(filtered_data, start_idx=0):
-    """Prepare data for table rendering with pagination offset."""
+def iter_ndjson(data, indices):
+    """Yield rows as newline-delimited JSON, a batch of lines at a time."""
+    for start in range(0, len(indices), NDJSON_BATCH_ROWS):
+        yield ''.join(
+            json.dumps(row_record(data, index), ensure_ascii=False) + '\n'
+            for index in indices[start:start + NDJSON_BATCH_ROWS]
+        )
+
+def sort_data(filtered_data, sort_spec):
+    """Stably sort filtered data by (field, reverse) pairs, in the sort order of the filter index."""
+    dataset = as_dataset(filtered_data)
+    order = select_rows(dataset, (1 << len(dataset)) - 1, sort_spec, 0, len(dataset))
+    return [dataset[i] for i in order]
+
+def get_page_window(page, total_pages, radius=PAGE_WINDOW):
+    """Return the page numbers to link: the first, the last and radius pages around the current one.
+
+    Gaps of more than one page are marked with None.
+    """
+    pages = sorted({1, total_pages} | set(range(max(1, page - radius), min(total_pages, page + radius) + 1)))
+    window = []
+    for p in pages:
+        if p < 1:
+            continue
+        if window and p == window[-1] + 2:
+            window.append(p - 1)
+        elif window and p > window[-1] + 2:
+            window.append(None)
+        window.append(p)
+    return window
+
+def prepare_table_data(filtered_data, start_idx=0, indices=None):
+    """Prepare data for table rendering with pagination offset or explicit row indices."""
     return [
         {
-            'index': start_idx + idx,
+            'index': indices[idx] if indices is not None else start_idx + idx,
             'text': item.query[0].get('text', 'No text available') if item.query else 'No query available',
             'segment': str(item.metadata.get('segment', 'Unknown')),
             'question_intent': str(item.metadata.get('question_intent', 'Unknown')),
@@ -83,20 +237,67 @@ def prepare_table_data(filtered_data, start_idx=0):
         for idx, item in enumerate(filtered_data)
     ]
 
-def get_sort_indicators():
-    """Return sort indicators for table headers."""
-    return {
-        'Question Intent': ' ▲' if session.get('sort_column') == 'Question Intent' and not session.get('sort_reverse') else ' ▼' if session.get('sort_column') == 'Question Intent' else '',
-        'Sub Intent': ' ▲' if session.get('sort_column') == 'Sub Intent' and not session.get('sort_reverse') else ' ▼' if session.get('sort_column') == 'Sub Intent' else ''
-    }
+def get_sort_indicators(sort_spec):
+    """Return sort indicators for table headers, numbered when sorting by several keys."""
+    indicators = {}
+    for label, field in SORT_FIELDS.items():
+        indicators[label] = ''
+        for position, (key, reverse) in enumerate(sort_spec, 1):
+            if key == field:
+                indicators[label] = (' ▼' if reverse else ' ▲') + (str(position) if len(sort_spec) > 1 else '')
+    return indicators
 
-def generate_charts(data, app):
-    """Generate JSON data for Chart.js pie and stacked bar charts."""
-    segment_counter = Counter(item.metadata['segment'] for item in data)
-    app.logger.info("Generating segment pie chart data")
-    pie_chart = plot_pie(segment_counter)
-    app.logger.info("Generating stacked bar chart data")
-    bar_chart = plot_stacked_bar(data)
+def get_chart_spec(fields=None):
+    """Extract the chart fields and top-K limit from request arguments.
+
+    Fields not in fields, when given, fall back to the defaults so that
+    unknown names never build a column or chart counter.
+    """
+    spec = {}
+    for name, default in CHART_DEFAULTS.items():
+        field = request.args.get(name, '').strip() or default
+        spec[name] = field if fields is None or field in fields else default
+    try:
+        spec['top'] = max(0, int(request.args.get('top', 0)))
+    except ValueError:
+        spec['top'] = 0
+    return spec
+
+def generate_charts(data, app, chart_spec=None, search_params=None):
+    """Generate JSON data for Chart.js pie and stacked bar charts.
+
+    Datasets are charted by the fields in chart_spec, over the rows matching
+    the search parameters. Unfiltered charts read the dataset's maintained
+    aggregates; filtered ones count the filter bitset's rows, unless the
+    aggregates can count filtered rows themselves.
+    """
+    aggregates = getattr(data, 'chart_aggregates', None)
+    if aggregates is None:
+        segment_counter = Counter(item.metadata['segment'] for item in data)
+        app.logger.info("Generating segment pie chart data")
+        pie_chart = plot_pie(segment_counter)
+        app.logger.info("Generating stacked bar chart data")
+        bar_chart = plot_stacked_bar(data)
+        return json.dumps(pie_chart), json.dumps(bar_chart)
+    
+    chart_spec = {**CHART_DEFAULTS, 'top': 0, **(chart_spec or {})}
+    if getattr(aggregates, 'supports_filters', False):
+        app.logger.info(f"Counting chart values in the dataset store: {search_params}")
+        value_counts = aggregates.value_counts(chart_spec['pie'], search_params)
+        pair_map = aggregates.pair_map(chart_spec['bar'], chart_spec['stack'], search_params)
+    else:
+        pie, bar, stack = (data.column(chart_spec[name]) for name in ('pie', 'bar', 'stack'))
+        if search_params and any(search_params.values()):
+            app.logger.info(f"Counting chart values over filtered rows: {search_params}")
+            bits = filter_bitmap(data, search_params)
+            value_counts = display_counts(pie, count_values(pie, bits))
+            pair_map = display_pairs(bar, stack, crosstab(bar, stack, bits))
+        else:
+            app.logger.info("Reading chart values from aggregates")
+            value_counts = aggregates.value_counts(chart_spec['pie'])
+            pair_map = aggregates.pair_map(chart_spec['bar'], chart_spec['stack'])
+    pie_chart = plot_pie(top_k(value_counts, chart_spec['top']))
+    bar_chart = plot_stacked_bar_counts(top_k_pairs(pair_map, chart_spec['top']))
     return json.dumps(pie_chart), json.dumps(bar_chart)
 
 def process_form_fields(fields, prefix):
@@ -110,20 +311,130 @@ def process_form_fields(fields, prefix):
             result[field] = value
     return result
 
+def get_assignments(fields):
+    """Read the field and value pairs of a bulk edit form, parsing values as process_form_fields does."""
+    assignments = {}
+    for field, value in zip(request.form.getlist('field'), request.form.getlist('value')):
+        if field not in fields:
+            raise ValueError(f"Unknown field: {field}")
+        value = value.strip()
+        try:
+            assignments[field] = json.loads(value) if value else ''
+        except json.JSONDecodeError:
+            assignments[field] = value
+    return assignments
+
+def parse_tsv_stream(stream, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Parse a binary stream of TSV lines into QueryData rows."""
+    parser = TsvChunkParser()
+    for chunk in iter(lambda: stream.read(chunk_bytes), b''):
+        parser.feed(chunk)
+    return parser.close()
+
+def check_schema(rows, data):
+    """Raise ValueError for the first row with fields that the loaded dataset's rows do not have."""
+    sample = data[0]
+    query_fields = set(sample.query[0]) if sample.query and isinstance(sample.query[0], dict) else set()
+    metadata_fields = set(sample.metadata)
+    for line, row in enumerate(rows, 1):
+        if not isinstance(row.query, list) or not isinstance(row.metadata, dict):
+            raise ValueError(f"Line {line}: query must be a list and metadata an object")
+        if row.query and not isinstance(row.query[0], dict):
+            raise ValueError(f"Line {line}: query turns must be objects")
+        unknown = (set(row.query[0]) - query_fields if row.query else set()) | (set(row.metadata) - metadata_fields)
+        if unknown:
+            raise ValueError(f"Line {line}: unknown fields {', '.join(sorted(unknown))}")
+
+def tsv_line(data_point):
+    """Serialize a data point as one UTF-8 TSV line."""
+    query_json = json.dumps(data_point.query, ensure_ascii=False)
+    metadata_json = json.dumps(data_point.metadata, ensure_ascii=False)
+    return f"{query_json}\t{metadata_json}\n".encode('utf-8')
+
+def tsv_parts(data_to_save, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yield data as chunks of serialized TSV lines and (start, end) spans of unchanged source lines."""
+    runs = data_to_save.export_runs() if hasattr(data_to_save, 'export_runs') else data_to_save
+    lines = []
+    size = 0
+    for run in runs:
+        if isinstance(run, tuple):
+            if lines:
+                yield b''.join(lines)
+                lines = []
+                size = 0
+            yield run
+            continue
+        line = tsv_line(run)
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b''.join(lines)
+
+def iter_tsv(data_to_save, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yield data as UTF-8 TSV in chunks of about chunk_bytes.
+
+    Unchanged rows of a dataset backed by a source file are copied from it
+    verbatim; only edited and added rows are serialized.
+    """
+    for part in tsv_parts(data_to_save, chunk_bytes):
+        if isinstance(part, tuple):
+            start, end = part
+            for position in range(start, end, chunk_bytes):
+                yield data_to_save.source_bytes(position, min(end, position + chunk_bytes))
+        else:
+            yield part
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of byte chunks into a gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def copy_span(source, target, start, end):
+    """Copy a byte range of one open file to the end of another, in the kernel where possible."""
+    target.flush()
+    position = start
+    while position < end:
+        if hasattr(os, 'sendfile'):
+            sent = os.sendfile(target.fileno(), source.fileno(), position, end - position)
+        else:
+            source.seek(position)
+            sent = target.write(source.read(min(end - position, EXPORT_CHUNK_BYTES)))
+        if not sent:
+            raise IOError(f"Source file ended before byte {end}")
+        position += sent
+
 def save_data_to_file(filepath, data_to_save):
-    """Save data to a TSV file."""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        for dp in data_to_save:
-            query_json = json.dumps(dp.query, ensure_ascii=False)
-            metadata_json = json.dumps(dp.metadata, ensure_ascii=False)
-            f.write(f"{query_json}\t{metadata_json}\n")
+    """Save data to a TSV file, copying unchanged rows from the source file."""
+    source_path = getattr(data_to_save, 'source_path', None)
+    if source_path is None:
+        with open(filepath, 'wb') as f:
+            for chunk in iter_tsv(data_to_save):
+                f.write(chunk)
+        return
+    with open(source_path, 'rb') as source, open(filepath, 'wb') as f:
+        for part in tsv_parts(data_to_save):
+            if isinstance(part, tuple):
+                copy_span(source, f, *part)
+            else:
+                f.write(part)
 
 def append_data_to_file(filepath, data_point):
     """Append a single data point to a TSV file."""
-    with open(filepath, 'a', encoding='utf-8') as f:
-        query_json = json.dumps(data_point.query, ensure_ascii=False)
-        metadata_json = json.dumps(data_point.metadata, ensure_ascii=False)
-        f.write(f"{query_json}\t{metadata_json}\n")
+    with open(filepath, 'ab') as f:
+        f.write(tsv_line(data_point))
+
+def append_rows_to_file(filepath, data_points):
+    """Append a batch of data points to a TSV file in one write."""
+    with open(filepath, 'ab') as f:
+        f.write(b''.join(tsv_line(data_point) for data_point in data_points))
 
 def get_file_paths(original_name, folder_key, app, session_id=None):
     """Generate file paths and names for saving or downloading."""
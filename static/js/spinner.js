@@ -30,6 +30,8 @@ function clearFilters() {
     form.querySelector('#question_intent').value = '';
     form.querySelector('#sub_intent').value = '';
     form.querySelector('#segment').value = '';
+    form.querySelector('#text').value = '';
+    form.querySelector('#sort').value = '';
     form.querySelector('#per_page').value = '10'; // Reset to default
     showSpinner();
     form.submit();
@@ -0,0 +1,50 @@
+document.addEventListener('DOMContentLoaded', () => {
+    // Upload in the background and poll the server for parse progress
+    const form = document.getElementById('load-file-form');
+    const status = document.getElementById('upload-progress');
+    if (!form || !status || !window.XMLHttpRequest) {
+        return;
+    }
+
+    form.addEventListener('submit', (event) => {
+        event.preventDefault();
+        const uploadId = Array.from(crypto.getRandomValues(new Uint8Array(16)))
+            .map(b => b.toString(16).padStart(2, '0')).join('');
+        const xhr = new XMLHttpRequest();
+        let pollTimer = null;
+
+        const formatMB = bytes => (bytes / (1024 * 1024)).toFixed(1);
+        const poll = () => {
+            fetch(`/upload_progress/${uploadId}`)
+                .then(response => response.ok ? response.json() : null)
+                .then(progress => {
+                    if (progress) {
+                        const total = progress.total_bytes ? ` of ${formatMB(progress.total_bytes)} MB` : '';
+                        status.textContent = `Parsed ${progress.rows_parsed} rows (${formatMB(progress.bytes_read)} MB${total})`;
+                    }
+                })
+                .catch(() => {});
+        };
+
+        status.classList.remove('hidden');
+        status.textContent = 'Uploading...';
+        pollTimer = setInterval(poll, 500);
+
+        xhr.open('POST', `${window.location.pathname}?upload_id=${uploadId}`);
+        xhr.onload = () => {
+            clearInterval(pollTimer);
+            if (xhr.responseURL && !xhr.responseURL.endsWith(window.location.pathname)) {
+                window.location.href = xhr.responseURL;
+            } else {
+                document.open();
+                document.write(xhr.responseText);
+                document.close();
+            }
+        };
+        xhr.onerror = () => {
+            clearInterval(pollTimer);
+            status.textContent = 'Upload failed. Please try again.';
+        };
+        xhr.send(new FormData(form));
+    });
+});
@@ -0,0 +1,94 @@
+import random
+import pytest
+from collections import Counter
+from src import aggregates
+from src.aggregates import ChartAggregates, count_values, crosstab, top_k, top_k_pairs
+from src.bitmaps import indices_to_bitmap
+from src.columns import build_columns
+from src.data import QueryData
+from src.store import Dataset
+
+def random_row(rng):
+    """A row with random metadata, sometimes missing the sub-intent."""
+    metadata = {'segment': rng.choice(['a', 'b', 'c']), 'question_intent': rng.choice(['i1', 'i2'])}
+    if rng.random() < 0.8:
+        metadata['sub_intent'] = rng.choice(['s1', 's2', 's3'])
+    return QueryData([{'text': 'q'}], metadata)
+
+def expected_counts(rows):
+    """Recount segments and intent/sub-intent pairs from the rows."""
+    segments = Counter(row.metadata['segment'] for row in rows)
+    pairs = Counter((row.metadata['question_intent'], row.metadata.get('sub_intent', 'Unknown')) for row in rows)
+    return segments, pairs
+
+def actual_counts(aggregates):
+    """Flatten the maintained aggregates into comparable counters."""
+    pair_map = aggregates.pair_map('question_intent', 'sub_intent')
+    pairs = Counter({(first, second): count for first, counter in pair_map.items() for second, count in counter.items()})
+    return aggregates.value_counts('segment'), pairs
+
+def test_aggregates_built_from_columns():
+    """Test the initial counts match a recount of the rows."""
+    rng = random.Random(1)
+    rows = [random_row(rng) for _ in range(200)]
+    assert actual_counts(ChartAggregates(build_columns(rows))) == expected_counts(rows)
+
+def test_aggregates_follow_edits_and_appends():
+    """Test edits and appends keep the counts equal to a recount, dropping values with no rows."""
+    rng = random.Random(2)
+    rows = [random_row(rng) for _ in range(50)]
+    dataset = Dataset('test', list(rows))
+    aggregates = dataset.chart_aggregates
+    for _ in range(100):
+        row = random_row(rng)
+        if rng.random() < 0.7:
+            index = rng.randrange(len(rows))
+            rows[index] = row
+            dataset._apply_change({'op': 'update', 'index': index, 'row': row.to_dict()})
+        else:
+            rows.append(row)
+            dataset._apply_change({'op': 'append', 'row': row.to_dict()})
+    assert actual_counts(aggregates) == expected_counts(rows)
+    for index in range(len(rows)):
+        dataset._apply_change({'op': 'update', 'index': index, 'row': {'query': [], 'metadata': {'segment': 'z'}}})
+    assert aggregates.value_counts('segment') == Counter({'z': len(rows)})
+    assert aggregates.pair_map('question_intent', 'sub_intent') == {'Unknown': Counter({'Unknown': len(rows)})}
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_count_values_and_crosstab_over_bitset(monkeypatch, use_numpy):
+    """Test code counts and cross-tabs match a recount, with and without a row bitset, with or without NumPy."""
+    if not use_numpy:
+        monkeypatch.setattr(aggregates, 'np', None)
+    elif aggregates.np is None:
+        pytest.skip("NumPy is not installed")
+    rng = random.Random(3)
+    rows = [random_row(rng) for _ in range(300)]
+    columns = build_columns(rows)
+    segment, intent, sub_intent = columns['segment'], columns['question_intent'], columns['sub_intent']
+    assert count_values(segment) == Counter(segment.codes)
+    assert crosstab(intent, sub_intent) == Counter(zip(intent.codes, sub_intent.codes))
+    selected = [i for i in range(300) if rng.random() < 0.3]
+    bits = indices_to_bitmap(selected, 300)
+    assert count_values(segment, bits) == Counter(segment.codes[i] for i in selected)
+    assert crosstab(intent, sub_intent, bits) == Counter((intent.codes[i], sub_intent.codes[i]) for i in selected)
+    assert count_values(segment, 0) == Counter()
+
+def test_top_k():
+    """Test the largest values are kept in order and the rest summed into 'Other'."""
+    counter = Counter({'a': 1, 'b': 5, 'c': 3, 'd': 2})
+    assert list(top_k(counter, 2).items()) == [('b', 5), ('c', 3), ('Other', 3)]
+    assert top_k(counter, 0) is counter
+    assert top_k(counter, 4) is counter
+    pair_map = {'x': Counter({'s1': 5, 's2': 1}), 'y': Counter({'s3': 2}), 'z': Counter({'s1': 1})}
+    assert top_k_pairs(pair_map, 1) == {'x': Counter({'s1': 5, 'Other': 1}), 'Other': Counter({'Other': 2, 's1': 1})}
+
+def test_aggregates_track_other_fields():
+    """Test counts for fields tracked later also follow changes."""
+    rows = [QueryData([], {'segment': 'a', 'source': 'x'}), QueryData([], {'segment': 'b', 'source': 'y'})]
+    dataset = Dataset('test', rows)
+    dataset.column('source')
+    aggregates = dataset.chart_aggregates
+    assert aggregates.pair_map('source', 'segment') == {'x': Counter({'a': 1}), 'y': Counter({'b': 1})}
+    dataset._apply_change({'op': 'update', 'index': 1, 'row': {'query': [], 'metadata': {'segment': 'a', 'source': 'x'}}})
+    assert aggregates.value_counts('source') == Counter({'x': 2})
+    assert aggregates.pair_map('source', 'segment') == {'x': Counter({'a': 2})}
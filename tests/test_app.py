@@ -3,7 +3,8 @@ import pytest
 import tempfile
 import shutil
 from flask import session
-from app import app, get_session_id, cleanup_session_files
+from app import app, registry, get_session_id, cleanup_session_files
+from src.ingest import UploadProgress
 from io import BytesIO
 import json
 
@@ -16,6 +17,10 @@ def client():
     app.config['DATA_FOLDER'] = tempfile.mkdtemp()
     app.config['MODIFIED_FOLDER'] = tempfile.mkdtemp()
     app.config['ADDED_FOLDER'] = tempfile.mkdtemp()
+    app.config['DATASET_FOLDER'] = tempfile.mkdtemp()
+    app.config['PROGRESS_FOLDER'] = tempfile.mkdtemp()
+    app.config['PARSE_CACHE_FOLDER'] = tempfile.mkdtemp()
+    app.config['JANITOR_INTERVAL'] = 0
     
     with app.test_client() as client:
         with app.app_context():
@@ -23,7 +28,9 @@ def client():
     
     # Cleanup
     for folder in [app.config['SESSION_FILE_DIR'], app.config['DATA_FOLDER'], 
-                   app.config['MODIFIED_FOLDER'], app.config['ADDED_FOLDER']]:
+                   app.config['MODIFIED_FOLDER'], app.config['ADDED_FOLDER'],
+                   app.config['DATASET_FOLDER'], app.config['PROGRESS_FOLDER'],
+                   app.config['PARSE_CACHE_FOLDER']]:
         if os.path.exists(folder):
             shutil.rmtree(folder)
 
@@ -60,7 +67,9 @@ def test_index_post_upload(client, sample_tsv):
     assert rv.status_code == 302
     assert rv.location.endswith('/data')
     with client.session_transaction() as sess:
-        assert len(sess['data']) == 2
+        assert 'data' not in sess
+        assert sess['dataset_version'] == 0
+        assert len(registry.get(sess['dataset_id'])) == 2
         assert sess['selected_file_name'] == 'test.tsv'
         assert sess['data_loaded'] is True
 
@@ -77,6 +86,48 @@ def test_index_post_invalid_file(client):
     assert rv.status_code == 200
     assert b'Only .tsv files are allowed' in rv.data
 
+def test_index_post_streaming_upload(client, sample_tsv, monkeypatch):
+    """Test POST / with an upload ID parses the upload as it streams in."""
+    monkeypatch.setitem(app.config, 'PARSE_CACHE_BYTES', 0)
+    with open(sample_tsv, 'rb') as f:
+        rv = client.post('/?upload_id=abc123', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    assert rv.status_code == 302
+    with client.session_transaction() as sess:
+        assert len(registry.get(sess['dataset_id'])) == 2
+    assert client.get('/upload_progress/abc123').status_code == 404
+    assert os.listdir(app.config['PROGRESS_FOLDER']) == []
+
+def test_reupload_loads_parse_snapshot(client, sample_tsv, monkeypatch):
+    """Test uploading the same bytes again loads the cached parse instead of parsing."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    assert registry.parse_cache.misses == 1
+    
+    def fail(source_path):
+        raise AssertionError("parsed a cached upload")
+    monkeypatch.setattr(registry, '_parse_source', fail)
+    with open(sample_tsv, 'rb') as f:
+        rv = client.post('/', data={'tsv_file': (f, 'again.tsv')}, content_type='multipart/form-data')
+    assert rv.status_code == 302
+    assert registry.parse_cache.hits == 1
+    assert b'query2' in client.get('/data').data
+
+def test_index_post_invalid_tsv(client):
+    """Test POST / with a malformed TSV reports the parse error."""
+    data = {'tsv_file': (BytesIO(b'single_column\n'), 'bad.tsv')}
+    rv = client.post('/', data=data, content_type='multipart/form-data')
+    assert rv.status_code == 200
+    assert b'Invalid line format' in rv.data
+
+def test_upload_progress(client):
+    """Test /upload_progress reports progress written by another worker."""
+    progress = UploadProgress(app.config['PROGRESS_FOLDER'], 'def456', total_bytes=10)
+    progress.update(5, 1)
+    rv = client.get('/upload_progress/def456')
+    assert rv.status_code == 200
+    assert rv.get_json()['state'] == 'receiving'
+
 def test_data_table(client, sample_tsv):
     """Test /data displays data after upload."""
     with open(sample_tsv, 'rb') as f:
@@ -89,6 +140,180 @@ def test_data_table(client, sample_tsv):
     assert b'regular' in rv.data
     assert b'intent1' in rv.data
 
+def test_data_table_filtered_rows_keep_their_index(client, sample_tsv):
+    """Test edit links on a filtered view point at the original rows."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/data?segment=premium')
+    assert b'query2' in rv.data
+    assert b'query1' not in rv.data
+    assert b'href="/edit/1"' in rv.data
+
+def test_data_table_text_search(client, sample_tsv):
+    """Test /data filters rows by their query text."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/data?text=QUERY2')
+    assert b'query2' in rv.data
+    assert b'query1' not in rv.data
+    assert b'Filtered rows: 1' in rv.data
+
+def test_data_table_sorted_paging(client, sample_tsv):
+    """Test a sort spec orders rows and is kept, not flipped, by pagination links."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/data?sort=-question_intent&per_page=10')
+    assert rv.data.index(b'query2') < rv.data.index(b'query1')
+    assert 'Question Intent ▼'.encode() in rv.data
+    assert b'sort=question_intent' in rv.data
+    rv = client.get('/data?sort=-question_intent&page=1')
+    assert rv.data.index(b'query2') < rv.data.index(b'query1')
+
+def test_cache_stats_counts_paging(client, sample_tsv):
+    """Test repeated /data requests for the same view hit the result cache."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    before = client.get('/cache_stats').get_json()
+    client.get('/data?segment=premium')
+    client.get('/data?segment=premium&page=1')
+    stats = client.get('/cache_stats').get_json()
+    assert stats['hits'] == before['hits'] + 1
+    assert stats['misses'] == before['misses'] + 1
+
+def upload_rows(client, count):
+    """Upload a generated TSV with the given number of rows."""
+    lines = [
+        f"{json.dumps([{'text': f'query{i:06d}'}])}\t{json.dumps({'segment': 'regular', 'question_intent': 'intent1', 'sub_intent': 'sub1'})}"
+        for i in range(count)
+    ]
+    client.post('/', data={'tsv_file': (BytesIO('\n'.join(lines).encode('utf-8')), 'test.tsv')},
+                content_type='multipart/form-data')
+
+def test_data_table_response_size_is_flat(client):
+    """Test the /data page size depends on the page size, not the number of pages."""
+    sizes = []
+    for count in [2000, 40000]:
+        upload_rows(client, count)
+        rv = client.get('/data?page=50&per_page=10')
+        assert b'query000490' in rv.data
+        sizes.append(len(rv.data))
+    assert abs(sizes[1] - sizes[0]) < 100
+    rv = client.get('/data?page=3&per_page=500')
+    assert b'query001499' in rv.data
+    assert b'query001500' not in rv.data
+
+def test_api_rows_keyset_paging(client):
+    """Test /api/rows pages through a sorted view with cursors, even when rows are added in between."""
+    upload_rows(client, 25)
+    client.post('/edit/3', data={'query_text': 'query000003', 'metadata_segment': 'a'})
+    rv = client.get('/api/rows?sort=-segment&limit=10')
+    body = rv.get_json()
+    assert body['total'] == 25
+    assert [row['index'] for row in body['rows']][:2] == [0, 1]
+    seen = [row['index'] for row in body['rows']]
+    client.post('/add', data={'query_text': 'new', 'metadata_segment': 'regular'})
+    while body['next_cursor']:
+        body = client.get(f"/api/rows?sort=-segment&limit=10&cursor={body['next_cursor']}").get_json()
+        seen += [row['index'] for row in body['rows']]
+    assert seen == [i for i in range(26) if i != 3] + [3]
+
+def test_api_rows_ndjson(client, sample_tsv):
+    """Test /api/rows streams every matching row as NDJSON."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/api/rows?format=ndjson&sort=-question_intent')
+    assert rv.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in rv.data.decode('utf-8').splitlines()]
+    assert [line['index'] for line in lines] == [1, 0]
+    assert lines[0]['query'] == [{'text': 'query2'}]
+    assert lines[0]['metadata']['segment'] == 'premium'
+
+def test_api_rows_errors(client, sample_tsv):
+    """Test /api/rows rejects bad cursors and requires a dataset."""
+    assert client.get('/api/rows').status_code == 404
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    assert client.get('/api/rows?cursor=bogus').status_code == 400
+    cursor = client.get('/api/rows?limit=1').get_json()['next_cursor']
+    assert client.get(f'/api/rows?cursor={cursor}&sort=segment').status_code == 400
+
+def test_conditional_get(client, sample_tsv):
+    """Test /data and /charts answer 304 until the dataset or the arguments change."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    for path in ['/data?segment=premium', '/charts']:
+        rv = client.get(path)
+        etag = rv.headers['ETag']
+        assert rv.headers['Cache-Control'] == 'private, no-cache'
+        rv = client.get(path, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        assert rv.data == b''
+        assert client.get(path + ('&' if '?' in path else '?') + 'page=2', headers={'If-None-Match': etag}).status_code == 200
+    
+    etag = client.get('/data').headers['ETag']
+    client.post('/edit/0', data={'query_text': 'changed', 'metadata_segment': 'regular'})
+    client.get('/data')
+    rv = client.get('/data', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert b'changed' in rv.data
+
+def test_conditional_get_of_dropped_dataset(client, sample_tsv):
+    """Test a matching ETag is not answered with 304 once the dataset is gone."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    etags = {path: client.get(path).headers['ETag'] for path in ['/data', '/charts', '/download']}
+    with client.session_transaction() as sess:
+        registry.drop(sess['dataset_id'])
+    
+    for path in ['/data', '/download']:
+        rv = client.get(path, headers={'If-None-Match': etags[path]})
+        assert rv.status_code == 302
+        assert rv.location.endswith('/')
+    rv = client.get('/charts', headers={'If-None-Match': etags['/charts']})
+    assert rv.status_code == 200
+    assert b'No data available' in rv.data
+
+def test_download_reuses_unchanged_export(client, sample_tsv, monkeypatch):
+    """Test ranged /download exports an unchanged dataset once and answers 304 to a matching ETag."""
+    import app as app_module
+    exports = []
+    save = app_module.save_data_to_file
+    monkeypatch.setattr(app_module, 'save_data_to_file', lambda path, data: exports.append(path) or save(path, data))
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    full = client.get('/download').data
+    assert exports == []
+    first = client.get('/download', headers={'Range': 'bytes=0-9'})
+    assert first.status_code == 206
+    assert first.data == full[:10]
+    second = client.get('/download', headers={'Range': 'bytes=10-'})
+    assert second.data == full[10:]
+    assert len(exports) == 1
+    assert client.get('/download', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    client.post('/add', data={'query_text': 'new', 'metadata_segment': 'regular'})
+    assert b'new' in client.get('/download', headers={'Range': 'bytes=0-'}).data
+    assert len(exports) == 2
+
+def test_download_gzip(client, sample_tsv):
+    """Test /download streams a gzip body to clients that accept it."""
+    import gzip
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    plain = client.get('/download')
+    compressed = client.get('/download', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert gzip.decompress(compressed.data) == plain.data
+
 def test_data_table_no_data(client):
     """Test /data redirects when no data."""
     rv = client.get('/data')
@@ -122,9 +347,10 @@ def test_edit_post(client, sample_tsv):
     assert rv.location.endswith('/data')
     
     with client.session_transaction() as sess:
-        data = sess['data'][0]
-        assert data['query'][0]['text'] == 'updated_query'
-        assert data['metadata']['segment'] == 'updated_segment'
+        assert sess['dataset_version'] == 1
+        data = registry.get(sess['dataset_id'], sess['dataset_version'])[0]
+        assert data.query[0]['text'] == 'updated_query'
+        assert data.metadata['segment'] == 'updated_segment'
 
 def test_add_get(client, sample_tsv):
     """Test GET /add shows add form."""
@@ -152,10 +378,11 @@ def test_add_post(client, sample_tsv):
     assert rv.location.endswith('/data')
     
     with client.session_transaction() as sess:
-        assert len(sess['data']) == 3
-        new_data = sess['data'][-1]
-        assert new_data['query'][0]['text'] == 'new_query'
-        assert new_data['metadata']['segment'] == 'new_segment'
+        dataset = registry.get(sess['dataset_id'], sess['dataset_version'])
+        assert len(dataset) == 3
+        new_data = dataset[-1]
+        assert new_data.query[0]['text'] == 'new_query'
+        assert new_data.metadata['segment'] == 'new_segment'
 
 def test_charts(client, sample_tsv):
     """Test /charts renders charts."""
@@ -167,6 +394,42 @@ def test_charts(client, sample_tsv):
     assert b'regular' in rv.data
     assert b'premium' in rv.data
 
+def test_charts_fields_and_filters(client, sample_tsv):
+    """Test /charts charts the requested fields over the filtered rows."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/charts?pie=sub_intent&segment=premium')
+    assert rv.status_code == 200
+    assert b'Sub Intent Distribution' in rv.data
+    assert b'sub2' in rv.data
+    assert b'sub1' not in rv.data
+
+def test_unknown_sort_fields_are_ignored(client, sample_tsv):
+    """Test sorting by names that are not metadata fields builds no columns."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    for name in ['junk1', '-junk2', 'segment,junk3']:
+        assert client.get(f'/data?sort={name}').status_code == 200
+        assert client.get(f'/api/rows?sort={name}').status_code == 200
+    with client.session_transaction() as sess:
+        data = registry.get(sess['dataset_id'])
+    assert not any(field.startswith('junk') for field in data.columns)
+
+def test_unknown_chart_fields_use_defaults(client, sample_tsv):
+    """Test charting names that are not metadata fields charts the default fields instead."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/charts?pie=junk1&bar=junk2&stack=junk3')
+    assert rv.status_code == 200
+    assert b'Segment Distribution' in rv.data
+    with client.session_transaction() as sess:
+        data = registry.get(sess['dataset_id'])
+    assert not any(field.startswith('junk') for field in data.columns)
+    assert not any(field.startswith('junk') for field in data.chart_aggregates.counts)
+
 def test_download(client, sample_tsv):
     """Test /download serves modified TSV."""
     with open(sample_tsv, 'rb') as f:
@@ -177,6 +440,59 @@ def test_download(client, sample_tsv):
     assert rv.headers['Content-Disposition'].startswith('attachment; filename=test_modified.tsv')
     assert b'query1' in rv.data
 
+def test_download_after_editing_last_row_without_newline(client, sample_tsv):
+    """Test the edited last row of a file with no final newline is downloaded once."""
+    with open(sample_tsv, 'rb') as f:
+        assert not f.read().endswith(b'\n')
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    client.post('/edit/1', data={'query_text': 'edited_last', 'metadata_segment': 'premium'})
+    
+    lines = client.get('/download').data.decode('utf-8').splitlines()
+    assert len(lines) == 2
+    assert 'query1' in lines[0] and 'edited_last' in lines[1]
+
+def test_add_bulk(client, sample_tsv):
+    """Test /add_bulk merges every row of an uploaded TSV as one change."""
+    import io
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    batch = ''.join(f'[{{"text": "bulk{i}"}}]\t{{"segment": "bulk", "question_intent": "intent1"}}\n' for i in range(30))
+    
+    rv = client.post('/add_bulk', data={'tsv_file': (io.BytesIO(batch.encode()), 'batch.tsv')},
+                     content_type='multipart/form-data', follow_redirects=True)
+    assert b'Added 30 data points!' in rv.data
+    with client.session_transaction() as sess:
+        assert sess['dataset_version'] == 1
+    rows = client.get('/api/rows?segment=bulk&limit=100').get_json()['rows']
+    assert [row['query'][0]['text'] for row in rows] == [f'bulk{i}' for i in range(30)]
+    assert client.get('/download_added').data.count(b'bulk') == 60
+
+def test_add_bulk_rejects_unknown_fields(client, sample_tsv):
+    """Test /add_bulk adds nothing when a row has fields the dataset does not."""
+    import io
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    batch = b'[{"text": "ok"}]\t{"segment": "bulk"}\n[{"text": "bad"}]\t{"colour": "red"}\n'
+    
+    rv = client.post('/add_bulk', data={'tsv_file': (io.BytesIO(batch), 'batch.tsv')},
+                     content_type='multipart/form-data', follow_redirects=True)
+    assert b'Line 2: unknown fields colour' in rv.data
+    assert client.get('/api/rows?segment=bulk').get_json()['rows'] == []
+
+def test_bulk_edit_matching_rows(client, sample_tsv):
+    """Test /data/bulk_edit sets a field on every row matching the filter and reports the count."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.post('/data/bulk_edit?segment=regular', data={'field': 'sub_intent', 'value': 'relabelled'},
+                     follow_redirects=True)
+    assert b'Updated 1 of 1 matching rows' in rv.data
+    rows = client.get('/api/rows?sub_intent=relabelled').get_json()['rows']
+    assert [row['metadata']['segment'] for row in rows] == ['regular']
+    rv = client.post('/data/bulk_edit', data={'field': 'colour', 'value': 'red'}, follow_redirects=True)
+    assert b'Unknown field: colour' in rv.data
+
 def test_download_added(client, sample_tsv):
     """Test /download_added serves added TSV after adding data."""
     with open(sample_tsv, 'rb') as f:
@@ -213,3 +529,42 @@ def test_session_isolation(client, sample_tsv):
         sid2 = sess2['sid']
         assert sess2['selected_file_name'] == 'test2.tsv'
         assert sid1 != sid2
+
+def test_edit_post_invalid_index(client, sample_tsv):
+    """Test POST /edit with an out-of-range index leaves data untouched."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.post('/edit/5', data={'query_text': 'x'})
+    assert rv.status_code == 302
+    with client.session_transaction() as sess:
+        assert sess['dataset_version'] == 0
+
+def test_reupload_drops_previous_dataset(client, sample_tsv):
+    """Test uploading a new file replaces the session's registry entry."""
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        first_id = sess['dataset_id']
+    
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        assert sess['dataset_id'] != first_id
+    assert registry.get(first_id) is None
+
+def test_sqlite_storage(client, sample_tsv, monkeypatch):
+    """Test browsing, editing and downloading a dataset stored in SQLite."""
+    monkeypatch.setitem(app.config, 'DATASET_STORAGE', 'sqlite')
+    with open(sample_tsv, 'rb') as f:
+        client.post('/', data={'tsv_file': (f, 'test.tsv')}, content_type='multipart/form-data')
+    
+    rv = client.get('/data?segment=premium&sort=-question_intent')
+    assert b'query2' in rv.data
+    assert b'query1' not in rv.data
+    rv = client.post('/edit/0', data={'query_text': 'updated_query', 'metadata_segment': 'premium'})
+    assert rv.status_code == 302
+    rv = client.get('/data?segment=premium&text=updated')
+    assert b'updated_query' in rv.data
+    assert b'Filtered rows: 1' in rv.data
+    assert b'updated_query' in client.get('/download').data
@@ -0,0 +1,121 @@
+import random
+import pytest
+from src import bitmaps
+from src.bitmaps import FilterIndex, indices_to_bitmap, bitmap_to_indices, bitmap_select
+from src.columns import MISSING, build_columns, sort_key
+from src.data import QueryData
+from src.store import Dataset
+
+@pytest.fixture
+def rows():
+    """Random rows over a small vocabulary, some with missing fields."""
+    rng = random.Random(7)
+    result = []
+    for i in range(500):
+        metadata = {'segment': rng.choice(['Regular', ' premium ', 'trial']),
+                    'question_intent': rng.choice(['billing', 'Billing-Refund', 'login', None])}
+        if i % 7:
+            metadata['sub_intent'] = rng.choice(['sub1', 'sub2', 'other'])
+        result.append(QueryData([{'text': f'query{i}'}], metadata))
+    return result
+
+def scan(rows, params):
+    """Return the indices of rows whose fields contain every search term, by checking each row."""
+    return [i for i, row in enumerate(rows)
+            if all(term in str(row.metadata.get(field, 'Unknown')).strip().lower() for field, term in params.items() if term)]
+
+def stable_sort(rows, indices, sort_spec):
+    """Stably sort row indices by (field, reverse) pairs, one field at a time from the last."""
+    for field, reverse in reversed(sort_spec):
+        indices = sorted(indices, key=lambda i: sort_key(rows[i].metadata.get(field, MISSING)), reverse=reverse)
+    return indices
+
+def test_bitmap_round_trip():
+    """Test converting indices to a bitset and back."""
+    indices = [0, 3, 8, 9, 63, 64, 1000]
+    bits = indices_to_bitmap(indices, 1001)
+    assert bits.bit_count() == len(indices)
+    assert bitmap_to_indices(bits) == indices
+    assert bitmap_to_indices(0) == []
+
+def test_bitmap_select_across_chunks(monkeypatch):
+    """Test page selection skips whole windows and blocks by population count and stops at the page end."""
+    monkeypatch.setattr(bitmaps, 'SELECT_CHUNK_BYTES', 2)
+    monkeypatch.setattr(bitmaps, 'SELECT_BLOCK_BYTES', 3)
+    indices = list(range(0, 400, 3))
+    bits = indices_to_bitmap(indices, 400)
+    for start, stop in [(0, 5), (10, 20), (130, 140), (133, 134), (200, 210)]:
+        assert bitmap_select(bits, start, stop) == indices[start:stop]
+    rng = random.Random(5)
+    indices = sorted(rng.sample(range(5000), 1200))
+    bits = indices_to_bitmap(indices, 5000)
+    for start in [0, 1, 7, 599, 1150, 1199]:
+        assert bitmap_select(bits, start, start + 50) == indices[start:start + 50]
+    assert bitmap_select(0, 0, 10) == []
+
+def test_filter_index_matches_scan(rows):
+    """Test bitmap filtering returns exactly the rows a scan of every row finds."""
+    index = FilterIndex(build_columns(rows), len(rows))
+    for params in [
+        {'question_intent': 'billing', 'sub_intent': '', 'segment': ''},
+        {'question_intent': 'none', 'sub_intent': 'sub', 'segment': 'prem'},
+        {'question_intent': '', 'sub_intent': 'unknown', 'segment': ''},
+        {'question_intent': 'missing', 'sub_intent': '', 'segment': ''},
+        {'question_intent': '', 'sub_intent': '', 'segment': ''}
+    ]:
+        assert bitmap_to_indices(index.match(params)) == scan(rows, params)
+
+def test_filter_index_follows_dataset_changes(rows):
+    """Test the dataset keeps its filter index current on edits and appends."""
+    dataset = Dataset('test', rows)
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'enterprise'}
+    assert dataset.filter_index.match(params) == 0
+    dataset._apply_change({'op': 'update', 'index': 4, 'row': {'query': [], 'metadata': {'segment': 'Enterprise'}}})
+    dataset._apply_change({'op': 'append', 'row': {'query': [], 'metadata': {'segment': 'enterprise'}}})
+    assert bitmap_to_indices(dataset.filter_index.match(params)) == [4, 500]
+    everything = {'question_intent': '', 'sub_intent': '', 'segment': ''}
+    assert dataset.filter_index.match(everything).bit_count() == 501
+
+def test_select_sorted_matches_stable_sort(rows):
+    """Test sorted pages read from the bitsets match a stable sort of the filtered rows."""
+    dataset = Dataset('test', rows)
+    dataset._apply_change({'op': 'update', 'index': 9, 'row': {'query': [], 'metadata': {'segment': 'Trial', 'question_intent': 3}}})
+    index = dataset.filter_index
+    bits = index.match({'question_intent': '', 'sub_intent': '', 'segment': 'r'})
+    rows = list(dataset)
+    for sort_spec in [[('question_intent', False)], [('segment', True), ('sub_intent', False)],
+                      [('sub_intent', True), ('question_intent', True), ('segment', False)]]:
+        expected = stable_sort(rows, bitmap_to_indices(bits), sort_spec)
+        assert index.select_sorted(bits, sort_spec) == expected
+        assert index.select_sorted(bits, sort_spec, 17, 41) == expected[17:41]
+
+def test_select_sorted_high_cardinality(monkeypatch, rows):
+    """Test fields with too many distinct values are sorted without bitsets."""
+    monkeypatch.setattr(bitmaps, 'MAX_BITMAP_VALUES', 3)
+    rows = [QueryData(row.query, dict(row.metadata, score=i % 11)) for i, row in enumerate(rows)]
+    dataset = Dataset('test', rows)
+    dataset.column('score')
+    index = dataset.filter_index
+    assert not index.ensure_field('score')
+    assert index.ensure_field('question_intent')
+    bits = index.match({'question_intent': 'b', 'sub_intent': '', 'segment': ''})
+    sort_spec = [('score', True), ('segment', False)]
+    expected = stable_sort(rows, bitmap_to_indices(bits), sort_spec)
+    assert index.select_sorted(bits, sort_spec, 5, 25) == expected[5:25]
+
+def test_after_continues_sorted_order(monkeypatch, rows):
+    """Test the rows after any keyset position are the rest of the sorted order."""
+    rows = [QueryData(row.query, dict(row.metadata, score=i % 7)) for i, row in enumerate(rows)]
+    dataset = Dataset('test', rows)
+    dataset.column('score')
+    index = dataset.filter_index
+    monkeypatch.setattr(bitmaps, 'MAX_BITMAP_VALUES', 5)
+    bits = index.match({'question_intent': '', 'sub_intent': '', 'segment': 'r'})
+    for sort_spec in [[], [('question_intent', True)], [('segment', False), ('sub_intent', True)], [('score', False)]]:
+        for field, _ in sort_spec:
+            index.ensure_field(field)
+        order = index.select_sorted(bits, sort_spec)
+        for position in [0, 13, len(order) - 1]:
+            last = order[position]
+            keys = [sort_key(dataset[last].metadata.get(field, MISSING)) for field, _ in sort_spec]
+            assert index.select_sorted(index.after(bits, sort_spec, keys, last), sort_spec) == order[position + 1:]
@@ -0,0 +1,50 @@
+from array import array
+from src.cache import ResultCache, CachedView
+
+def test_cache_hits_and_misses():
+    """Test lookups count hits and misses and keys are scoped per dataset."""
+    cache = ResultCache()
+    assert cache.get('a', 0, 'k') is None
+    cache.put('a', 0, 'k', 'value', 10)
+    assert cache.get('a', 0, 'k') == 'value'
+    assert cache.get('b', 0, 'k') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['bytes']) == (1, 2, 1, 10)
+
+def test_cache_new_version_invalidates():
+    """Test seeing a newer dataset version drops that dataset's older entries only."""
+    cache = ResultCache()
+    cache.put('a', 0, 'k1', 1, 10)
+    cache.put('a', 0, 'k2', 2, 10)
+    cache.put('b', 0, 'k1', 3, 10)
+    assert cache.get('a', 1, 'k1') is None
+    assert cache.stats()['entries'] == 1
+    cache.put('a', 0, 'k1', 'stale', 10)
+    assert cache.get('a', 1, 'k1') is None
+    assert cache.get('b', 0, 'k1') == 3
+
+def test_cache_evicts_by_bytes():
+    """Test least recently used entries are evicted to stay within the byte budget."""
+    cache = ResultCache(max_bytes=100)
+    cache.put('a', 0, 'k1', 1, 40)
+    cache.put('a', 0, 'k2', 2, 40)
+    cache.get('a', 0, 'k1')
+    cache.put('a', 0, 'k3', 3, 40)
+    assert cache.get('a', 0, 'k2') is None
+    assert cache.get('a', 0, 'k1') == 1
+    cache.put('a', 0, 'k4', 4, 1000)
+    assert cache.get('a', 0, 'k4') is None
+    cache.put('a', 0, 'k1', 1, 10)
+    stats = cache.stats()
+    assert stats['bytes'] == 50
+    assert stats['evictions'] == 1
+    cache.drop('a')
+    assert cache.stats()['bytes'] == 0
+
+def test_cached_view_size():
+    """Test a view's estimated size follows its bitset and materialized order."""
+    view = CachedView(0b1011)
+    assert view.count == 3
+    before = view.nbytes
+    view.order = array('I', [0, 1, 3])
+    assert view.nbytes == before + 12
@@ -0,0 +1,67 @@
+import os
+import json
+import pytest
+import tempfile
+from src.data import QueryData, load_query_data
+from src.columnar import ColumnarDataset, RowView, JsonStore, load_columnar, memory_report
+
+@pytest.fixture
+def sample_rows():
+    """Sample QueryData rows with indexed and extra metadata."""
+    return [
+        QueryData([{'text': f'query{i}'}], {'source': 'eval', 'segment': ['regular', 'premium'][i % 2],
+                                            'question_intent': f'intent{i % 3}', 'score': i})
+        for i in range(30)
+    ]
+
+def test_json_store_set_repoints_span():
+    """Test replacing a document keeps the others intact."""
+    store = JsonStore()
+    store.append({'a': 1})
+    store.append(['b'])
+    store.set(0, {'a': 2})
+    assert store.get(0) == {'a': 2}
+    assert store.get(1) == ['b']
+    assert len(store) == 2
+
+def test_columnar_round_trip_preserves_rows(sample_rows):
+    """Test rows round-trip exactly, including metadata key order."""
+    dataset = ColumnarDataset.from_rows(sample_rows)
+    assert len(dataset) == 30
+    assert dataset.to_dicts() == [row.to_dict() for row in sample_rows]
+    assert list(dataset[1].metadata) == ['source', 'segment', 'question_intent', 'score']
+    assert 'sub_intent' not in dataset[1].metadata
+    assert dataset.columns['segment'].values == ['regular', 'premium']
+
+def test_row_view_is_query_data_compatible(sample_rows):
+    """Test RowView supports to_dict/from_dict and has no instance dict."""
+    view = ColumnarDataset.from_rows(sample_rows)[-1]
+    assert isinstance(view, RowView)
+    assert not hasattr(view, '__dict__')
+    assert view.query == [{'text': 'query29'}]
+    assert RowView.from_dict(view.to_dict()).to_dict() == view.to_dict()
+
+def test_columnar_set_updates_columns(sample_rows):
+    """Test replacing a row updates both its JSON and its codes."""
+    dataset = ColumnarDataset.from_rows(sample_rows)
+    dataset.set(0, QueryData([{'text': 'edited'}], {'segment': 'trial'}))
+    assert dataset[0].to_dict() == {'query': [{'text': 'edited'}], 'metadata': {'segment': 'trial'}}
+    assert dataset.columns['segment'].value(0) == 'trial'
+
+def test_load_columnar_matches_load_query_data(sample_rows):
+    """Test serial and parallel columnar loads match the eager loader."""
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for row in sample_rows:
+            f.write(f"{json.dumps(row.query)}\t{json.dumps(row.metadata)}\n")
+    expected = [row.to_dict() for row in load_query_data(path)]
+    assert load_columnar(path, parallel_threshold=None).to_dicts() == expected
+    assert load_columnar(path, parallel_threshold=0, workers=3).to_dicts() == expected
+    os.remove(path)
+
+def test_memory_report(sample_rows):
+    """Test the memory report compares both representations."""
+    report = memory_report(sample_rows)
+    assert report['rows'] == 30
+    assert report['columnar_bytes'] < report['query_data_bytes']
+    assert report['ratio'] > 1
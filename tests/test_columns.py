@@ -0,0 +1,39 @@
+from src.columns import CategoricalColumn, MISSING, build_columns, display_value, value_key
+from src.data import QueryData
+
+def test_categorical_column_encodes_values():
+    """Test values are dictionary-encoded in first-seen order."""
+    column = CategoricalColumn()
+    for value in ['a', 'b', 'a', MISSING, 'b']:
+        column.append(value)
+    assert column.values == ['a', 'b', MISSING]
+    assert list(column.codes) == [0, 1, 0, 2, 1]
+    column.set(0, 'c')
+    assert column.value(0) == 'c'
+    assert len(column) == 5
+
+def test_categorical_column_keeps_types_distinct():
+    """Test equal-hashing values of different types get different codes."""
+    column = CategoricalColumn()
+    for value in [1, True, '1', ['x'], ['x']]:
+        column.append(value)
+    assert list(column.codes) == [0, 1, 2, 3, 3]
+    assert value_key(['x']) == value_key(['x'])
+
+def test_categorical_column_extend_remaps_codes():
+    """Test extending re-maps another column's codes into this vocabulary."""
+    left, right = CategoricalColumn(), CategoricalColumn()
+    for value in ['a', 'b']:
+        left.append(value)
+    for value in ['b', 'c', 'b']:
+        right.append(value)
+    left.extend(right)
+    assert [left.value(i) for i in range(5)] == ['a', 'b', 'b', 'c', 'b']
+
+def test_build_columns_and_display_value():
+    """Test columns built from rows mark missing fields."""
+    rows = [QueryData([], {'segment': 'regular'}), QueryData([], {})]
+    columns = build_columns(rows)
+    assert columns['segment'].value(1) is MISSING
+    assert display_value(columns['segment'].value(1)) == 'Unknown'
+    assert display_value(None) == 'None'
@@ -3,7 +3,7 @@ import pytest
 import json
 import tempfile
 import os
-from src.data import QueryData, load_query_data
+from src.data import QueryData, load_query_data, parse_line, split_line_ranges, TsvChunkParser
 
 @pytest.fixture
 def sample_data():
@@ -77,3 +77,71 @@ def test_load_query_data_invalid_format():
         load_query_data(path)
     
     os.remove(path)
+
+def test_parse_line():
+    """Test parse_line builds a QueryData from one TSV line."""
+    row = parse_line(f"{json.dumps([{'text': 'query1'}])}\t{json.dumps({'segment': 'regular'})}\n")
+    assert row.query == [{'text': 'query1'}]
+    assert row.metadata == {'segment': 'regular'}
+
+def test_chunk_parser_matches_load_query_data():
+    """Test TsvChunkParser yields the same rows for arbitrary chunk boundaries."""
+    lines = [f"{json.dumps([{'text': f'qé{i}'}], ensure_ascii=False)}\t{json.dumps({'segment': 's'})}" for i in range(20)]
+    content = '\n'.join(lines).encode('utf-8')
+    for size in (1, 7, 64, len(content)):
+        parser = TsvChunkParser()
+        for start in range(0, len(content), size):
+            parser.feed(content[start:start + size])
+        rows = parser.close()
+        assert [r.query[0]['text'] for r in rows] == [f'qé{i}' for i in range(20)]
+
+def test_chunk_parser_invalid_line():
+    """Test TsvChunkParser raises the same errors as load_query_data."""
+    parser = TsvChunkParser()
+    with pytest.raises(ValueError, match="Invalid line format"):
+        parser.feed(b"single_column\n")
+    parser = TsvChunkParser()
+    parser.feed(b"invalid_json\t{}")
+    with pytest.raises(ValueError, match="Invalid JSON"):
+        parser.close()
+
+@pytest.fixture
+def large_tsv():
+    """Create a TSV file with 200 rows, CRLF line endings and a missing final newline."""
+    lines = [f"{json.dumps([{'text': f'qé{i}'}], ensure_ascii=False)}\t{json.dumps({'segment': f's{i % 3}'})}" for i in range(200)]
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        f.write('\r\n'.join(lines))
+    yield path
+    os.remove(path)
+
+def test_split_line_ranges(large_tsv):
+    """Test byte ranges cover the file and end on line boundaries."""
+    ranges = split_line_ranges(large_tsv, 7)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == os.path.getsize(large_tsv)
+    with open(large_tsv, 'rb') as f:
+        content = f.read()
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert content[end - 1:end] == b'\n'
+
+def test_load_query_data_parallel_matches_serial(large_tsv):
+    """Test the parallel loader returns the same rows in the same order."""
+    serial = load_query_data(large_tsv, parallel_threshold=None)
+    parallel = load_query_data(large_tsv, parallel_threshold=0, workers=3)
+    assert [d.to_dict() for d in parallel] == [d.to_dict() for d in serial]
+    assert len(parallel) == 200
+
+def test_load_query_data_parallel_reports_first_error():
+    """Test the parallel loader raises the error for the earliest bad line."""
+    lines = [f"{json.dumps([{'text': f'q{i}'}])}\t{{}}" for i in range(100)]
+    lines[30] = "first_bad_line"
+    lines[80] = "invalid_json\t{}"
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    
+    with pytest.raises(ValueError, match="Invalid line format: first_bad_line"):
+        load_query_data(path, parallel_threshold=0, workers=4)
+    os.remove(path)
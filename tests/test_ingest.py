@@ -0,0 +1,76 @@
+import os
+import json
+import shutil
+import pytest
+import tempfile
+from src.ingest import UploadProgress, TsvUploadStream, read_progress
+from src.lazy import LineIndex
+
+@pytest.fixture
+def folder():
+    """Create a temporary folder for uploads and progress files."""
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+def tsv_bytes(n):
+    """Build n TSV rows as bytes."""
+    return ''.join(
+        f"{json.dumps([{'text': f'query{i}'}])}\t{json.dumps({'segment': 'regular'})}\n" for i in range(n)
+    ).encode('utf-8')
+
+def test_upload_progress_roundtrip(folder):
+    """Test progress is readable by upload ID and removed on discard."""
+    progress = UploadProgress(folder, 'abc123', total_bytes=100, interval=0)
+    assert read_progress(folder, 'abc123')['state'] == 'receiving'
+    progress.update(50, 3)
+    assert read_progress(folder, 'abc123') == {
+        'state': 'receiving', 'bytes_read': 50, 'total_bytes': 100, 'rows_parsed': 3, 'error': None
+    }
+    progress.finish(6)
+    assert read_progress(folder, 'abc123')['state'] == 'done'
+    progress.discard()
+    assert read_progress(folder, 'abc123') is None
+    assert read_progress(folder, '../x') is None
+
+def test_upload_stream_parses_while_writing(folder):
+    """Test rows are parsed as chunks are written and the file is moved on save."""
+    progress = UploadProgress(folder, 'up1', interval=0)
+    stream = TsvUploadStream(folder, progress, sink=LineIndex())
+    content = tsv_bytes(5)
+    stream.write(content[:40])
+    stream.write(content[40:])
+    assert stream.rows_parsed == 5
+    assert read_progress(folder, 'up1')['bytes_read'] == len(content)
+    
+    dst = os.path.join(folder, 'saved.tsv')
+    stream.save(dst)
+    index = stream.finish()
+    stream.close()
+    assert len(index) == 5
+    assert index.offsets[-1] == len(content)
+    assert index.columns['segment'].values == ['regular']
+    with open(dst, 'rb') as f:
+        assert f.read() == content
+    assert read_progress(folder, 'up1') is None
+
+def test_upload_stream_reports_error_after_draining(folder):
+    """Test a bad line is reported once the upload completes."""
+    progress = UploadProgress(folder, 'up2', interval=0)
+    stream = TsvUploadStream(folder, progress, sink=LineIndex())
+    stream.write(b"single_column\n")
+    stream.write(tsv_bytes(2))
+    assert stream.bytes_read == len(b"single_column\n") + len(tsv_bytes(2))
+    with pytest.raises(ValueError, match="Invalid line format"):
+        stream.finish()
+    assert read_progress(folder, 'up2')['state'] == 'error'
+    stream.close()
+    assert [name for name in os.listdir(folder) if name.endswith('.part')] == []
+
+def test_upload_stream_without_parsing(folder):
+    """Test a stream without a sink only writes the upload and leaves parsing to the loader."""
+    stream = TsvUploadStream(folder)
+    stream.write(tsv_bytes(3))
+    assert stream.rows_parsed == 0
+    assert stream.finish() is None
+    stream.close()
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import pytest
+import tempfile
+from datetime import timedelta
+from flask import Flask
+from src.store import DatasetRegistry, BASES_DIRNAME
+from src.janitor import Janitor, retire, TRASH_DIRNAME, LOCK_FILENAME, TOUCH_INTERVAL
+
+@pytest.fixture
+def app():
+    """Create a Flask app with temporary session, dataset and progress folders."""
+    app = Flask(__name__)
+    for key in ('DATA_FOLDER', 'MODIFIED_FOLDER', 'ADDED_FOLDER', 'DATASET_FOLDER', 'PROGRESS_FOLDER'):
+        app.config[key] = tempfile.mkdtemp()
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
+    app.config['JANITOR_DELETES_PER_SECOND'] = 100000
+    yield app
+    for key in ('DATA_FOLDER', 'MODIFIED_FOLDER', 'ADDED_FOLDER', 'DATASET_FOLDER', 'PROGRESS_FOLDER'):
+        shutil.rmtree(app.config[key], ignore_errors=True)
+
+@pytest.fixture
+def registry(app):
+    """A dataset registry over the app's dataset folder."""
+    return DatasetRegistry(app)
+
+@pytest.fixture
+def source_tsv():
+    """Create a TSV file with 2 rows."""
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(f"{json.dumps([{'text': 'query1'}])}\t{json.dumps({'segment': 'regular'})}\n")
+        f.write(f"{json.dumps([{'text': 'query2'}])}\t{json.dumps({'segment': 'premium'})}\n")
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+def make_session_folder(app, key, session_id, content=b'x' * 10):
+    """Create a session folder holding one file."""
+    folder = os.path.join(app.config[key], session_id)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'data.tsv'), 'wb') as f:
+        f.write(content)
+    return folder
+
+def test_retired_folder_is_deleted_on_next_sweep(app, registry):
+    """Test retire renames into the trash and the next sweep deletes it and counts the bytes."""
+    folder = make_session_folder(app, 'DATA_FOLDER', 'abc123', b'x' * 100)
+    retire(folder)
+    assert not os.path.exists(folder)
+    assert len(os.listdir(os.path.join(app.config['DATA_FOLDER'], TRASH_DIRNAME))) == 1
+    janitor = Janitor(app, registry)
+    assert janitor.sweep() == 100
+    assert os.listdir(os.path.join(app.config['DATA_FOLDER'], TRASH_DIRNAME)) == []
+    assert janitor.stats() == {'deleted_files': 1, 'reclaimed_bytes': 100}
+
+def test_sessions_expire_after_session_lifetime(app, registry):
+    """Test a session's folders are deleted together once all of them are idle past the TTL."""
+    janitor = Janitor(app, registry)
+    stale = [make_session_folder(app, 'DATA_FOLDER', 'stale'), make_session_folder(app, 'ADDED_FOLDER', 'stale')]
+    active = [make_session_folder(app, 'DATA_FOLDER', 'active'), make_session_folder(app, 'MODIFIED_FOLDER', 'active')]
+    past = time.time() - janitor.ttl - 10
+    for folder in stale + active[:1]:
+        for path in [os.path.join(folder, 'data.tsv'), folder]:
+            os.utime(path, (past, past))
+    assert sorted(janitor.expired_paths()) == sorted(stale)
+    assert janitor.sweep() == 20
+    assert not any(os.path.exists(folder) for folder in stale)
+    assert all(os.path.exists(folder) for folder in active)
+    assert janitor.sweep(now=time.time() + janitor.ttl + 10) == 20
+    assert not any(os.path.exists(folder) for folder in active)
+
+def test_unreferenced_bases_expire(app, registry, source_tsv):
+    """Test a stored base is kept while a dataset names it and deleted with the dataset after the TTL."""
+    janitor = Janitor(app, registry)
+    dataset = registry.create(source_tsv)
+    bases_dir = os.path.join(app.config['DATASET_FOLDER'], BASES_DIRNAME)
+    later = time.time() + janitor.ttl + 10
+    dataset_id = dataset.dataset_id
+    del dataset
+    registry.forget(dataset_id)
+    assert registry.unreferenced_bases() == []
+    janitor.sweep(now=later)
+    assert registry.get(dataset_id) is None
+    assert len(os.listdir(bases_dir)) == 1
+    janitor.sweep(now=later)
+    assert os.listdir(bases_dir) == []
+
+def test_touch_is_throttled(app, registry):
+    """Test touch writes a path's modification time at most once per interval and sweeps forget idle paths."""
+    janitor = Janitor(app, registry)
+    folder = make_session_folder(app, 'DATA_FOLDER', 'abc123')
+    past = time.time() - 1000
+    os.utime(folder, (past, past))
+    janitor.touch(folder)
+    assert os.path.getmtime(folder) > past + 500
+    os.utime(folder, (past, past))
+    janitor.touch(folder)
+    assert os.path.getmtime(folder) == past
+    other = make_session_folder(app, 'DATA_FOLDER', 'def456')
+    janitor.touch(other)
+    janitor._touched[folder] -= TOUCH_INTERVAL
+    janitor.sweep()
+    assert list(janitor._touched) == [other]
+
+def test_sweep_skips_while_another_worker_sweeps(app, registry):
+    """Test a sweep returns without deleting while another process holds the lock."""
+    retire(make_session_folder(app, 'DATA_FOLDER', 'abc123'))
+    with open(os.path.join(app.config['DATASET_FOLDER'], LOCK_FILENAME), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(Janitor(app, registry).sweep())
+        _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert len(os.listdir(os.path.join(app.config['DATA_FOLDER'], TRASH_DIRNAME))) == 1
+    assert Janitor(app, registry).sweep() == 10
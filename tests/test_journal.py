@@ -0,0 +1,81 @@
+import os
+import json
+import tempfile
+import threading
+import pytest
+from src.journal import ChangeJournal, SEAL_OP, read_seal, write_synced
+
+@pytest.fixture
+def journal_path():
+    """Path of a journal file that does not exist yet."""
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    os.close(fd)
+    os.remove(path)
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+def test_append_and_read(journal_path):
+    """Test records read back from an offset, with the offset after the last one."""
+    journal = ChangeJournal(journal_path)
+    _, first_end = journal.append({'op': 'append', 'row': 1})
+    _, second_end = journal.append({'op': 'append', 'row': 2})
+    assert journal.read(0) == ([{'op': 'append', 'row': 1}, {'op': 'append', 'row': 2}], second_end, None)
+    assert journal.read(first_end)[0] == [{'op': 'append', 'row': 2}]
+    journal.close()
+
+def test_partial_record_is_not_read(journal_path):
+    """Test a record cut off by a crash is ignored and can be truncated."""
+    journal = ChangeJournal(journal_path)
+    _, end = journal.append({'op': 'append', 'row': 1})
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"op": "app')
+    records, offset, _ = journal.read(0)
+    assert len(records) == 1 and offset == end
+    journal.truncate(offset)
+    journal.append({'op': 'append', 'row': 2})
+    assert len(journal.read(0)[0]) == 2
+    journal.close()
+
+def test_commit_batches_fsync(journal_path, monkeypatch):
+    """Test writers waiting on a sync in progress share the next one."""
+    journal = ChangeJournal(journal_path)
+    started, release = threading.Event(), threading.Event()
+    fsync = os.fsync
+    def slow_fsync(fd):
+        started.set()
+        release.wait()
+        fsync(fd)
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+    first, _ = journal.append({'op': 'append', 'row': 0})
+    syncing = threading.Thread(target=journal.commit, args=(first,))
+    syncing.start()
+    started.wait()
+    sequences = [journal.append({'op': 'append', 'row': i})[0] for i in range(1, 6)]
+    waiting = [threading.Thread(target=journal.commit, args=(sequence,)) for sequence in sequences]
+    for thread in waiting:
+        thread.start()
+    release.set()
+    for thread in [syncing] + waiting:
+        thread.join()
+    assert journal.syncs == 2
+    journal.close()
+
+def test_read_stops_at_seal(journal_path):
+    """Test a sealed journal reports the seal and read_seal finds it."""
+    journal = ChangeJournal(journal_path)
+    journal.append({'op': 'append', 'row': 1})
+    assert read_seal(journal_path) is None
+    journal.append({'op': SEAL_OP, 'generation': 1, 'version': 1})
+    records, _, seal = journal.read(0)
+    assert len(records) == 1
+    assert seal == read_seal(journal_path) == {'op': SEAL_OP, 'generation': 1, 'version': 1}
+    journal.close()
+
+def test_write_synced_replaces_file(journal_path):
+    """Test write_synced leaves only the new contents."""
+    write_synced(journal_path, b'old')
+    write_synced(journal_path, json.dumps({'generation': 2}).encode())
+    with open(journal_path, 'rb') as f:
+        assert json.load(f) == {'generation': 2}
+    assert not os.path.exists(journal_path + '.tmp')
@@ -0,0 +1,66 @@
+import os
+import json
+import pytest
+import tempfile
+from src.data import load_query_data
+from src.columns import MISSING
+from src.lazy import LazyDataset, build_line_index
+
+@pytest.fixture
+def tsv_path():
+    """Create a TSV file with 50 rows and no trailing newline."""
+    lines = [
+        f"{json.dumps([{'text': f'query{i}'}])}\t{json.dumps({'segment': f's{i % 2}', 'question_intent': f'i{i % 5}'})}"
+        for i in range(50)
+    ]
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    yield path
+    os.remove(path)
+
+def test_build_line_index(tsv_path):
+    """Test the line index records offsets and indexed metadata only."""
+    index = build_line_index(tsv_path)
+    assert len(index) == 50
+    assert index.offsets[0] == 0
+    assert index.offsets[-1] == os.path.getsize(tsv_path)
+    assert index.columns['segment'].values == ['s0', 's1']
+    assert index.columns['sub_intent'].values == [MISSING]
+
+def test_build_line_index_parallel_matches_serial(tsv_path):
+    """Test a parallel index build produces the same offsets and codes."""
+    serial = build_line_index(tsv_path, parallel_threshold=None)
+    parallel = build_line_index(tsv_path, parallel_threshold=0, workers=3)
+    assert parallel.offsets == serial.offsets
+    for field, column in serial.columns.items():
+        assert [column.value(i) for i in range(50)] == [parallel.columns[field].value(i) for i in range(50)]
+
+def test_lazy_dataset_decodes_on_access(tsv_path):
+    """Test rows decode on demand, match the eager loader and stay bounded in the LRU."""
+    dataset = LazyDataset(tsv_path, cache_size=4)
+    eager = load_query_data(tsv_path)
+    assert len(dataset) == 50
+    assert [row.to_dict() for row in dataset] == [row.to_dict() for row in eager]
+    assert len(dataset._cache) == 4
+    assert dataset[-1].query == [{'text': 'query49'}]
+    assert [row.query[0]['text'] for row in dataset[1:3]] == ['query1', 'query2']
+    with pytest.raises(IndexError):
+        dataset[50]
+    dataset.close()
+
+def test_lazy_dataset_empty_file():
+    """Test an empty file yields an empty dataset."""
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    os.close(fd)
+    dataset = LazyDataset(path)
+    assert len(dataset) == 0
+    dataset.close()
+    os.remove(path)
+
+def test_lazy_dataset_query_only(tsv_path):
+    """Test decoding only the query column leaves the row cache untouched."""
+    dataset = LazyDataset(tsv_path)
+    assert dataset.query(7) == [{'text': 'query7'}]
+    assert len(dataset._cache) == 0
+    dataset.close()
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import pytest
+import tempfile
+from src.columns import MISSING
+from src.lazy import build_line_index
+from src.columnar import load_columnar
+from src.parsecache import ParseCache, file_digest, read_snapshot, write_snapshot
+
+@pytest.fixture
+def source_tsv():
+    """Create a TSV file with missing, numeric and structured metadata values."""
+    rows = [
+        ([{'text': 'query1'}], {'segment': 'regular', 'question_intent': 'intent1', 'sub_intent': 'sub1'}),
+        ([{'text': 'quéry2'}], {'segment': 'premium', 'question_intent': 3, 'score': 0.5}),
+        ([{'text': 'query3'}], {'segment': ['a', 'b'], 'question_intent': None, 'sub_intent': 'sub1'})
+    ]
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for query, metadata in rows:
+            f.write(f"{json.dumps(query)}\t{json.dumps(metadata)}\n")
+    yield path
+    os.remove(path)
+
+def test_line_index_snapshot_round_trip(source_tsv, tmp_path):
+    """Test a LineIndex snapshot restores offsets, vocabularies and codes."""
+    index = build_line_index(source_tsv)
+    write_snapshot(str(tmp_path / 'index.lines'), index)
+    loaded = read_snapshot(str(tmp_path / 'index.lines'))
+    assert loaded.offsets == index.offsets
+    for field, column in index.columns.items():
+        assert loaded.columns[field].values == column.values
+        assert loaded.columns[field].codes == column.codes
+    assert loaded.columns['sub_intent'].value(1) is MISSING
+    assert loaded.columns['segment'].code_for(['a', 'b']) == index.columns['segment'].code_for(['a', 'b'])
+
+def test_columnar_snapshot_round_trip(source_tsv, tmp_path):
+    """Test a ColumnarDataset snapshot restores every row."""
+    dataset = load_columnar(source_tsv)
+    write_snapshot(str(tmp_path / 'rows.columnar'), dataset)
+    loaded = read_snapshot(str(tmp_path / 'rows.columnar'))
+    assert loaded.to_dicts() == dataset.to_dicts()
+
+def test_concurrent_snapshot_writes_use_separate_temp_files(source_tsv, tmp_path, monkeypatch):
+    """Test two writers of the same snapshot never share a temp file, and a failed write leaves none behind."""
+    index = build_line_index(source_tsv)
+    opened = []
+    real_fdopen = os.fdopen
+    def fdopen(fd, *args, **kwargs):
+        f = real_fdopen(fd, *args, **kwargs)
+        opened.append(os.readlink(f'/proc/self/fd/{fd}'))
+        if len(opened) == 1:
+            write_snapshot(str(tmp_path / 'index.lines'), index)
+        return f
+    monkeypatch.setattr(os, 'fdopen', fdopen)
+    write_snapshot(str(tmp_path / 'index.lines'), index)
+    assert len(set(opened)) == 2
+    assert sorted(os.listdir(tmp_path)) == ['index.lines']
+    assert read_snapshot(str(tmp_path / 'index.lines')).offsets == index.offsets
+    
+    monkeypatch.setattr(os, 'replace', lambda src, dst: (_ for _ in ()).throw(OSError('disk full')))
+    with pytest.raises(OSError):
+        write_snapshot(str(tmp_path / 'other.lines'), index)
+    assert sorted(os.listdir(tmp_path)) == ['index.lines']
+
+def test_truncated_snapshot_is_a_miss(source_tsv, tmp_path):
+    """Test a damaged snapshot is reported as a miss rather than loaded."""
+    cache = ParseCache(str(tmp_path))
+    digest = file_digest(source_tsv)
+    cache.put(digest, build_line_index(source_tsv))
+    path = tmp_path / f'{digest}.lines'
+    path.write_bytes(path.read_bytes()[:-3])
+    assert cache.get(digest, 'lines', 10) is None
+    assert cache.stats()['misses'] == 1
+
+def test_cache_hits_and_evicts_least_recently_used(source_tsv, tmp_path):
+    """Test hits are counted with the bytes saved and old snapshots are evicted past the budget."""
+    cache = ParseCache(str(tmp_path))
+    index = build_line_index(source_tsv)
+    assert cache.get('aaa', 'lines', 100) is None
+    cache.put('aaa', index)
+    cache.put('bbb', index)
+    past = time.time() - 60
+    os.utime(tmp_path / 'bbb.lines', (past, past))
+    assert cache.get('aaa', 'lines', 100).offsets == index.offsets
+    cache.max_bytes = os.path.getsize(tmp_path / 'aaa.lines') + 1
+    cache.put('ccc', index)
+    assert sorted(os.listdir(tmp_path)) == ['ccc.lines']
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes_saved']) == (1, 1, 100)
+    with pytest.raises(ValueError):
+        cache.get('../x', 'lines', 0)
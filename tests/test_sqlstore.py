@@ -0,0 +1,165 @@
+import os
+import json
+import random
+import shutil
+import pytest
+import tempfile
+from flask import Flask
+from src.data import QueryData
+from src.columns import MISSING, sort_key
+from src.bitmaps import bitmap_to_indices
+from src.store import Dataset, DatasetRegistry
+from src.sqlstore import SQLITE_FILENAME, SqliteDataset, load_sqlite
+from src.utils import generate_charts, filter_bitmap, select_rows
+
+@pytest.fixture
+def rows():
+    """Random rows over a small vocabulary, some with missing or numeric fields."""
+    rng = random.Random(11)
+    result = []
+    for i in range(300):
+        metadata = {'segment': rng.choice(['Regular', ' premium ', 'trial']),
+                    'question_intent': rng.choice(['billing', 'Billing-Refund', 'login', None, 3]),
+                    'score': i % 7}
+        if i % 7:
+            metadata['sub_intent'] = rng.choice(['sub1', 'sub2', 'other'])
+        result.append(QueryData([{'text': f'Query {i}'}], metadata))
+    return result
+
+@pytest.fixture
+def datasets(rows):
+    """The same rows as an in-memory Dataset and a SqliteDataset."""
+    folder = tempfile.mkdtemp()
+    source_path = os.path.join(folder, 'source.tsv')
+    with open(source_path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(f"{json.dumps(row.query)}\t{json.dumps(row.metadata)}\n")
+    db_path = os.path.join(folder, SQLITE_FILENAME)
+    assert load_sqlite(source_path, db_path) == len(rows)
+    dataset = SqliteDataset('test', db_path)
+    yield Dataset('test', rows), dataset
+    dataset.close()
+    shutil.rmtree(folder, ignore_errors=True)
+
+@pytest.fixture
+def app_logger():
+    """A Flask app to log chart generation to."""
+    return Flask(__name__)
+
+SEARCHES = [
+    {'question_intent': 'billing', 'sub_intent': '', 'segment': ''},
+    {'question_intent': 'none', 'sub_intent': 'sub', 'segment': 'prem'},
+    {'question_intent': '', 'sub_intent': 'missing', 'segment': ''},
+    {'question_intent': '', 'sub_intent': '', 'segment': ''}
+]
+
+SORT_SPECS = [[], [('question_intent', False)], [('segment', True), ('sub_intent', False)], [('score', True)]]
+
+def test_rows_round_trip(rows, datasets):
+    """Test rows read back from the database equal the loaded rows."""
+    _, dataset = datasets
+    assert len(dataset) == len(rows)
+    assert [row.to_dict() for row in dataset] == [row.to_dict() for row in rows]
+    assert dataset[-1].to_dict() == rows[-1].to_dict()
+    assert [row.to_dict() for row in dataset[5:8]] == [row.to_dict() for row in rows[5:8]]
+    with pytest.raises(IndexError):
+        dataset[len(rows)]
+
+def test_filter_and_sort_match_filter_index(datasets):
+    """Test SQL filtering, sorted pages and keyset positions match the in-memory indexes."""
+    memory, dataset = datasets
+    memory.column('score')
+    for params in SEARCHES:
+        bits = dataset.filter_index.match(params)
+        memory_bits = memory.filter_index.match(params)
+        assert bits == memory_bits
+        for sort_spec in SORT_SPECS:
+            for field, _ in sort_spec:
+                memory.filter_index.ensure_field(field)
+            order = memory.filter_index.select_sorted(memory_bits, sort_spec)
+            assert dataset.filter_index.select_sorted(bits, sort_spec) == order
+            assert dataset.filter_index.select_sorted(bits, sort_spec, 3, 9) == order[3:9]
+            assert dataset.filter_index.select_sorted(memory_bits, sort_spec, 3, 9) == order[3:9]
+            for position in [0, len(order) // 2]:
+                if position >= len(order):
+                    continue
+                last = order[position]
+                keys = [sort_key(memory[last].metadata.get(field, MISSING)) for field, _ in sort_spec]
+                after = dataset.filter_index.after(bits, sort_spec, keys, last)
+                assert after == memory.filter_index.after(memory_bits, sort_spec, keys, last)
+                assert dataset.filter_index.select_sorted(after, sort_spec, 0, 5) == order[position + 1:position + 6]
+
+def test_filtered_page_is_one_query(datasets):
+    """Test a sorted page of search results, and of the rows after a cursor, each run as a single query."""
+    memory, dataset = datasets
+    params = {'question_intent': 'billing', 'sub_intent': '', 'segment': '', 'text': 'query 1'}
+    sort_spec = [('segment', True), ('sub_intent', False)]
+    expected = select_rows(memory, filter_bitmap(memory, params), sort_spec, 0, 100)
+    bits = filter_bitmap(dataset, params)
+    statements = []
+    dataset._connection().set_trace_callback(statements.append)
+    assert select_rows(dataset, bits, sort_spec, 2, 5) == expected[2:5]
+    assert len(statements) == 1
+    keys = [sort_key(memory[expected[1]].metadata.get(field, MISSING)) for field, _ in sort_spec]
+    statements.clear()
+    after = dataset.filter_index.after(bits, sort_spec, keys, expected[1])
+    assert select_rows(dataset, after, sort_spec, 0, 2) == expected[2:4]
+    assert len(statements) == 1
+    assert 'ORDER BY' in statements[0] and 'LIMIT' in statements[0]
+
+def test_text_match(datasets):
+    """Test text search matches the trigram index."""
+    memory, dataset = datasets
+    for term in ['query 1', ' QUERY 29', 'y', 'missing']:
+        assert dataset.text_index.match(term) == memory.text_index.match(term)
+
+def test_chart_counts(app_logger, datasets):
+    """Test chart counts pushed down to SQL equal the in-memory counts, with and without a filter."""
+    memory, dataset = datasets
+    chart_spec = {'pie': 'segment', 'bar': 'question_intent', 'stack': 'score'}
+    for params in SEARCHES[:2] + [{'question_intent': '', 'sub_intent': '', 'segment': '', 'text': 'query 1'}]:
+        assert generate_charts(dataset, app_logger, chart_spec, params) == generate_charts(memory, app_logger, chart_spec, params)
+
+def test_apply_changes(rows, datasets):
+    """Test each change operation is written to the database and bumps the version."""
+    _, dataset = datasets
+    assert dataset.apply({'op': 'update', 'index': 4, 'row': {'query': [], 'metadata': {'segment': 'Enterprise'}}}) == 1
+    assert dataset.apply({'op': 'append', 'row': {'query': [{'text': 'new'}], 'metadata': {'segment': 'enterprise'}}}) == 2
+    assert dataset.apply({'op': 'extend', 'rows': [{'query': [], 'metadata': {}}] * 2}) == 3
+    assert dataset.apply({'op': 'assign', 'indices': [0, 1], 'metadata': {'sub_intent': 'moved'}}) == 4
+    assert len(dataset) == len(rows) + 3
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'enterprise'}
+    assert bitmap_to_indices(dataset.filter_index.match(params)) == [4, len(rows)]
+    assert dataset[0].metadata == dict(rows[0].metadata, sub_intent='moved')
+    assert dataset.rows_differing([0, 1, 2], {'sub_intent': 'moved'}) == [2]
+    with pytest.raises(ValueError):
+        dataset.apply({'op': 'unknown'})
+    assert dataset.version == 4
+
+def test_registry_uses_sqlite_storage(rows):
+    """Test a second registry opens the database and sees changes recorded through the first."""
+    app = Flask(__name__)
+    app.config['DATASET_FOLDER'] = tempfile.mkdtemp()
+    app.config['DATASET_STORAGE'] = 'sqlite'
+    try:
+        fd, path = tempfile.mkstemp(suffix='.tsv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for row in rows[:10]:
+                f.write(f"{json.dumps(row.query)}\t{json.dumps(row.metadata)}\n")
+        registry, other = DatasetRegistry(app), DatasetRegistry(app)
+        assert registry.new_sink() is None
+        dataset = registry.create(path)
+        assert isinstance(dataset, SqliteDataset)
+        assert os.path.exists(os.path.join(app.config['DATASET_FOLDER'], dataset.dataset_id, SQLITE_FILENAME))
+        reader = other.get(dataset.dataset_id)
+        assert len(reader) == 10
+        assert registry.append_row(dataset, QueryData([], {'segment': 'new'})) == 1
+        assert registry.compact(dataset.dataset_id) is None
+        reader = other.get(dataset.dataset_id, 1)
+        assert reader.version == 1
+        assert reader[10].metadata == {'segment': 'new'}
+        other.drop(dataset.dataset_id)
+        registry.drop(dataset.dataset_id)
+        assert registry.get(dataset.dataset_id) is None
+    finally:
+        shutil.rmtree(app.config['DATASET_FOLDER'], ignore_errors=True)
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import shutil
+import pytest
+import tempfile
+from flask import Flask
+from src.data import QueryData
+from src.store import Dataset, DatasetRegistry, SOURCE_FILENAME, CHANGES_FILENAME, BASE_FILENAME, BASES_DIRNAME
+from src.columns import MISSING
+from src.columnar import ColumnarDataset
+
+@pytest.fixture
+def app():
+    """Create a Flask app with a temporary dataset folder."""
+    app = Flask(__name__)
+    app.config['DATASET_FOLDER'] = tempfile.mkdtemp()
+    yield app
+    shutil.rmtree(app.config['DATASET_FOLDER'], ignore_errors=True)
+
+@pytest.fixture
+def source_tsv():
+    """Create a TSV file with 2 rows."""
+    rows = [
+        ([{'text': 'query1'}], {'segment': 'regular', 'question_intent': 'intent1', 'sub_intent': 'sub1'}),
+        ([{'text': 'query2'}], {'segment': 'premium', 'question_intent': 'intent2', 'sub_intent': 'sub2'})
+    ]
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for query, metadata in rows:
+            f.write(f"{json.dumps(query)}\t{json.dumps(metadata)}\n")
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+def create_dataset(registry, path):
+    """Register a TSV file."""
+    return registry.create(path)
+
+def test_create_takes_ownership_of_source(app, source_tsv):
+    """Test create moves the source file into the shared base folder."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    assert not os.path.exists(source_tsv)
+    with open(os.path.join(app.config['DATASET_FOLDER'], dataset.dataset_id, BASE_FILENAME)) as f:
+        digest = f.read()
+    assert os.listdir(os.path.join(app.config['DATASET_FOLDER'], BASES_DIRNAME)) == [f'{digest}.tsv']
+    assert len(dataset) == 2
+    assert dataset.version == 0
+
+def test_get_returns_same_handle(app, source_tsv):
+    """Test get returns the cached handle without copying rows."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    assert registry.get(dataset.dataset_id) is dataset
+    assert registry.get('missing') is None
+    assert registry.get('../etc') is None
+
+def test_dataset_is_read_only(app, source_tsv):
+    """Test the handle does not support item assignment."""
+    dataset = create_dataset(DatasetRegistry(app), source_tsv)
+    with pytest.raises(TypeError):
+        dataset[0] = QueryData([], {})
+
+def test_update_and_append_bump_version(app, source_tsv):
+    """Test row mutations are applied in place and bump the version."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    assert registry.update_row(dataset, 1, QueryData([{'text': 'edited'}], {'segment': 'new'})) == 1
+    assert registry.append_row(dataset, QueryData([{'text': 'added'}], {'segment': 'regular'})) == 2
+    assert dataset[1].query == [{'text': 'edited'}]
+    assert dataset[2].metadata == {'segment': 'regular'}
+    with pytest.raises(IndexError):
+        registry.update_row(dataset, 10, QueryData([], {}))
+
+def test_other_worker_rebuilds_and_catches_up(app, source_tsv):
+    """Test a second registry rebuilds from disk and replays later changes."""
+    registry = DatasetRegistry(app)
+    other = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    
+    replica = other.get(dataset.dataset_id, 1)
+    assert replica.version == 1
+    assert replica[0].query == [{'text': 'edited'}]
+    
+    version = registry.append_row(dataset, QueryData([{'text': 'added'}], {}))
+    assert len(other.get(dataset.dataset_id, version)) == 3
+
+def test_eviction_and_drop(app, source_tsv):
+    """Test evicted datasets reload from disk and dropped ones are gone."""
+    registry = DatasetRegistry(app, max_datasets=1)
+    dataset = create_dataset(registry, source_tsv)
+    registry._datasets.clear()
+    reloaded = registry.get(dataset.dataset_id)
+    assert reloaded is not dataset
+    assert len(reloaded) == 2
+    registry.drop(dataset.dataset_id)
+    assert registry.get(dataset.dataset_id) is None
+
+def test_eviction_closes_dataset(app, source_tsv):
+    """Test a dataset evicted past max_datasets releases its handles."""
+    registry = DatasetRegistry(app, max_datasets=1)
+    first = create_dataset(registry, source_tsv)
+    registry.update_row(first, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    assert first._journal is not None
+    with open(first.source_path, 'rb') as f:
+        content = f.read()
+    with open(source_tsv, 'wb') as f:
+        f.write(content + b'[{"text": "query3"}]\t{"segment": "regular"}\n')
+    second = create_dataset(registry, source_tsv)
+    assert first._journal is None
+    assert registry.get(first.dataset_id)[0].query == [{'text': 'edited'}]
+    assert registry.get(second.dataset_id) is not None
+
+def test_columns_follow_changes(app, source_tsv):
+    """Test the indexed metadata columns reflect edited and added rows."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'premium'}))
+    registry.append_row(dataset, QueryData([{'text': 'added'}], {'question_intent': 'intent3'}))
+    segments = dataset.columns['segment']
+    assert [segments.value(i) for i in range(3)][:2] == ['premium', 'premium']
+    assert dataset.columns['question_intent'].value(2) == 'intent3'
+    assert [row.query[0]['text'] for row in dataset[-2:]] == ['query2', 'added']
+
+def test_create_rejects_invalid_file(app):
+    """Test an unparseable source raises ValueError and registers nothing."""
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write("single_column\n")
+    registry = DatasetRegistry(app)
+    with pytest.raises(ValueError, match="Invalid line format"):
+        registry.create(path)
+    assert os.listdir(app.config['DATASET_FOLDER']) == [BASES_DIRNAME]
+    assert os.listdir(os.path.join(app.config['DATASET_FOLDER'], BASES_DIRNAME)) == []
+
+def test_datasets_of_the_same_file_share_their_base(app, source_tsv):
+    """Test uploads of the same bytes share one stored file and base, with changes kept per dataset."""
+    with open(source_tsv, 'rb') as f:
+        content = f.read()
+    registry = DatasetRegistry(app)
+    first = create_dataset(registry, source_tsv)
+    with open(source_tsv, 'wb') as f:
+        f.write(content)
+    second = create_dataset(registry, source_tsv)
+    assert second._base is first._base
+    assert len(os.listdir(os.path.join(app.config['DATASET_FOLDER'], BASES_DIRNAME))) == 1
+    
+    registry.update_row(first, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    registry.append_row(second, QueryData([{'text': 'added'}], {'segment': 'new'}))
+    assert second[0].query == [{'text': 'query1'}]
+    assert second.columns['segment'].value(0) == 'regular'
+    assert first.columns['segment'].value(0) == 'new'
+    assert len(first) == 2 and len(second) == 3
+    
+    registry.drop(first.dataset_id)
+    assert [row.query[0]['text'] for row in second] == ['query1', 'query2', 'added']
+    reloaded = DatasetRegistry(app).get(second.dataset_id)
+    assert [row.query[0]['text'] for row in reloaded] == ['query1', 'query2', 'added']
+
+def test_pinned_dataset_shares_warm_indexes(app, source_tsv):
+    """Test datasets of a pinned file start from its indexes without ever adding to them."""
+    registry = DatasetRegistry(app)
+    pinned = registry.pin(source_tsv)
+    assert os.path.exists(source_tsv)
+    assert set(pinned._indexes) == {'filter', 'text', 'charts'}
+    dataset = create_dataset(registry, source_tsv)
+    assert dataset._base is pinned._base
+    assert dataset.text_index is pinned.text_index
+    assert dataset.filter_index.bitmaps['segment'][0] is pinned.filter_index.bitmaps['segment'][0]
+    assert dataset.columns['segment'] is pinned.columns['segment']
+    
+    dataset.column('score')
+    dataset.filter_index.ensure_field('score')
+    dataset.filter_index.select_sorted(dataset.filter_index.match({}), [('score', True)])
+    dataset.chart_aggregates.value_counts('score')
+    assert 'score' not in pinned.columns
+    assert 'score' not in pinned.filter_index.bitmaps and 'score' not in pinned.filter_index._groups
+    assert 'score' not in pinned.chart_aggregates.counts
+    
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'premium'}))
+    assert dataset.text_index is not pinned.text_index
+    assert dataset.text_index.search('edited') == [0]
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'premium'}
+    assert dataset.filter_index.match(params) == 0b11
+    assert pinned.filter_index.match(params) == 0b10
+    assert pinned.text_index.search('edited') == []
+    assert pinned.columns['segment'].value(0) == 'regular'
+
+def test_memory_storage_mode(app, source_tsv):
+    """Test DATASET_STORAGE='memory' keeps rows in a ColumnarDataset."""
+    app.config['DATASET_STORAGE'] = 'memory'
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    assert isinstance(dataset._base, ColumnarDataset)
+    registry.update_row(dataset, 1, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    assert dataset[1].query == [{'text': 'edited'}]
+    assert dataset[0].to_dict()['metadata']['segment'] == 'regular'
+    assert len(DatasetRegistry(app).get(dataset.dataset_id, 1)) == 2
+
+def test_dataset_column_built_on_demand():
+    """Test columns of other metadata fields are built on first use and follow changes."""
+    rows = [QueryData([], {'segment': 'a', 'score': 3}), QueryData([], {'segment': 'b'})]
+    dataset = Dataset('test', rows)
+    column = dataset.column('score')
+    assert [column.value(i) for i in range(2)] == [3, MISSING]
+    dataset._apply_change({'op': 'append', 'row': {'query': [], 'metadata': {'score': 1}}})
+    assert column.value(2) == 1
+    assert dataset.column('score') is column
+
+def test_export_runs_copy_unedited_spans(app, source_tsv):
+    """Test export_runs yields byte spans for unedited rows and rows for edited and added ones."""
+    with open(source_tsv, 'a', encoding='utf-8') as f:
+        f.write('[{"text": "query3"}]\t{"segment": "regular"}')
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 1, QueryData([{'text': 'edited'}], {'segment': 'premium'}))
+    registry.append_row(dataset, QueryData([{'text': 'added'}], {'segment': 'regular'}))
+    runs = list(dataset.export_runs())
+    assert isinstance(runs[0], tuple)
+    assert dataset.source_bytes(*runs[0]).startswith(b'[{"text": "query1"}]')
+    assert [run.query[0]['text'] for run in runs[1:]] == ['edited', 'query3', 'added']
+    assert list(Dataset('plain', [QueryData([], {})]).export_runs())[0].query == []
+
+def test_update_row_keeps_derived_indexes(app, source_tsv):
+    """Test a single-row edit updates built indexes in place instead of rebuilding them."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    filter_index, text_index, aggregates = dataset.filter_index, dataset.text_index, dataset.chart_aggregates
+    segment_bits = filter_index.bitmaps['segment'][dataset.columns['segment'].code_for('regular')]
+    assert aggregates.value_counts('question_intent')['intent1'] == 1
+    version = registry.update_row(dataset, 0, QueryData([{'text': 'renamed'}], {
+        'segment': 'regular', 'question_intent': 'intent2', 'sub_intent': 'sub1'}))
+    assert version == dataset.version == 1
+    assert dataset.filter_index is filter_index and dataset.text_index is text_index
+    assert dataset.chart_aggregates is aggregates
+    assert filter_index.bitmaps['segment'][dataset.columns['segment'].code_for('regular')] is segment_bits
+    assert filter_index.match({'question_intent': 'intent2'}) == 0b11
+    assert text_index.search('renamed') == [0]
+    assert aggregates.value_counts('question_intent') == {'intent2': 2}
+
+def test_journal_replay_skips_torn_record(app, source_tsv):
+    """Test a record half-written by a crashed worker is dropped on reload and overwritten."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    with open(os.path.join(app.config['DATASET_FOLDER'], dataset.dataset_id, CHANGES_FILENAME), 'ab') as f:
+        f.write(b'{"op": "append", "row": {"qu')
+    restarted = DatasetRegistry(app)
+    reloaded = restarted.get(dataset.dataset_id)
+    assert reloaded.version == 1
+    assert reloaded[0].query == [{'text': 'edited'}]
+    assert restarted.append_row(reloaded, QueryData([{'text': 'added'}], {})) == 2
+    assert len(DatasetRegistry(app).get(dataset.dataset_id)) == 3
+
+def test_compact_folds_journal_into_snapshot(app, source_tsv):
+    """Test compaction starts a new generation that reloads, keeps indexes and accepts changes."""
+    registry = DatasetRegistry(app)
+    other = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    stale = other.get(dataset.dataset_id)
+    filter_index = dataset.filter_index
+    assert registry.compact(dataset.dataset_id) == 1
+    
+    current = registry.get(dataset.dataset_id)
+    assert current.generation == 1 and current.version == 1
+    assert current.filter_index is filter_index
+    assert current[0].query == [{'text': 'edited'}]
+    version = registry.append_row(dataset, QueryData([{'text': 'added'}], {'segment': 'regular'}))
+    assert version == 2
+    
+    assert registry.compact(dataset.dataset_id) == 2
+    assert not os.path.exists(os.path.join(app.config['DATASET_FOLDER'], dataset.dataset_id, SOURCE_FILENAME))
+    assert other.update_row(stale, 1, QueryData([{'text': 'late'}], {})) == 3
+    reloaded = DatasetRegistry(app).get(dataset.dataset_id)
+    assert (reloaded.generation, reloaded.version) == (2, 3)
+    assert [row.query[0]['text'] for row in reloaded] == ['edited', 'late', 'added']
+
+def test_compact_keeps_edited_last_row_without_newline(app, source_tsv):
+    """Test compacting an edit of a last row with no final newline neither duplicates nor loses rows."""
+    with open(source_tsv, 'a', encoding='utf-8') as f:
+        f.write('[{"text": "query3"}]\t{"segment": "regular"}')
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 2, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    assert registry.compact(dataset.dataset_id) == 1
+    
+    expected = ['query1', 'query2', 'edited']
+    current = registry.get(dataset.dataset_id)
+    assert [row.query[0]['text'] for row in current] == expected
+    reloaded = DatasetRegistry(app).get(dataset.dataset_id)
+    assert [row.query[0]['text'] for row in reloaded] == expected
+    assert reloaded[2].metadata == {'segment': 'new'}
+
+def test_compaction_triggered_by_journal_size(app, source_tsv):
+    """Test recording past JOURNAL_COMPACT_BYTES compacts in the background."""
+    app.config['JOURNAL_COMPACT_BYTES'] = 1
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.update_row(dataset, 0, QueryData([{'text': 'edited'}], {'segment': 'new'}))
+    for _ in range(100):
+        if not registry._compacting:
+            break
+        time.sleep(0.05)
+    assert registry.get(dataset.dataset_id).generation == 1
+
+def test_append_rows_is_one_change(app, source_tsv):
+    """Test a batch append bumps the version once and updates built indexes."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    filter_index, aggregates = dataset.filter_index, dataset.chart_aggregates
+    dataset.text_index
+    rows = [QueryData([{'text': f'bulk{i}'}], {'segment': 'bulk' if i % 2 else 'regular'}) for i in range(5)]
+    assert registry.append_rows(dataset, rows) == 1
+    assert len(dataset) == 7
+    assert filter_index.match({'segment': 'bulk'}) == 0b0101000
+    assert filter_index.match({'segment': 'regular'}) == 0b1010101
+    assert dataset.text_index.search('bulk3') == [5]
+    assert aggregates.value_counts('segment') == {'regular': 4, 'premium': 1, 'bulk': 2}
+    assert len(DatasetRegistry(app).get(dataset.dataset_id)) == 7
+
+def test_assign_metadata_is_one_change(app, source_tsv):
+    """Test a bulk metadata edit records one change, skips unchanged rows and updates built indexes."""
+    registry = DatasetRegistry(app)
+    dataset = create_dataset(registry, source_tsv)
+    registry.append_row(dataset, QueryData([{'text': 'added'}], {'segment': 'trial'}))
+    filter_index, aggregates = dataset.filter_index, dataset.chart_aggregates
+    pairs = aggregates.pair_map('segment', 'sub_intent')
+    
+    assert registry.assign_metadata(dataset, [0, 1, 2], {'segment': 'premium', 'sub_intent': 'moved'}) == (3, 2)
+    assert registry.assign_metadata(dataset, [0, 1], {'segment': 'premium'}) == (0, 2)
+    assert dataset[0].query == [{'text': 'query1'}]
+    assert dataset[0].metadata == {'segment': 'premium', 'question_intent': 'intent1', 'sub_intent': 'moved'}
+    assert dataset[2].metadata == {'segment': 'premium', 'sub_intent': 'moved'}
+    assert filter_index.match({'segment': 'premium'}) == 0b111
+    assert filter_index.match({'segment': 'regular'}) == 0
+    assert aggregates.value_counts('segment') == {'premium': 3}
+    assert aggregates.pair_map('segment', 'sub_intent') == {'premium': {'moved': 3}}
+    assert pairs != aggregates.pair_map('segment', 'sub_intent')
+    
+    assert registry.assign_metadata(dataset, [1], {'question_intent': 'intent9'}) == (1, 3)
+    assert dataset[1].metadata['question_intent'] == 'intent9'
+    assert dataset[1].metadata['sub_intent'] == 'moved'
+    replica = DatasetRegistry(app).get(dataset.dataset_id)
+    assert [row.to_dict() for row in replica] == [row.to_dict() for row in dataset]
@@ -0,0 +1,76 @@
+import random
+import pytest
+from src.data import QueryData
+from src.store import Dataset
+from src.textindex import TrigramIndex, query_text, grams
+from src.utils import filter_indices
+from src.bitmaps import indices_to_bitmap
+
+WORDS = ['reset', 'password', 'refund', 'my', 'order', 'Cancel', 'billing', 'where', 'is']
+
+@pytest.fixture
+def rows():
+    """Rows with random multi-word texts, plus rows without usable text."""
+    rng = random.Random(3)
+    result = [
+        QueryData([{'text': ' '.join(rng.choice(WORDS) for _ in range(5))}], {'segment': rng.choice(['a', 'b'])})
+        for _ in range(300)
+    ]
+    result += [QueryData([], {'segment': 'a'}), QueryData([{'id': 1}], {'segment': 'b'})]
+    return result
+
+def test_query_text():
+    """Test the first turn's text is extracted and other shapes yield ''."""
+    assert query_text([{'text': 'Hello'}, {'text': 'ignored'}]) == 'Hello'
+    assert query_text([]) == ''
+    assert query_text([{'text': 3}]) == ''
+    assert query_text(['not a dict']) == ''
+    assert grams('abcd') == {'abc', 'bcd'}
+
+def test_search_matches_scan(rows):
+    """Test trigram search returns exactly the rows a substring scan finds."""
+    index = TrigramIndex((row.query for row in rows), lambda i: rows[i].query)
+    texts = [query_text(row.query).lower() for row in rows]
+    for term in ['refund', 'cancel my', 'D BILL', 'my', 'zzz', 'password reset password', ' ', 'e', 'der']:
+        expected = [i for i, text in enumerate(texts) if term.strip().lower() in text]
+        assert index.search(term) == expected
+        within = indices_to_bitmap(range(0, len(rows), 2), len(rows))
+        assert index.search(term, within) == [i for i in expected if i % 2 == 0]
+
+def test_search_after_edits(rows):
+    """Test edited and appended rows are found by their new text only, and old postings are removed."""
+    rows = list(rows)
+    index = TrigramIndex((row.query for row in rows), lambda i: rows[i].query)
+    
+    def edit(i, text):
+        index.row_changing(i)
+        if i == len(rows):
+            rows.append(None)
+        rows[i] = QueryData([{'text': text}], {})
+        index.row_changed(i, {}, rows[i])
+    before = index.search('refund')
+    edit(before[0], 'something else')
+    edit(len(rows), 'Partial refund please')
+    assert index.search('refund') == before[1:] + [len(rows) - 1]
+    assert before[0] not in index.postings['ref']
+    edit(5, 'quite unique')
+    edit(5, 'ok')
+    assert index.search('quite uniq') == [] and 'qui' not in index.postings
+    assert index.search('ok') == [5]
+    edit(5, 'quite unique')
+    assert index.search('quite uniq') == [5]
+    assert index.short.get(5) is None
+
+def test_text_filter_combines_with_metadata(rows):
+    """Test the dataset's text filter intersects the metadata filter and follows changes."""
+    dataset = Dataset('test', rows)
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'a', 'text': 'order is'}
+    expected = [i for i, row in enumerate(rows)
+                if row.metadata['segment'] == 'a' and 'order is' in query_text(row.query).lower()]
+    assert expected and filter_indices(dataset, params) == expected
+    dataset._apply_change({'op': 'append', 'row': {'query': [{'text': 'ORDER IS late'}], 'metadata': {'segment': 'a'}}})
+    assert filter_indices(dataset, params)[-1] == len(rows)
+    first = filter_indices(dataset, params)[0]
+    dataset._apply_change({'op': 'update', 'index': first, 'row': {'query': [{'text': 'nothing here'}], 'metadata': {'segment': 'a'}}})
+    assert first not in filter_indices(dataset, params)
+    assert dataset.text_index.search('nothing here') == [first]
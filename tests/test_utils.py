@@ -6,11 +6,14 @@ import json
 from flask import Flask, session
 from src.utils import (
     ensure_folders_exist, load_file, reset_session_and_globals,
-    get_search_params, filter_data, sort_data, prepare_table_data,
-    get_sort_indicators, generate_charts, process_form_fields,
-    save_data_to_file, append_data_to_file, get_file_paths
+    get_search_params, filter_data, sort_data, filter_indices, filter_bitmap, select_rows, prepare_table_data,
+    get_filtered_view, view_rows, get_page_window,
+    parse_sort_spec, format_sort_spec, get_sort_links, get_sort_indicators, generate_charts, process_form_fields,
+    iter_tsv, gzip_chunks, save_data_to_file, append_data_to_file, get_file_paths
 )
 from src.data import QueryData
+from src.store import Dataset
+from src.cache import ResultCache
 
 @pytest.fixture
 def app():
@@ -59,8 +62,6 @@ def test_reset_session_and_globals(app):
         reset_session_and_globals()
         assert session['data_loaded'] is True
         assert session['has_added_data'] is False
-        assert session['sort_column'] is None
-        assert session['sort_reverse'] is False
 
 def test_get_search_params(app):
     """Test get_search_params extracts query args."""
@@ -69,7 +70,8 @@ def test_get_search_params(app):
         assert params == {
             'question_intent': 'intent1',
             'sub_intent': 'sub1',
-            'segment': ''
+            'segment': '',
+            'text': ''
         }
 
 def test_filter_data(app, sample_data):
@@ -80,12 +82,27 @@ def test_filter_data(app, sample_data):
     assert filtered[0].metadata['question_intent'] == 'intent1'
 
 def test_sort_data(app, sample_data):
-    """Test sort_data sorts by column."""
-    with app.test_request_context():
-        sorted_data = sort_data(sample_data, 'Question Intent', app)
-        assert sorted_data[0].metadata['question_intent'] == 'intent1'
-        assert session['sort_column'] == 'Question Intent'
-        assert session['sort_reverse'] is False
+    """Test sort_data sorts by a field in either direction."""
+    sorted_data = sort_data(sample_data, [('question_intent', False)])
+    assert sorted_data[0].metadata['question_intent'] == 'intent1'
+    sorted_data = sort_data(sample_data, [('question_intent', True)])
+    assert sorted_data[0].metadata['question_intent'] == 'intent2'
+
+def test_parse_sort_spec():
+    """Test sort parameters parse into (field, reverse) pairs."""
+    assert parse_sort_spec('') == []
+    assert parse_sort_spec('Question Intent') == [('question_intent', False)]
+    assert parse_sort_spec(' -sub_intent, segment ,,score,-segment') == [
+        ('sub_intent', True), ('segment', False), ('score', False)]
+    assert format_sort_spec(parse_sort_spec('-sub_intent,score')) == '-sub_intent,score'
+    assert parse_sort_spec('-junk,segment,score', {'segment', 'sub_intent'}) == [('segment', False)]
+
+def test_get_sort_links():
+    """Test header links promote a column and flip it when it is already primary."""
+    links = get_sort_links([('question_intent', False), ('sub_intent', False)])
+    assert links['Question Intent'] == '-question_intent,sub_intent'
+    assert links['Sub Intent'] == 'sub_intent,question_intent'
+    assert get_sort_links([('segment', True)])['Segment'] == 'segment'
 
 def test_prepare_table_data(sample_data):
     """Test prepare_table_data formats data for table."""
@@ -99,14 +116,14 @@ def test_prepare_table_data(sample_data):
         'sub_intent': 'sub1'
     }
 
-def test_get_sort_indicators(app):
-    """Test get_sort_indicators returns sort arrows."""
-    with app.test_request_context():
-        session['sort_column'] = 'Question Intent'
-        session['sort_reverse'] = False
-        indicators = get_sort_indicators()
-        assert indicators['Question Intent'] == ' ▲'
-        assert indicators['Sub Intent'] == ''
+def test_get_sort_indicators():
+    """Test get_sort_indicators returns sort arrows, numbered for several keys."""
+    indicators = get_sort_indicators([('question_intent', False)])
+    assert indicators['Question Intent'] == ' ▲'
+    assert indicators['Sub Intent'] == ''
+    indicators = get_sort_indicators([('sub_intent', True), ('question_intent', False)])
+    assert indicators['Sub Intent'] == ' ▼1'
+    assert indicators['Question Intent'] == ' ▲2'
 
 def test_generate_charts(app, sample_data):
     """Test generate_charts produces chart JSON."""
@@ -133,6 +150,37 @@ def test_save_data_to_file(sample_data):
     assert 'query1' in lines[0]
     os.remove(path)
 
+def test_iter_tsv_chunks(sample_data):
+    """Test iter_tsv yields whole lines grouped into chunks that gzip_chunks round-trips."""
+    import gzip
+    chunks = list(iter_tsv(sample_data, chunk_bytes=1))
+    assert len(chunks) == 2
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert list(iter_tsv(sample_data)) == [b''.join(chunks)]
+    assert gzip.decompress(b''.join(gzip_chunks(chunks))) == b''.join(chunks)
+
+def test_save_data_to_file_copies_unchanged_rows(app):
+    """Test exporting a source-backed dataset keeps unedited lines byte for byte."""
+    from src.store import DatasetRegistry
+    app.config['DATASET_FOLDER'] = tempfile.mkdtemp()
+    fd, source = tempfile.mkstemp(suffix='.tsv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write('[{"text":"a"}]\t{"segment":"x"}\n[{"text":"b"}]\t{"segment":"x"}\n[{"text":"c"}]\t{"segment":"x"}\n')
+    registry = DatasetRegistry(app)
+    dataset = registry.create(source)
+    registry.update_row(dataset, 1, QueryData([{'text': 'B'}], {'segment': 'y'}))
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    os.close(fd)
+    save_data_to_file(path, dataset)
+    with open(path, 'rb') as f:
+        exported = f.read()
+    expected = '[{"text":"a"}]\t{"segment":"x"}\n[{"text": "B"}]\t{"segment": "y"}\n[{"text":"c"}]\t{"segment":"x"}\n'
+    assert exported == expected.encode()
+    assert b''.join(iter_tsv(dataset, chunk_bytes=8)) == exported
+    dataset.close()
+    os.remove(path)
+    shutil.rmtree(app.config['DATASET_FOLDER'])
+
 def test_append_data_to_file(sample_data):
     """Test append_data_to_file appends to TSV."""
     fd, path = tempfile.mkstemp(suffix='.tsv')
@@ -150,3 +198,78 @@ def test_get_file_paths(app):
     filename, filepath = get_file_paths('test', 'MODIFIED_FOLDER', app, session_id)
     assert filename == 'test_modified.tsv'
     assert os.path.exists(os.path.dirname(filepath))
+
+def test_filter_indices(sample_data):
+    """Test filtering selects rows whose fields contain each search term, with missing fields as 'Unknown'."""
+    rows = sample_data + [QueryData([{'text': 'query3'}], {'segment': 'regular'})]
+    dataset = Dataset('test', rows)
+    for terms, expected in [
+        ({'question_intent': 'intent1'}, [0]),
+        ({'question_intent': 'intent'}, [0, 1]),
+        ({'segment': 'reg'}, [0, 2]),
+        ({'question_intent': 'unknown'}, [2]),
+        ({'segment': 'reg', 'text': 'query3'}, [2]),
+        ({}, [0, 1, 2])
+    ]:
+        params = dict({'question_intent': '', 'sub_intent': '', 'segment': '', 'text': ''}, **terms)
+        assert filter_indices(dataset, params) == expected
+
+def test_select_rows(sample_data):
+    """Test select_rows pages through a filter bitset in sort order, by any metadata field."""
+    rows = list(reversed(sample_data)) + [QueryData([{'text': 'query3'}], {'segment': 'regular', 'rank': 2})]
+    dataset = Dataset('test', rows)
+    everything = filter_bitmap(dataset, {'question_intent': '', 'sub_intent': '', 'segment': ''})
+    assert select_rows(dataset, everything, [], 0, 3) == [0, 1, 2]
+    assert select_rows(dataset, everything, [('question_intent', False)], 0, 3) == [1, 0, 2]
+    assert select_rows(dataset, everything, [('segment', False), ('question_intent', True)], 1, 3) == [2, 1]
+    assert select_rows(dataset, everything, [('rank', True)], 0, 3) == [0, 1, 2]
+    assert select_rows(dataset, everything, [('rank', False)], 0, 1) == [2]
+
+def test_get_filtered_view(sample_data):
+    """Test views are cached, materialized on reuse and recomputed after a change."""
+    dataset = Dataset('test', sample_data * 3)
+    cache = ResultCache()
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'regular', 'text': ''}
+    sort_spec = [('sub_intent', True)]
+    view = get_filtered_view(dataset, params, sort_spec, cache)
+    assert view.order is None
+    assert view_rows(dataset, view, sort_spec, 1, 3) == [2, 4]
+    assert get_filtered_view(dataset, params, sort_spec, cache) is view
+    assert view.order.tolist() == [0, 2, 4]
+    assert view_rows(dataset, view, sort_spec, 1, 3) == [2, 4]
+    dataset._apply_change({'op': 'append', 'row': sample_data[0].to_dict()})
+    view = get_filtered_view(dataset, params, sort_spec, cache)
+    assert view.count == 4
+    assert cache.stats()['hits'] == 1
+
+def test_get_page_window():
+    """Test the page window keeps the first and last pages and marks gaps."""
+    assert get_page_window(1, 0) == [1]
+    assert get_page_window(2, 3) == [1, 2, 3]
+    assert get_page_window(1, 100) == [1, 2, 3, None, 100]
+    assert get_page_window(50, 100) == [1, None, 48, 49, 50, 51, 52, None, 100]
+    assert get_page_window(97, 100, radius=1) == [1, None, 96, 97, 98, 99, 100]
+
+def test_prepare_table_data_with_indices(sample_data):
+    """Test prepare_table_data reports the original row indices when given."""
+    table_data = prepare_table_data(sample_data, start_idx=10, indices=[7, 3])
+    assert [row['index'] for row in table_data] == [7, 3]
+
+def test_generate_charts_from_columns(app, sample_data):
+    """Test charts built from columns match charts built from rows."""
+    assert generate_charts(Dataset('test', sample_data), app) == generate_charts(sample_data, app)
+
+def test_generate_charts_fields_and_filters(app, sample_data):
+    """Test charts follow the chosen fields, the search filter and the top-K limit."""
+    dataset = Dataset('test', sample_data * 2 + [QueryData([], {'segment': 'trial'})])
+    chart_spec = {'pie': 'sub_intent', 'bar': 'segment', 'stack': 'question_intent', 'top': 1}
+    pie, bar = generate_charts(dataset, app, chart_spec)
+    pie_data = json.loads(pie)
+    assert pie_data['labels'] == ['sub1', 'Other']
+    assert pie_data['datasets'][0]['data'] == [2, 3]
+    params = {'question_intent': '', 'sub_intent': '', 'segment': 'premium', 'text': ''}
+    pie, bar = generate_charts(dataset, app, dict(chart_spec, top=0), params)
+    assert json.loads(pie)['labels'] == ['sub2']
+    bar_data = json.loads(bar)
+    assert bar_data['labels'] == ['premium']
+    assert [(d['label'], d['data']) for d in bar_data['datasets']] == [('intent2', [2])]